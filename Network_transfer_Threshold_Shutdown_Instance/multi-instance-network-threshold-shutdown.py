@@ -1,5 +1,13 @@
+import argparse
+import heapq
+import json
 import requests
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
 
 # Your Linode API token
 API_TOKEN = ""
@@ -7,18 +15,88 @@ API_TOKEN = ""
 # API endpoints
 BASE_URL = "https://api.linode.com/v4"
 LINODES_URL = f"{BASE_URL}/linode/instances"
+EVENTS_URL = f"{BASE_URL}/account/events"
+
+# Concurrency: number of /transfer requests in flight, all sharing one rate limiter
+MAX_WORKERS = 16
+# Linode API rate limit: 800 requests per 2 minutes
+RATE_LIMIT_REQUESTS = 800
+RATE_LIMIT_PERIOD = 120  # seconds
+PAGE_SIZE = 500
+
+# Shutdown executor: concurrent shutdown POSTs, confirmed from batched /account/events polls
+SHUTDOWN_WORKERS = 8
+EVENT_POLL_INTERVAL = 10         # seconds between /account/events polls
+SHUTDOWN_CONFIRM_TIMEOUT = 600   # seconds to wait for linode_shutdown events to finish
+CLOCK_SKEW_ALLOWANCE = timedelta(seconds=60)  # slack between this host's clock and the API's
+
+# Percentage of the quota at which an instance is shut down (100 = the full quota)
+THRESHOLD_PERCENTAGE = 100
+
+# Daemon mode (--daemon): check each instance again based on its forecast time to the threshold
+MIN_CHECK_INTERVAL = 60          # seconds, for instances close to the threshold
+MAX_CHECK_INTERVAL = 4 * 3600    # seconds, for idle instances
+FIRST_RECHECK_INTERVAL = 600     # seconds, second sample needed before a rate can be estimated
+FORECAST_SAFETY_FACTOR = 0.5     # re-check after this fraction of the forecast time to threshold
+SAMPLES_PER_INSTANCE = 6         # recent (time, used) samples kept for the rate estimate
+LIST_REFRESH_INTERVAL = 900      # seconds between instance listings (new/deleted/offline instances)
 
 headers = {
     "Authorization": f"Bearer {API_TOKEN}",
     "Content-Type": "application/json",
 }
 
+#Thread-safe sliding-window rate limiter shared by all worker threads
+class RateLimiter:
+    def __init__(self, max_requests, period):
+        self.max_requests = max_requests
+        self.period = period
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.period:
+                    self.timestamps.popleft()
+                if len(self.timestamps) < self.max_requests:
+                    self.timestamps.append(now)
+                    return
+                wait_time = self.period - (now - self.timestamps[0])
+            time.sleep(wait_time)
+
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+session = requests.Session()
+session.headers.update(headers)
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS + SHUTDOWN_WORKERS))
+
+#Generator over every linode instance: page_size=500, next page prefetched while the current one is processed
+def iter_linodes(x_filter=None):
+    # Stable ordering so instances don't shift between pages while we paginate
+    request_headers = {"X-Filter": json.dumps({"+order_by": "id", "+order": "asc", **(x_filter or {})})}
+
+    def fetch_page(page):
+        rate_limiter.acquire()
+        response = session.get(LINODES_URL, params={"page": page, "page_size": PAGE_SIZE}, headers=request_headers)
+        response.raise_for_status()
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        data = fetch_page(1)
+        pages = data.get('pages', 1)
+        for page in range(1, pages + 1):
+            next_page = prefetcher.submit(fetch_page, page + 1) if page < pages else None
+            yield from data['data']
+            if next_page is not None:
+                data = next_page.result()
+
+#function to retrieve every linode instance (all pages) including its status
+def get_all_linodes():
+    return list(iter_linodes())
+
 def get_all_linode_ids():
-    response = requests.get(LINODES_URL, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    linode_ids = [linode['id'] for linode in data['data']]
-    return linode_ids
+    return [linode['id'] for linode in iter_linodes()]
 
 def get_instance_details(linode_id):
     linode_url = f"{BASE_URL}/linode/instances/{linode_id}"
@@ -28,7 +106,8 @@ def get_instance_details(linode_id):
 
 def get_instance_network_usage(linode_id):
     linode_transfer_url = f"{BASE_URL}/linode/instances/{linode_id}/transfer"
-    response = requests.get(linode_transfer_url, headers=headers)
+    rate_limiter.acquire()
+    response = session.get(linode_transfer_url)
     response.raise_for_status()
     data = response.json()
 
@@ -39,43 +118,302 @@ def get_instance_network_usage(linode_id):
 
 def shutdown_linode(linode_id):
     shutdown_url = f"{BASE_URL}/linode/instances/{linode_id}/shutdown"
-    response = requests.post(shutdown_url, headers=headers)
+    rate_limiter.acquire()
+    response = session.post(shutdown_url)
     response.raise_for_status()
     return response.json()
 
-def main():
-    try:
-        linode_ids = get_all_linode_ids()
-        for linode_id in linode_ids:
+#function to parse Linode API timestamps (UTC, without offset)
+def parse_api_time(value):
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+#Concurrent shutdowns, confirmed by polling linode_shutdown events in batches
+class ShutdownExecutor:
+    def __init__(self, max_workers=SHUTDOWN_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = {}  # linode_id -> shutdown POST not collected yet
+        self.pending = {}  # linode_id -> monotonic deadline for its linode_shutdown event
+        self.issued = {}  # linode_id -> time the shutdown POST was sent
+        self.last_poll = 0
+
+    def submit(self, linode_id):
+        if linode_id not in self.futures and linode_id not in self.pending:
+            self.futures[linode_id] = self.pool.submit(self._shutdown, linode_id)
+
+    def _shutdown(self, linode_id):
+        self.issued[linode_id] = datetime.now(timezone.utc)
+        return shutdown_linode(linode_id)
+
+    def get_shutdown_events(self, since):
+        """All linode_shutdown events created since the given time (newest first, all pages)."""
+        x_filter = {
+            "action": "linode_shutdown",
+            "created": {"+gte": since.strftime("%Y-%m-%dT%H:%M:%S")},
+            "+order_by": "created",
+            "+order": "desc",
+        }
+        events = []
+        page = 1
+        while True:
+            rate_limiter.acquire()
+            response = session.get(EVENTS_URL, params={"page": page, "page_size": 100},
+                                   headers={"X-Filter": json.dumps(x_filter)})
+            response.raise_for_status()
+            data = response.json()
+            events.extend(data['data'])
+            if page >= data.get('pages', 1):
+                return events
+            page += 1
+
+    def busy(self):
+        """True while shutdowns are being sent or waiting for their event."""
+        return bool(self.futures or self.pending)
+
+    def poll_once(self, timeout=SHUTDOWN_CONFIRM_TIMEOUT):
+        """Non-blocking: collect sent shutdowns and check their events once (at most every
+        EVENT_POLL_INTERVAL). Returns {linode_id: seconds to offline or None} for the shutdowns
+        that resolved in this call."""
+        results = {}
+        for linode_id, future in list(self.futures.items()):
+            if not future.done():
+                continue
+            del self.futures[linode_id]
             try:
-                data = get_instance_details(linode_id)
-                print(f"Checking Linode ID: {linode_id}")
+                future.result()
+                self.pending[linode_id] = time.monotonic() + timeout
+            except requests.exceptions.RequestException as e:
+                print(f"Shutdown request failed for Linode ID {linode_id}: {e}")
+                results[linode_id] = None
 
-                # Check if the instance is offline
-                if data['status'] == 'offline':
-                    print("Instance is already offline. No action needed.")
-                    continue
+        if not self.pending or time.monotonic() - self.last_poll < EVENT_POLL_INTERVAL:
+            return results
+        self.last_poll = time.monotonic()
 
-                # Retrieve network_quota and network_used from get_instance_network_usage() function
-                network_quota, network_used = get_instance_network_usage(linode_id)
-                print(f"Current usage: {network_used} Gigabytes. Quota limit: {network_quota} Gigabytes.")
+        since = min(self.issued[linode_id] for linode_id in self.pending) - CLOCK_SKEW_ALLOWANCE
+        try:
+            events = self.get_shutdown_events(since)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to poll events: {e}")
+            events = []
 
-                if network_used >= network_quota:
-                    print("Network quota reached, shutting down Linode.")
-                    shutdown_response = shutdown_linode(linode_id)
-                    print(f"Shutdown initiated:", shutdown_response,"\n")
+        for event in events:
+            linode_id = (event.get('entity') or {}).get('id')
+            if linode_id not in self.pending:
+                continue
+            # An older shutdown of the same instance is no confirmation of this one
+            if parse_api_time(event['created']) < self.issued[linode_id] - CLOCK_SKEW_ALLOWANCE:
+                continue
+            if event['status'] == 'finished':
+                del self.pending[linode_id]
+                # Prefer the API's own duration; fall back to when we observed the event
+                if event.get('duration') is not None:
+                    offline_after = (parse_api_time(event['created']) - self.issued[linode_id]).total_seconds()
+                    results[linode_id] = max(0.0, offline_after) + event['duration']
                 else:
-                    print(f"Usage below quota limit, no action needed.\n")
+                    results[linode_id] = (datetime.now(timezone.utc) - self.issued[linode_id]).total_seconds()
+                print(f"Linode ID {linode_id} is offline after {results[linode_id]:.1f} seconds.")
+            elif event['status'] == 'failed':
+                del self.pending[linode_id]
+                results[linode_id] = None
+                print(f"Shutdown failed for Linode ID {linode_id} (event {event['id']}).")
+
+        for linode_id, deadline in list(self.pending.items()):
+            if time.monotonic() >= deadline:
+                del self.pending[linode_id]
+                results[linode_id] = None
+                print(f"Shutdown of Linode ID {linode_id} not confirmed within {timeout} seconds.")
+        return results
+
+    def wait_for_offline(self, timeout=SHUTDOWN_CONFIRM_TIMEOUT):
+        """Wait until every submitted shutdown finished; returns {linode_id: seconds to offline or None}."""
+        wait(self.futures.values())
+        results = self.poll_once(timeout)
+        while self.busy():
+            time.sleep(EVENT_POLL_INTERVAL)
+            results.update(self.poll_once(timeout))
+        return results
+
+    def close(self):
+        self.pool.shutdown(wait=True)
 
-                # Rate limiting: sleep for 0.15 seconds to stay within the rate limit of 800 requests per 2 minutes
-                time.sleep(0.15)
+#function to print the time-to-offline report
+def print_shutdown_report(results):
+    if not results:
+        return
+    confirmed = {linode_id: seconds for linode_id, seconds in results.items() if seconds is not None}
+    print(f"Shutdown report: {len(confirmed)}/{len(results)} instances confirmed offline.")
+    for linode_id, seconds in sorted(results.items(), key=lambda item: item[0]):
+        status = f"{seconds:.1f} s to offline" if seconds is not None else "not confirmed"
+        print(f"  - Linode ID {linode_id}: {status}")
 
+#function to evaluate one instance's transfer usage against its quota
+def evaluate_instance(linode_id, network_quota, network_used, shutdown_executor=None):
+    print(f"Checking Linode ID: {linode_id}")
+    print(f"Current usage: {network_used} Gigabytes. Quota limit: {network_quota} Gigabytes.")
+
+    if network_used >= network_quota * THRESHOLD_PERCENTAGE / 100:
+        print("Network quota reached, shutting down Linode.")
+        if shutdown_executor is not None:
+            shutdown_executor.submit(linode_id)
+            print("Shutdown queued.\n")
+        else:
+            shutdown_response = shutdown_linode(linode_id)
+            print(f"Shutdown initiated:", shutdown_response,"\n")
+        return True
+    else:
+        print(f"Usage below quota limit, no action needed.\n")
+        return False
+
+def main():
+    # Fetch /transfer concurrently and evaluate each result as soon as it arrives;
+    # shutdowns start immediately on their own pool and are confirmed together at the end
+    shutdown_executor = ShutdownExecutor()
+    scanned = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        try:
+            # Status comes from the listing, so offline instances need no further requests.
+            # Transfer fetches start while later pages are still being listed.
+            for linode in iter_linodes():
+                scanned += 1
+                if linode['status'] == 'offline':
+                    print(f"Linode ID {linode['id']} is already offline. No action needed.")
+                else:
+                    futures[executor.submit(get_instance_network_usage, linode['id'])] = linode['id']
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to retrieve Linode IDs: {e}")
+
+        for future in as_completed(futures):
+            linode_id = futures[future]
+            try:
+                network_quota, network_used = future.result()
+                evaluate_instance(linode_id, network_quota, network_used, shutdown_executor)
             except KeyError as e:
                 print(f"Error for Linode ID {linode_id}: {e}")
             except requests.exceptions.RequestException as e:
                 print(f"HTTP Request failed for Linode ID {linode_id}: {e}")
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to retrieve Linode IDs: {e}")
+
+    print(f"Scanned {scanned} instances ({len(futures)} online).")
+    print_shutdown_report(shutdown_executor.wait_for_offline())
+    shutdown_executor.close()
+
+#Per-instance transfer samples and time-to-threshold forecast
+class TransferForecaster:
+    def __init__(self, threshold_percentage):
+        self.threshold_percentage = threshold_percentage
+        self.samples = {}  # linode_id -> deque of (timestamp, used GB)
+
+    def record(self, linode_id, used, now):
+        history = self.samples.setdefault(linode_id, deque(maxlen=SAMPLES_PER_INSTANCE))
+        if history and used < history[-1][1]:
+            history.clear()  # Usage dropped: a new billing cycle started
+        history.append((now, used))
+
+    def forget(self, linode_id):
+        self.samples.pop(linode_id, None)
+
+    def rate(self, linode_id):
+        """Transfer rate in GB/s over the kept samples, or None with fewer than two samples."""
+        history = self.samples.get(linode_id)
+        if not history or len(history) < 2:
+            return None
+        (first_time, first_used), (last_time, last_used) = history[0], history[-1]
+        if last_time <= first_time:
+            return None
+        return max(0.0, (last_used - first_used) / (last_time - first_time))
+
+    def next_check_delay(self, linode_id, quota, used):
+        """Seconds until this instance should be checked again."""
+        rate = self.rate(linode_id)
+        if rate is None:
+            return FIRST_RECHECK_INTERVAL
+        remaining = quota * self.threshold_percentage / 100 - used
+        if remaining <= 0:
+            return MIN_CHECK_INTERVAL
+        if rate == 0:
+            return MAX_CHECK_INTERVAL
+        delay = remaining / rate * FORECAST_SAFETY_FACTOR
+        return min(MAX_CHECK_INTERVAL, max(MIN_CHECK_INTERVAL, delay))
+
+#Long-running mode: heap of (next check time, linode id) ordered by forecast time to threshold
+def run_daemon():
+    forecaster = TransferForecaster(THRESHOLD_PERCENTAGE)
+    schedule = []          # heap of (due time, linode_id)
+    next_check = {}        # linode_id -> due time of its live heap entry (older entries are stale)
+    known_online = set()   # online instances currently in the schedule
+    next_listing = 0
+
+    def schedule_check(linode_id, due_time):
+        next_check[linode_id] = due_time
+        heapq.heappush(schedule, (due_time, linode_id))
+
+    shutdown_executor = ShutdownExecutor()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while True:
+            now = time.time()
+
+            # Refresh the inventory now and then: schedule new/powered-on instances, drop the rest
+            if now >= next_listing:
+                try:
+                    linodes = get_all_linodes()
+                    online = {linode['id'] for linode in linodes if linode['status'] != 'offline'}
+                    for linode_id in online - known_online:
+                        schedule_check(linode_id, now)
+                    for linode_id in known_online - online:
+                        forecaster.forget(linode_id)
+                        next_check.pop(linode_id, None)
+                    known_online = online
+                    print(f"Inventory refreshed: {len(linodes)} instances, {len(online)} online.")
+                except requests.exceptions.RequestException as e:
+                    print(f"Failed to retrieve Linode IDs: {e}")
+                next_listing = now + LIST_REFRESH_INTERVAL
+
+            # Everything that is due now is fetched concurrently
+            due = []
+            while schedule and schedule[0][0] <= now:
+                due_time, linode_id = heapq.heappop(schedule)
+                if linode_id in known_online and next_check.get(linode_id) == due_time:
+                    due.append(linode_id)
+
+            futures = {executor.submit(get_instance_network_usage, linode_id): linode_id for linode_id in due}
+            for future in as_completed(futures):
+                linode_id = futures[future]
+                try:
+                    network_quota, network_used = future.result()
+                except (KeyError, requests.exceptions.RequestException) as e:
+                    print(f"Check failed for Linode ID {linode_id}: {e}")
+                    schedule_check(linode_id, time.time() + MIN_CHECK_INTERVAL)
+                    continue
+
+                checked_at = time.time()
+                forecaster.record(linode_id, network_used, checked_at)
+                shut_down = evaluate_instance(linode_id, network_quota, network_used, shutdown_executor)
+
+                if shut_down:
+                    # Offline now; the inventory refresh re-adds it if it is powered on again
+                    known_online.discard(linode_id)
+                    forecaster.forget(linode_id)
+                    next_check.pop(linode_id, None)
+                    continue
+                delay = forecaster.next_check_delay(linode_id, network_quota, network_used)
+                print(f"Next check for Linode ID {linode_id} in {delay:.0f} seconds.")
+                schedule_check(linode_id, checked_at + delay)
+
+            # Shutdown confirmations are polled without blocking the scheduled checks
+            print_shutdown_report(shutdown_executor.poll_once())
+
+            next_due = schedule[0][0] if schedule else next_listing
+            if shutdown_executor.busy():
+                next_due = min(next_due, time.time() + EVENT_POLL_INTERVAL)
+            time.sleep(max(1, min(next_due, next_listing) - time.time()))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Shut down Linode instances that reach their network transfer quota.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and schedule each instance's next check from its transfer rate")
+    args = parser.parse_args()
+
+    if args.daemon:
+        run_daemon()
+    else:
+        main()
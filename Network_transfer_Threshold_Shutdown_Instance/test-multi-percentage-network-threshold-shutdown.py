@@ -1,5 +1,12 @@
+import json
+import os
 import requests
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 
 # Your Linode API token
 API_TOKEN = ""
@@ -11,27 +18,102 @@ LINODES_URL = f"{BASE_URL}/linode/instances"
 # Threshold percentage (e.g., 90% of the network quota)
 THRESHOLD_PERCENTAGE = 90
 
+# Tiered policy: every tier fires once per instance per billing cycle, lowest percentage first.
+# Supported actions: "log", "webhook" (POST to WEBHOOK_URL), "shutdown", "delete_public_ip"
+# Tiers above the shutdown tier still fire while the instance is offline (its usage is still
+# checked as long as one of its OFFLINE_ACTIONS tiers has not fired), so the 95% tier below
+# removes the extra public IPs of an instance the 90% tier already shut down.
+THRESHOLD_POLICY = [
+    {"percentage": 70, "action": "log"},
+    {"percentage": 80, "action": "webhook"},
+    {"percentage": THRESHOLD_PERCENTAGE, "action": "shutdown"},
+    {"percentage": 95, "action": "delete_public_ip"},
+]
+
+POLICY_ACTIONS = ("log", "webhook", "shutdown", "delete_public_ip")
+OFFLINE_ACTIONS = ("log", "webhook", "delete_public_ip")  # Actions that still apply to offline instances
+
+# Webhook for the "webhook" action (e.g. Slack/Teams incoming webhook)
+WEBHOOK_URL = ""
+
+# Which tiers already fired for which instance in the current billing cycle
+STATE_FILE = "threshold-policy-state.json"
+
+# Concurrency: usage fetches and actions share one rate limiter
+FETCH_WORKERS = 16
+ACTION_WORKERS = 4
+RATE_LIMIT_REQUESTS = 800  # Linode API rate limit: 800 requests per 2 minutes
+RATE_LIMIT_PERIOD = 120    # seconds
+PAGE_SIZE = 500
+
 headers = {
     "Authorization": f"Bearer {API_TOKEN}",
     "Content-Type": "application/json",
 }
 
+#Thread-safe sliding-window rate limiter shared by all worker threads
+class RateLimiter:
+    def __init__(self, max_requests, period):
+        self.max_requests = max_requests
+        self.period = period
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.period:
+                    self.timestamps.popleft()
+                if len(self.timestamps) < self.max_requests:
+                    self.timestamps.append(now)
+                    return
+                wait_time = self.period - (now - self.timestamps[0])
+            time.sleep(wait_time)
+
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+session = requests.Session()
+session.headers.update(headers)
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS + ACTION_WORKERS))
+
+#Generator over every linode instance: page_size=500, next page prefetched while the current one is processed
+def iter_linodes(x_filter=None):
+    # Stable ordering so instances don't shift between pages while we paginate
+    request_headers = {"X-Filter": json.dumps({"+order_by": "id", "+order": "asc", **(x_filter or {})})}
+
+    def fetch_page(page):
+        rate_limiter.acquire()
+        response = session.get(LINODES_URL, params={"page": page, "page_size": PAGE_SIZE}, headers=request_headers)
+        response.raise_for_status()
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        data = fetch_page(1)
+        pages = data.get('pages', 1)
+        for page in range(1, pages + 1):
+            next_page = prefetcher.submit(fetch_page, page + 1) if page < pages else None
+            yield from data['data']
+            if next_page is not None:
+                data = next_page.result()
+
+#function to retrieve every linode instance (all pages) including its status and IPs
+def get_all_linodes():
+    return list(iter_linodes())
+
 def get_all_linode_ids():
-    response = requests.get(LINODES_URL, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    linode_ids = [linode['id'] for linode in data['data']]
-    return linode_ids
+    return [linode['id'] for linode in iter_linodes()]
 
 def get_instance_details(linode_id):
     linode_url = f"{BASE_URL}/linode/instances/{linode_id}"
-    response = requests.get(linode_url, headers=headers)
+    rate_limiter.acquire()
+    response = session.get(linode_url)
     response.raise_for_status()
     return response.json()
 
 def get_instance_network_usage(linode_id):
     linode_transfer_url = f"{BASE_URL}/linode/instances/{linode_id}/transfer"
-    response = requests.get(linode_transfer_url, headers=headers)
+    rate_limiter.acquire()
+    response = session.get(linode_transfer_url)
     response.raise_for_status()
     data = response.json()
 
@@ -42,47 +124,165 @@ def get_instance_network_usage(linode_id):
 
 def shutdown_linode(linode_id):
     shutdown_url = f"{BASE_URL}/linode/instances/{linode_id}/shutdown"
-    response = requests.post(shutdown_url, headers=headers)
+    rate_limiter.acquire()
+    response = session.post(shutdown_url)
     response.raise_for_status()
     return response.json()
 
-def main():
-    try:
-        linode_ids = get_all_linode_ids()
-        for linode_id in linode_ids:
+#function to remove the extra public IPv4 addresses of an instance
+#The primary (first) public address is kept: the API refuses to delete an instance's last public IPv4
+def delete_public_ips(linode):
+    rate_limiter.acquire()
+    response = session.get(f"{BASE_URL}/linode/instances/{linode['id']}/ips")
+    response.raise_for_status()
+    public = [ip['address'] for ip in response.json()['ipv4']['public']]
+    primary = next((address for address in linode.get('ipv4', []) if address in public), public[0] if public else None)
+
+    deleted = []
+    for address in public:
+        if address == primary:
+            continue
+        rate_limiter.acquire()
+        response = session.delete(f"{BASE_URL}/linode/instances/{linode['id']}/ips/{address}")
+        response.raise_for_status()
+        deleted.append(address)
+    return deleted
+
+#function to notify the configured webhook
+def notify_webhook(linode, usage_percentage, tier_percentage):
+    if not WEBHOOK_URL:
+        # Raise so the tier is not recorded as fired (main() rejects such a policy up front)
+        raise ValueError("WEBHOOK_URL is not set")
+    message = (f"Linode {linode['label']} (ID: {linode['id']}) has used {usage_percentage:.2f}% "
+               f"of its network transfer quota (tier: {tier_percentage}%).")
+    response = requests.post(WEBHOOK_URL, json={"text": message}, timeout=10)
+    response.raise_for_status()
+
+#function to load/save which tiers fired per instance, reset every billing cycle (calendar month, UTC)
+def current_billing_cycle():
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+def load_policy_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        state = json.load(f)
+    if state.get("cycle") != current_billing_cycle():
+        return {}  # New billing cycle, every tier can fire again
+    return state.get("fired", {})
+
+def save_policy_state(fired):
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"cycle": current_billing_cycle(), "fired": fired}, f, indent=2)
+    os.replace(tmp_file, STATE_FILE)
+
+#function to run one tier action for one instance
+def run_action(action, linode, usage_percentage, tier_percentage):
+    linode_id = linode['id']
+    if action == "log":
+        print(f"[{tier_percentage}%] Linode ID {linode_id} is at {usage_percentage:.2f}% of its quota.")
+    elif action == "webhook":
+        notify_webhook(linode, usage_percentage, tier_percentage)
+        print(f"[{tier_percentage}%] Webhook notified for Linode ID {linode_id}.")
+    elif action == "shutdown":
+        shutdown_response = shutdown_linode(linode_id)
+        print(f"[{tier_percentage}%] Shutdown initiated for Linode ID {linode_id}:", shutdown_response)
+    elif action == "delete_public_ip":
+        deleted = delete_public_ips(linode)
+        if deleted:
+            print(f"[{tier_percentage}%] Deleted public IPs {deleted} from Linode ID {linode_id}.")
+        else:
+            print(f"[{tier_percentage}%] Linode ID {linode_id} has no public IPs besides its primary one.")
+    else:
+        raise ValueError(f"Unknown action: {action}")
+
+#function to build the usage table concurrently for the instances selected by should_check(linode)
+def build_usage_table(linodes, should_check):
+    usage_table = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = {executor.submit(get_instance_network_usage, linode['id']): linode
+                   for linode in linodes if should_check(linode)}
+        for future in as_completed(futures):
+            linode = futures[future]
             try:
-                data = get_instance_details(linode_id)
-                print(f"Checking Linode ID: {linode_id}")
-
-                # Check if the instance is offline
-                if data['status'] == 'offline':
-                    print("Instance is already offline. No action needed.")
-                    continue
-
-                # Retrieve network_quota and network_used from get_instance_network_usage() function
-                network_quota, network_used = get_instance_network_usage(linode_id)
-                print(f"Current usage: {network_used} Gigabytes. Quota limit: {network_quota} Gigabytes.")
-
-                # Calculate the percentage of quota used
-                usage_percentage = (network_used / network_quota) * 100
-                print(f"Current usage is {usage_percentage:.2f}% of the quota.")
-
-                if usage_percentage >= THRESHOLD_PERCENTAGE:
-                    print(f"Network usage has reached {THRESHOLD_PERCENTAGE}% of the quota. Shutting down Linode.")
-                    shutdown_response = shutdown_linode(linode_id)
-                    print(f"Shutdown initiated:", shutdown_response, "\n")
-                else:
-                    print(f"Usage below quota limit, no action needed.\n")
-
-                # Rate limiting: sleep for 0.15 seconds to stay within the rate limit of 800 requests per 2 minutes
-                time.sleep(0.15)
-
-            except KeyError as e:
-                print(f"Error for Linode ID {linode_id}: {e}")
+                network_quota, network_used = future.result()
+                usage_table[linode['id']] = (network_used / network_quota) * 100
+            except (KeyError, ZeroDivisionError) as e:
+                print(f"Error for Linode ID {linode['id']}: {e}")
             except requests.exceptions.RequestException as e:
-                print(f"HTTP Request failed for Linode ID {linode_id}: {e}")
+                print(f"HTTP Request failed for Linode ID {linode['id']}: {e}")
+    return usage_table
+
+def main():
+    unknown = [tier['action'] for tier in THRESHOLD_POLICY if tier['action'] not in POLICY_ACTIONS]
+    if unknown:
+        print(f"Unknown actions in THRESHOLD_POLICY: {unknown}")
+        return
+    if not WEBHOOK_URL and any(tier['action'] == "webhook" for tier in THRESHOLD_POLICY):
+        print("THRESHOLD_POLICY has a webhook tier but WEBHOOK_URL is not set.")
+        return
+
+    try:
+        linodes = get_all_linodes()
     except requests.exceptions.RequestException as e:
         print(f"Failed to retrieve Linode IDs: {e}")
+        return
+
+    linodes_by_id = {linode['id']: linode for linode in linodes}
+    tiers = sorted(THRESHOLD_POLICY, key=lambda tier: tier['percentage'])
+    fired = load_policy_state()
+
+    def applicable_tiers(linode):
+        if linode['status'] != 'offline':
+            return tiers
+        return [tier for tier in tiers if tier['action'] in OFFLINE_ACTIONS]
+
+    # Offline instances are only checked while one of their offline tiers has not fired yet
+    def should_check(linode):
+        already_fired = set(fired.get(str(linode['id']), []))
+        return any(tier['percentage'] not in already_fired for tier in applicable_tiers(linode))
+
+    usage_table = build_usage_table(linodes, should_check)
+
+    # One pass over the usage table decides every tier for every instance
+    pending = []
+    for linode_id, usage_percentage in usage_table.items():
+        already_fired = set(fired.get(str(linode_id), []))
+        for tier in applicable_tiers(linodes_by_id[linode_id]):
+            if usage_percentage >= tier['percentage'] and tier['percentage'] not in already_fired:
+                pending.append((linode_id, usage_percentage, tier))
+
+    offline = sum(1 for linode_id in usage_table if linodes_by_id[linode_id]['status'] == 'offline')
+    print(f"Checked {len(usage_table)} instances ({offline} offline), {len(pending)} tier actions to run.")
+
+    # Tiers of one instance run in order; different instances run concurrently.
+    # A failed tier is not recorded (it is retried next run) and never blocks the tiers above it,
+    # so e.g. a webhook outage cannot hold back the shutdown.
+    def run_instance_actions(actions):
+        completed = []
+        for linode_id, usage_percentage, tier in actions:
+            try:
+                run_action(tier['action'], linodes_by_id[linode_id], usage_percentage, tier['percentage'])
+                completed.append(tier['percentage'])
+            except requests.exceptions.RequestException as e:
+                print(f"Action {tier['action']} failed for Linode ID {linode_id}: {e}")
+            except Exception as e:
+                print(f"Action {tier['action']} failed for Linode ID {linode_id}: {type(e).__name__}: {e}")
+        return completed
+
+    actions_by_instance = {}
+    for action in pending:
+        actions_by_instance.setdefault(action[0], []).append(action)
+
+    with ThreadPoolExecutor(max_workers=ACTION_WORKERS) as executor:
+        futures = {executor.submit(run_instance_actions, actions): linode_id
+                   for linode_id, actions in actions_by_instance.items()}
+        for future in as_completed(futures):
+            completed = future.result()
+            if completed:
+                fired.setdefault(str(futures[future]), []).extend(completed)
+                save_policy_state(fired)  # Saved per instance, so a crash later in the run loses nothing
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,12 @@
 import requests
 import csv
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 # Linode API Token
 API_TOKEN = ""
@@ -13,43 +20,84 @@ HEADERS = {
     "Content-Type": "application/json",
 }
 
-# List of LKE Cluster ID
-clusterID = 304292
-
-# Output Table to Store VLAN Addresses
-outputTable = []
-
-
-def api_call(endpoint, method="GET", data=None, params=None):
-    """Helper function to make API calls with pagination handling."""
+# List of LKE Cluster IDs (can also be passed on the command line: python lke-vlan-ip-list-final.py 304292 304293)
+clusterIDs = [304292]
+
+# Output CSV file, written row by row as results arrive
+OUTPUT_FILE = "vlan_ip_addresses.csv"
+FIELDNAMES = [
+    "Cluster",
+    "Node pool",
+    "Worker node ID",
+    "Worker Node Label",
+    "Interface Configuration ID",
+    "VLAN ipam_address",
+]
+
+PAGE_SIZE = 500  # Maximum page size allowed by the Linode API
+MAX_WORKERS = 16  # Concurrent node lookups, all sharing the rate limiter
+RATE_LIMIT_REQUESTS = 800  # Linode API rate limit: 800 requests per minute
+RATE_LIMIT_PERIOD = 60  # Seconds in a minute
+
+# Track request timestamps for rate limiting (sliding window shared by all worker threads)
+request_timestamps = deque()
+rate_limit_lock = threading.Lock()
+
+# One keep-alive session with a connection pool big enough for every worker
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
+
+#rate-limit function
+def enforce_rate_limit():
+    """Wait until another request fits in the RATE_LIMIT_REQUESTS per RATE_LIMIT_PERIOD window."""
+    while True:
+        with rate_limit_lock:
+            current_time = time.monotonic()
+            while request_timestamps and current_time - request_timestamps[0] >= RATE_LIMIT_PERIOD:
+                request_timestamps.popleft()
+            if len(request_timestamps) < RATE_LIMIT_REQUESTS:
+                request_timestamps.append(current_time)
+                return
+            sleep_time = RATE_LIMIT_PERIOD - (current_time - request_timestamps[0])
+
+        # Budget exhausted: sleep outside the lock until the oldest request leaves the window
+        print(f"Rate limit reached, sleeping for {sleep_time:.2f} seconds")
+        time.sleep(sleep_time)
+
+
+def api_call(endpoint, params=None):
+    """Helper function to make rate-limited API calls."""
     url = f"{BASE_URL}{endpoint}"
     try:
-        # Add pagination parameters if available
-        response = requests.get(url, headers=HEADERS, params=params)
+        enforce_rate_limit()
+        response = session.get(url, headers=HEADERS, params=params, timeout=30)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error with API call to {url}: {e}")
         return None
 
+
+def get_all_pages(endpoint):
+    """Fetch every page of a paginated endpoint, following the 'pages' count from the API."""
+    results = []
+    page = 1
+    while True:
+        response = api_call(endpoint, params={"page": page, "page_size": PAGE_SIZE})
+        if isinstance(response, list):  # Some endpoints return a bare list
+            return results + response
+        if not response or "data" not in response:
+            return results
+        results.extend(response["data"])
+        if page >= response.get("pages", 1):
+            return results
+        page += 1
+
 #get the list of nodes from node pools in the mentioned LKE cluster
 def get_pools(cluster_id):
-    """Fetch pools for a given cluster with pagination."""
-    endpoint = f"/lke/clusters/{cluster_id}/pools"
-    pools = []
-    params = {"page": 1, "page_size": 50}  # Start with page 1 and a reasonable page size
-    while True:
-        response = api_call(endpoint, params=params)
-        if response and "data" in response:
-            pools.extend(response["data"])
-            # Check if there's another page
-            if "next" in response:
-                params["page"] += 1
-            else:
-                break
-        else:
-            break
-    return pools
+    """Fetch pools for a given cluster."""
+    return get_all_pages(f"/lke/clusters/{cluster_id}/pools")
 
 
 def get_pool_nodes(pool):
@@ -58,78 +106,74 @@ def get_pool_nodes(pool):
 
 #get the Linode instance configuration
 def get_configs(node_id):
-    """Fetch config IDs for a specific node with pagination."""
-    endpoint = f"/linode/instances/{node_id}/configs"
-    configs = []
-    params = {"page": 1, "page_size": 50}  # Start with page 1 and a reasonable page size
-    while True:
-        response = api_call(endpoint, params=params)
-        if response and "data" in response:
-            configs.extend(response["data"])
-            # Check if there's another page
-            if "next" in response:
-                params["page"] += 1
-            else:
-                break
-        else:
-            break
-    return configs
+    """Fetch configs for a specific node."""
+    return get_all_pages(f"/linode/instances/{node_id}/configs")
 
 # get the Linode instance interface configuration of the nodes
 def get_interfaces(node_id, config_id):
-    """Fetch interfaces for a specific config ID with pagination."""
-    endpoint = f"/linode/instances/{node_id}/configs/{config_id}/interfaces"
-    interfaces = []
-    params = {"page": 1, "page_size": 50}  # Start with page 1 and a reasonable page size
-    while True:
-        response = api_call(endpoint, params=params)
-        if response and isinstance(response, list):
-            interfaces.extend(response)
-            # Check if there's another page (if applicable)
-            if len(response) == params["page_size"]:
-                params["page"] += 1
-            else:
-                break
-        else:
-            break
-    return interfaces
-
-# save the output result in csv format function
-def save_to_csv(data, filename):
-    """Save the data to a CSV file."""
-    with open(filename, mode="w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=data[0].keys())
-        writer.writeheader()
-        writer.writerows(data)
-        print(f"Data has been written to {filename}")
-
-# Main Execution (skip the interfaces that are not for VLANs)
-pools = get_pools(clusterID)
-for pool in pools:
-    pool_nodes = get_pool_nodes(pool)
-    for node in pool_nodes:
-        node_id = node["instance_id"]  # Extract the correct node ID
-        label = node["id"]
-        configs = get_configs(node_id)
-        for config in configs:
+    """Fetch interfaces for a specific config ID."""
+    return get_all_pages(f"/linode/instances/{node_id}/configs/{config_id}/interfaces")
+
+# collect the VLAN rows of one worker node (skip the interfaces that are not for VLANs)
+def get_node_vlan_rows(cluster_id, pool_id, node):
+    """Return the CSV rows for one node's VLAN interfaces."""
+    node_id = node["instance_id"]  # Extract the correct node ID
+    label = node["id"]
+    rows = []
+    for config in get_configs(node_id):
+        # The config payload already lists its interfaces; only ask the interfaces endpoint if it does not
+        interfaces = config.get("interfaces")
+        if interfaces is None:
             interfaces = get_interfaces(node_id, config["id"])
-            for interface in interfaces:
-                if interface.get("purpose") == "vlan":
-                    outputTable.append({
-                        "Cluster": clusterID,
-                        "Node pool": pool["id"],
-                        "Worker node ID": node_id,
-                        "Worker Node Label": "lke" + str(clusterID) + "-" + str(label),
-                        "Interface Configuration ID": interface["id"],
-                        "VLAN ipam_address": interface.get("ipam_address"),
-                    })
-
-# Print Output Table
-for row in outputTable:
-     print(row)
-
-# Save Output Table to CSV
-if outputTable:
-    save_to_csv(outputTable, "vlan_ip_addresses.csv")
-else:
-    print("No data found.")
+        for interface in interfaces:
+            if interface.get("purpose") == "vlan":
+                rows.append({
+                    "Cluster": cluster_id,
+                    "Node pool": pool_id,
+                    "Worker node ID": node_id,
+                    "Worker Node Label": "lke" + str(cluster_id) + "-" + str(label),
+                    "Interface Configuration ID": interface.get("id"),
+                    "VLAN ipam_address": interface.get("ipam_address"),
+                })
+    return rows
+
+# export the VLAN addresses of all clusters, streaming rows to the csv as they arrive
+def export_vlan_addresses(cluster_ids, filename):
+    """Fan out the node lookups of every cluster and write each node's rows as soon as they are ready."""
+    row_count = 0
+    with open(filename, mode="w", newline="") as file, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+
+        pools_by_cluster = dict(zip(cluster_ids, executor.map(get_pools, cluster_ids)))
+        futures = [
+            executor.submit(get_node_vlan_rows, cluster_id, pool["id"], node)
+            for cluster_id, pools in pools_by_cluster.items()
+            for pool in pools
+            for node in get_pool_nodes(pool)
+            if node.get("instance_id")  # Nodes still being provisioned have no instance yet
+        ]
+        print(f"Fetching VLAN interfaces for {len(futures)} node(s) in {len(cluster_ids)} cluster(s)...")
+
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"Error collecting node VLAN interfaces: {e}")
+                continue
+            for row in rows:
+                print(row)
+            writer.writerows(rows)
+            file.flush()
+            row_count += len(rows)
+    return row_count
+
+
+# Main Execution
+if __name__ == "__main__":
+    cluster_ids = [int(arg) for arg in sys.argv[1:]] or clusterIDs
+    if export_vlan_addresses(cluster_ids, OUTPUT_FILE):
+        print(f"Data has been written to {OUTPUT_FILE}")
+    else:
+        os.remove(OUTPUT_FILE)
+        print("No data found.")
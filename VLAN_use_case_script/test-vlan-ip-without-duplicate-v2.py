@@ -5,11 +5,20 @@ import datetime
 import asyncio
 import ipaddress
 import random
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp  # Only needed for the concurrent controller (ASYNC_MODE=true)
+except ImportError:
+    aiohttp = None
 
 # Linode API Token and Configuration
 api_token = os.environ.get("API_TOKEN")
 vlan_id = os.environ.get("VLAN_ID")
 cidr = os.environ.get("CIDR")
+# Comma separated IPs, 'start-end' ranges or CIDRs that must never be handed out (e.g. the gateway)
+reserved_ips = [entry.strip() for entry in os.environ.get("RESERVED_IPS", "").split(",") if entry.strip()]
 
 # API Base URL and Headers
 base_url = 'https://api.linode.com/v4'
@@ -19,7 +28,19 @@ headers = {
 
 MAX_RETRIES = 3
 RETRY_INTERVAL = 5
-IP_RETRY_LIMIT = 10  # Maximum attempts to find an unused IP
+
+# Concurrent controller: handle new nodes in parallel with aiohttp instead of one by one
+ASYNC_MODE = os.environ.get("ASYNC_MODE", "false").lower() == "true"
+NODE_CONCURRENCY = int(os.environ.get("NODE_CONCURRENCY", 10))  # Max API requests in flight
+
+# Reboot scheduling: all config changes are applied first, then nodes reboot in waves per LKE pool
+MAX_UNAVAILABLE_PER_POOL = int(os.environ.get("MAX_UNAVAILABLE_PER_POOL", 1))  # Max nodes of one pool rebooting at once
+REBOOT_TIMEOUT = int(os.environ.get("REBOOT_TIMEOUT", 900))  # Seconds to wait for a reboot wave to finish
+EVENT_POLL_INTERVAL = int(os.environ.get("EVENT_POLL_INTERVAL", 10))  # Seconds between /account/events polls
+
+# Persistent IPAM index: (vlan, ip) -> (linode, config), refreshed only for new or updated nodes
+IPAM_INDEX_FILE = os.environ.get("IPAM_INDEX_FILE", "vlan-ipam-index.json")
+IPAM_RESYNC_INTERVAL = int(os.environ.get("IPAM_RESYNC_INTERVAL", 3600))  # Seconds between full config rescans, 0 disables
 
 # Utility Functions
 def current_time():
@@ -39,38 +60,141 @@ def get_linode_status(linode_id):
         return None
 
 
-def get_unused_ipv4(cidr, used_ips):
+class IPv4Allocator:
     """
-    Generate a random unused IP from the given CIDR range.
-    Exclude already used and attempted IPs.
+    IPAM allocator for one CIDR, stored as an integer range plus a bitmap of used addresses.
+    Memory is one bit per address (a /16 is 8 KB, a /8 is 2 MB) and no IPv4Address objects are
+    created. Random picks are expected O(1) on sparse ranges and lowest-free picks are amortized
+    O(1) thanks to a moving hint; both fall back to a C-speed bitmap scan when the range is dense.
     """
-    import ipaddress
-    import random
-
-    network = ipaddress.ip_network(cidr, strict=True)
-    all_ips = set(network.hosts())  # Use a set for faster exclusion
-    used_ips_set = set(ipaddress.ip_address(ip) for ip in used_ips)  # Convert to IPAddress objects
-    attempts = 0
 
-    # Exclude used IPs
-    available_ips = all_ips - used_ips_set
-
-    if not available_ips:
-        raise RuntimeError(f"{current_time()} No available IPs in the CIDR range after excluding used IPs.")
-
-    while attempts < IP_RETRY_LIMIT:
-        random_ip = random.choice(list(available_ips))  # Choose a random IP
-        available_ips.remove(random_ip)  # Remove it from the pool to avoid reselecting
-        print(f'{current_time()} Attempt {attempts + 1}: Testing IP {random_ip}.')
-
-        if str(random_ip) not in used_ips:
-            print(f'{current_time()} Found unused IP: {random_ip}.')
-            return str(random_ip)
+    def __init__(self, cidr, reserved=()):
+        self.network = ipaddress.ip_network(cidr, strict=False)
+        self.first = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.free_count = self.size
+        self.lowest_hint = 0
+        if self.size % 8:
+            # Padding bits past the end of the range are permanently "used"
+            self.bitmap[-1] |= 0xFF << (self.size % 8) & 0xFF
+
+        if self.network.prefixlen < 31:
+            self.mark_used(self.network.network_address)
+            self.mark_used(self.network.broadcast_address)
+        for entry in reserved:
+            self.reserve(entry)
+
+    def reserve(self, entry):
+        """Reserve a single IP, an 'a.b.c.d-e.f.g.h' range or a CIDR inside the network."""
+        if not entry:
+            return
+        entry = str(entry)
+        if "-" in entry:
+            start, end = (int(ipaddress.ip_address(part.strip())) for part in entry.split("-", 1))
+        elif "/" in entry:
+            block = ipaddress.ip_network(entry, strict=False)
+            start, end = int(block.network_address), int(block.broadcast_address)
+        else:
+            start = end = int(ipaddress.ip_address(entry))
+        for value in range(max(start, self.first), min(end, self.first + self.size - 1) + 1):
+            self._set(value - self.first)
+
+    def _index(self, ip):
+        offset = int(ipaddress.ip_address(str(ip).split("/")[0])) - self.first
+        return offset if 0 <= offset < self.size else None
+
+    def _is_set(self, offset):
+        return self.bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _set(self, offset):
+        if not self._is_set(offset):
+            self.bitmap[offset >> 3] |= 1 << (offset & 7)
+            self.free_count -= 1
+
+    def mark_used(self, ip):
+        """Mark an address (optionally with /prefix) as used; addresses outside the CIDR are ignored."""
+        offset = self._index(ip)
+        if offset is not None:
+            self._set(offset)
+
+    def release(self, ip):
+        offset = self._index(ip)
+        if offset is not None and self._is_set(offset):
+            self.bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+            self.free_count += 1
+            self.lowest_hint = min(self.lowest_hint, offset)
+
+    def is_used(self, ip):
+        offset = self._index(ip)
+        return offset is None or bool(self._is_set(offset))
+
+    def _next_free_from(self, offset):
+        """Lowest free offset >= offset, or None. Full bytes are skipped with bytes.lstrip (C speed)."""
+        byte_index = offset >> 3
+        if byte_index >= len(self.bitmap):
+            return None
+        # Finish the partial first byte bit by bit
+        for bit in range(offset & 7, 8):
+            if not self.bitmap[byte_index] & (1 << bit):
+                return (byte_index << 3) + bit
+        rest = bytes(self.bitmap[byte_index + 1:])
+        skipped = len(rest) - len(rest.lstrip(b"\xff"))
+        byte_index += 1 + skipped
+        if byte_index >= len(self.bitmap):
+            return None
+        value = self.bitmap[byte_index]
+        bit = (~value & (value + 1)).bit_length() - 1  # lowest zero bit
+        return (byte_index << 3) + bit
+
+    def _take(self, offset):
+        self._set(offset)
+        return str(ipaddress.ip_address(self.first + offset))
+
+    def allocate_lowest(self):
+        """Allocate and return the lowest free address."""
+        offset = self._next_free_from(self.lowest_hint)
+        if offset is None:
+            raise RuntimeError(f"No free IPs available in {self.network}")
+        self.lowest_hint = offset + 1
+        return self._take(offset)
+
+    def allocate_random(self, probes=32):
+        """Allocate and return a random free address."""
+        if self.free_count <= 0:
+            raise RuntimeError(f"No free IPs available in {self.network}")
+        for _ in range(probes):
+            offset = random.randrange(self.size)
+            if not self._is_set(offset):
+                return self._take(offset)
+        # Dense range: take the first free address after a random starting point
+        start = random.randrange(self.size)
+        offset = self._next_free_from(start)
+        if offset is None:
+            offset = self._next_free_from(0)
+        return self._take(offset)
+
+
+def build_allocator(cidr, used_ips):
+    """
+    Build an allocator for the CIDR with the network/broadcast, RESERVED_IPS and used IPs taken.
+    """
+    allocator = IPv4Allocator(cidr, reserved=reserved_ips)
+    for ip in used_ips:
+        try:
+            allocator.mark_used(ip)
+        except ValueError:
+            print(f"{current_time()} Warning: ignoring invalid IPAM address '{ip}'")
+    return allocator
 
-        attempts += 1
-        print(f'{current_time()} Attempt {attempts}: IP {random_ip} is already in use.')
 
-    raise RuntimeError(f'{current_time()} Unable to find an unused IP after {IP_RETRY_LIMIT} attempts.')
+def get_unused_ipv4(allocator):
+    """
+    Pick a random unused IP from the allocator and mark it as used.
+    """
+    ip = allocator.allocate_random()
+    print(f'{current_time()} Found unused IP: {ip}.')
+    return ip
 
 def ping_ip(ip):
     """
@@ -80,18 +204,31 @@ def ping_ip(ip):
     return response == 0
 
 # API Helper Functions
-def get_nodes(page_size=300):
+NODE_LIST_ORDER = json.dumps({"+order_by": "id", "+order": "asc"})  # Stable order, so nodes don't shift between pages
+
+def get_nodes(page_size=500):
     """
     Fetch all nodes (Linode instances) with labels starting with 'lke'.
+    Every page is read: the listing decides which nodes are gone and get their addresses released,
+    so a partial listing must never be returned (None on any failure).
     """
     try:
-        response = requests.get(f'{base_url}/linode/instances', headers=headers, params={'page_size': page_size}, timeout=15)
-        response.raise_for_status()
-        nodes = [node for node in response.json()['data'] if node['label'].startswith('lke')]
+        instances = []
+        page = 1
+        while True:
+            response = requests.get(f'{base_url}/linode/instances', headers={**headers, 'X-Filter': NODE_LIST_ORDER},
+                                    params={'page': page, 'page_size': page_size}, timeout=15)
+            response.raise_for_status()
+            data = response.json()
+            instances.extend(data['data'])
+            if page >= data.get('pages', 1):
+                break
+            page += 1
+        nodes = [node for node in instances if node['label'].startswith('lke')]
         return nodes
     except Exception as e:
         print(f'{current_time()} Failed to fetch Linode instances. Error: {e}')
-        return []
+        return None
 
 def get_configs(node_id):
     """
@@ -103,22 +240,140 @@ def get_configs(node_id):
         return response.json()['data']
     except Exception as e:
         print(f'{current_time()} {node_id} Failed to fetch configs for Linode instance. Error: {e}')
-        return []
+        return None
 
-def get_used_ipam_addresses():
+# IPAM Index Functions
+def new_ipam_index():
+    return {"vlan": vlan_id, "cidr": cidr, "synced_at": 0, "nodes": {}, "pending_reboots": {}}
+
+def load_ipam_index():
     """
-    Retrieve all used IPAM addresses from the configurations of all nodes.
+    Load the IPAM index from IPAM_INDEX_FILE. A missing or unreadable file, or one written for
+    another VLAN/CIDR, starts a fresh index (which costs one full config scan).
     """
-    used_ips = set()
-    nodes = get_nodes()
+    try:
+        with open(IPAM_INDEX_FILE) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return new_ipam_index()
+    except (OSError, ValueError) as e:
+        print(f'{current_time()} Ignoring unreadable IPAM index {IPAM_INDEX_FILE}. Error: {e}')
+        return new_ipam_index()
+
+    if index.get("vlan") != vlan_id or index.get("cidr") != cidr or not isinstance(index.get("nodes"), dict):
+        print(f'{current_time()} IPAM index {IPAM_INDEX_FILE} is for another VLAN/CIDR. Rebuilding.')
+        return new_ipam_index()
+    index.setdefault("pending_reboots", {})  # Index files written before reboots were tracked
+    return index
+
+def save_ipam_index(index):
+    """
+    Write the IPAM index atomically (temp file + rename) so a crash never leaves a torn file.
+    """
+    tmp_file = f'{IPAM_INDEX_FILE}.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, IPAM_INDEX_FILE)
+    except OSError as e:
+        print(f'{current_time()} Failed to save IPAM index {IPAM_INDEX_FILE}. Error: {e}')
+
+def index_node(node, configs):
+    """
+    Build the index entry for a node from its configs: per config, the interface count and the
+    VLAN addresses it holds.
+    """
+    entry_configs = []
+    for config in configs:
+        addresses = []
+        for interface in config.get('interfaces', []):
+            if interface.get('purpose') == 'vlan' and interface.get('ipam_address'):
+                addresses.append({"vlan": interface.get('label'), "ip": interface['ipam_address'].split('/')[0]})  # Only store the base IP
+        entry_configs.append({"id": config['id'], "interface_count": len(config.get('interfaces', [])), "addresses": addresses})
+    return {"label": node['label'], "updated": node.get('updated'), "configs": entry_configs}
+
+def plan_ipam_refresh(index, nodes):
+    """
+    Drop nodes that disappeared from the listing (freeing their addresses) and work out which nodes
+    need their configs fetched: new nodes, nodes whose `updated` timestamp changed, or every node
+    once per IPAM_RESYNC_INTERVAL.
+    Returns (stale_nodes, full_resync, changed).
+    """
+    full_resync = IPAM_RESYNC_INTERVAL > 0 and time.time() - index.get("synced_at", 0) >= IPAM_RESYNC_INTERVAL
+    listed_ids = {str(node['id']) for node in nodes}
+    changed = False
+
+    for node_id in list(index["nodes"]):
+        if node_id not in listed_ids:
+            print(f'{current_time()} {index["nodes"][node_id]["label"]} is gone. Releasing its VLAN addresses.')
+            del index["nodes"][node_id]
+            changed = True
+
+    stale_nodes = []
     for node in nodes:
-        configs = get_configs(node['id'])
-        for config in configs:
-            for interface in config.get('interfaces', []):
-                if interface.get('purpose') == 'vlan' and 'ipam_address' in interface:
-                    used_ips.add(interface['ipam_address'].split('/')[0])  # Only store the base IP
+        entry = index["nodes"].get(str(node['id']))
+        if entry is None or entry.get("updated") != node.get('updated') or full_resync:
+            stale_nodes.append(node)
+    return stale_nodes, full_resync, changed
+
+def apply_ipam_refresh(index, nodes, stale_nodes, results, full_resync, changed):
+    """
+    Store fetched configs (None means the fetch failed) in the index. Returns True if the index changed.
+    """
+    failed = 0
+    for node, configs in zip(stale_nodes, results):
+        if configs is None:
+            failed += 1  # Keep the previous entry (if any) and retry on the next tick
+            continue
+        index["nodes"][str(node['id'])] = index_node(node, configs)
+        changed = True
+
+    if full_resync and not failed:
+        index["synced_at"] = time.time()
+        changed = True
+    if stale_nodes:
+        print(f'{current_time()} IPAM index refreshed configs for {len(stale_nodes) - failed} of {len(nodes)} node(s){" (full resync)" if full_resync else ""}.')
+    return changed
+
+def refresh_ipam_index(index, nodes):
+    """
+    Bring the index in line with the current node listing, fetching configs only where needed.
+    Returns True if the index changed.
+    """
+    stale_nodes, full_resync, changed = plan_ipam_refresh(index, nodes)
+    results = [get_configs(node['id']) for node in stale_nodes]
+    return apply_ipam_refresh(index, nodes, stale_nodes, results, full_resync, changed)
+
+def get_used_ipam_addresses(index):
+    """
+    Retrieve all IPAM addresses used on our VLAN from the index.
+    """
+    used_ips = set()
+    for entry in index["nodes"].values():
+        for config in entry["configs"]:
+            for address in config["addresses"]:
+                if address["vlan"] == vlan_id:
+                    used_ips.add(address["ip"])
     return used_ips
 
+def record_attachment(index, node_id, config_id, ip):
+    """
+    Record a successful VLAN attachment in the index and persist it straight away, so the address
+    stays taken even if the script dies before the next tick. The node is also marked as needing a
+    reboot until its reboot event finishes.
+    """
+    entry = index["nodes"].get(str(node_id))
+    if entry is None:
+        return
+    for config in entry["configs"]:
+        if config["id"] == config_id:
+            config["interface_count"] = 2
+            config["addresses"] = [{"vlan": vlan_id, "ip": ip}]
+    index["pending_reboots"][str(node_id)] = reboot_wave_since()
+    save_ipam_index(index)
+
 def attach_vlan_if_needed(node_name, node_id, config_id, ipam_address, used_ips):
     """
     Attach VLAN to the node only if it's not already attached.
@@ -143,9 +398,11 @@ def attach_vlan_if_needed(node_name, node_id, config_id, ipam_address, used_ips)
             print(f"{current_time()} Warning: used_ips is not a set! Converting it now.")
             used_ips = set(used_ips)  # Convert list to set and then add the IP
             used_ips.add(ipam_address.split('/')[0])
+        return True
 
     except Exception as e:
         print(f'{current_time()} {node_name} Failed to attach VLAN. Error: {e}')
+        return False
 
 def reboot_from_config(node_name, node_id):
     """
@@ -159,7 +416,7 @@ def reboot_from_config(node_name, node_id):
             response = requests.post(url, headers=headers, timeout=10)
             response.raise_for_status()
             print(f'{current_time()} {node_name} Successfully rebooted Linode instance.')
-            break
+            return True
         except Exception as e:
             retry_count += 1
             print(f'{current_time()} {node_name} Failed to reboot instance (Attempt {retry_count}). Error: {e}')
@@ -168,76 +425,465 @@ def reboot_from_config(node_name, node_id):
                 time.sleep(RETRY_INTERVAL)
             else:
                 print(f'{current_time()} {node_name} Maximum retry attempts reached.')
+    return False
 
+# Reboot Scheduling Functions
+def get_pool_id(node):
+    """
+    LKE pool of a node. LKE labels its Linodes lke<cluster id>-<pool id>-<hash>, which carries the
+    same pool id as the node's lke.linode.com/pool-id Kubernetes label.
+    """
+    parts = node['label'].split('-')
+    return parts[1] if len(parts) >= 3 else node['label']
 
-def get_remaining_ips(cidr, used_ips):
+def plan_reboot_waves(changes):
     """
-    Calculate the number of remaining available IPs in the given CIDR block.
+    Split the nodes with applied changes into reboot waves. A node with several changed configs is
+    rebooted once, and a wave holds at most MAX_UNAVAILABLE_PER_POOL nodes of each pool.
     """
-    try:
-        network = ipaddress.ip_network(cidr, strict=True)
+    by_pool = {}
+    seen = set()
+    for change in changes:
+        if change['node_id'] not in seen:
+            seen.add(change['node_id'])
+            by_pool.setdefault(change['pool_id'], []).append(change)
+
+    waves = []
+    while any(by_pool.values()):
+        wave = []
+        for pool_changes in by_pool.values():
+            wave.extend(pool_changes[:MAX_UNAVAILABLE_PER_POOL])
+            del pool_changes[:MAX_UNAVAILABLE_PER_POOL]
+        waves.append(wave)
+    return waves
+
+def reboot_events_filter(since):
+    return {"action": "linode_reboot", "created": {"+gte": since}}
+
+def reboot_wave_since():
+    # UTC start of a wave in the API's timestamp format, with a minute of slack for clock skew
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=60)
+    return since.strftime("%Y-%m-%dT%H:%M:%S")
+
+def pending_reboots_since(index, nodes):
+    """
+    Drop pending reboots of nodes that are gone or offline (the config applies on their next boot).
+    Returns the oldest reboot request time of the rest, or None if nothing is pending.
+    """
+    pending = index["pending_reboots"]
+    status_by_id = {str(node['id']): node.get('status') for node in nodes}
+    for node_id in list(pending):
+        if status_by_id.get(node_id) in (None, 'offline'):
+            print(f'{current_time()} Linode {node_id} is gone or offline. Dropping its pending reboot.')
+            del pending[node_id]
+    return min(pending.values()) if pending else None
+
+def pending_reboot_changes(index, nodes, events):
+    """
+    Clear pending reboots whose reboot event finished after it was requested, and return the running
+    nodes that still need one, as changes for the wave rollout. Nodes in other states wait for the next tick.
+    """
+    pending = index["pending_reboots"]
+    for event in events:
+        node_id = str((event.get('entity') or {}).get('id'))
+        if node_id in pending and event.get('status') == 'finished' and event.get('created', '') >= pending[node_id]:
+            del pending[node_id]
+    save_ipam_index(index)
+
+    changes = [{'node_id': node['id'], 'node_name': node['label'], 'pool_id': get_pool_id(node)}
+               for node in nodes if str(node['id']) in pending and node.get('status') == 'running']
+    if changes:
+        print(f'{current_time()} Resuming {len(changes)} pending reboot(s): {", ".join(change["node_name"] for change in changes)}')
+    return changes
+
+def resume_pending_reboots(index, nodes):
+    """
+    Nodes whose VLAN was attached on an earlier tick but whose reboot never finished.
+    """
+    since = pending_reboots_since(index, nodes)
+    if since is None:
+        return []
+    events = get_reboot_events(since)
+    if events is None:
+        return []  # Try again on the next tick
+    return pending_reboot_changes(index, nodes, events)
 
-        # Total usable IPs (excluding network and broadcast)
-        total_ips_count = network.num_addresses - 2  
+def clear_finished_reboots(index, wave, finished):
+    """
+    Persist the reboot state after a wave: nodes that finished leave the pending reboots.
+    """
+    for change in wave:
+        if change['node_id'] in finished:
+            index["pending_reboots"].pop(str(change['node_id']), None)
+    save_ipam_index(index)
 
-        # Convert used IPs to a set of valid IP addresses
-        used_ips_set = {ipaddress.ip_address(ip) for ip in used_ips if ip}
+def collect_reboot_results(events, pending, finished):
+    """
+    Move nodes whose reboot event finished (or failed) out of `pending`.
+    """
+    for event in events:
+        node_id = (event.get('entity') or {}).get('id')
+        if node_id not in pending:
+            continue
+        name = pending.pop(node_id)
+        if event.get('status') == 'finished':
+            finished.add(node_id)
+            print(f'{current_time()} {name} Reboot finished.')
+        else:
+            print(f'{current_time()} {name} Reboot failed.')
 
-        # Remaining IPs count
-        remaining_ips_count = total_ips_count - len(used_ips_set)
+def get_reboot_events(since):
+    """
+    Fetch linode_reboot events created at or after `since` (all pages: a resumed `since` can be hours old).
+    Returns None if any request failed.
+    """
+    try:
+        events = []
+        page = 1
+        while True:
+            response = requests.get(f'{base_url}/account/events', params={'page': page, 'page_size': 500}, timeout=15,
+                                    headers={**headers, 'X-Filter': json.dumps(reboot_events_filter(since))})
+            response.raise_for_status()
+            data = response.json()
+            events.extend(data['data'])
+            if page >= data.get('pages', 1):
+                break
+            page += 1
+        return [event for event in events if event.get('status') in ('finished', 'failed')]
+    except Exception as e:
+        print(f'{current_time()} Failed to fetch reboot events. Error: {e}')
+        return None
 
-        print(f"{current_time()} CIDR: {cidr}, Total Usable IPs: {total_ips_count}, Used IPs: {len(used_ips_set)}, Remaining IPs: {remaining_ips_count}")
-        return remaining_ips_count
+def wave_failed(number, waves, wave, finished):
+    """
+    Report a wave whose nodes did not all finish rebooting. Returns True if the rollout must stop.
+    """
+    failed = [change['node_name'] for change in wave if change['node_id'] not in finished]
+    if not failed:
+        return False
+    remaining = [change['node_name'] for later_wave in waves[number:] for change in later_wave]
+    print(f'{current_time()} Reboot wave {number} did not finish for: {", ".join(failed)}. Stopping reboots.')
+    if remaining:
+        print(f'{current_time()} VLAN attached but reboot still needed for: {", ".join(remaining)}')
+    print(f'{current_time()} Pending reboots are kept in {IPAM_INDEX_FILE} and resumed on the next check.')
+    return True
+
+def start_reboot_wave(index, wave):
+    """
+    Stamp the wave's nodes with the wave start, so only reboot events from now on clear them.
+    """
+    since = reboot_wave_since()
+    for change in wave:
+        index["pending_reboots"][str(change['node_id'])] = since
+    save_ipam_index(index)
+    return since
 
-    except ValueError as e:
-        print(f"{current_time()} Error: Invalid CIDR '{cidr}' - {e}")
-        return 0  # Return 0 if CIDR is invalid
+def reboot_in_waves(changes, index):
+    """
+    Reboot the nodes with applied changes wave by wave and wait for their reboot events, so a pool
+    never has more than MAX_UNAVAILABLE_PER_POOL nodes down. Stops at the first wave that does not finish;
+    the nodes left stay in the index's pending reboots and are resumed on the next tick.
+    """
+    waves = plan_reboot_waves(changes)
+    for number, wave in enumerate(waves, start=1):
+        print(f'{current_time()} Reboot wave {number}/{len(waves)}: {", ".join(change["node_name"] for change in wave)}')
+        since = start_reboot_wave(index, wave)
+        with ThreadPoolExecutor(max_workers=NODE_CONCURRENCY) as executor:
+            results = list(executor.map(lambda change: reboot_from_config(change['node_name'], change['node_id']), wave))
+
+        pending = {change['node_id']: change['node_name'] for change, ok in zip(wave, results) if ok}
+        finished = set()
+        deadline = time.monotonic() + REBOOT_TIMEOUT
+        while pending and time.monotonic() < deadline:
+            time.sleep(EVENT_POLL_INTERVAL)
+            events = get_reboot_events(since)
+            if events is not None:
+                collect_reboot_results(events, pending, finished)
+
+        clear_finished_reboots(index, wave, finished)
+        if wave_failed(number, waves, wave, finished):
+            return
+
+
+def get_remaining_ips(allocator):
+    """
+    Return the number of remaining available IPs in the allocator's CIDR block.
+    """
+    network = allocator.network
+    total_ips_count = network.num_addresses - 2 if network.prefixlen < 31 else network.num_addresses
+    remaining_ips_count = allocator.free_count
+    print(f"{current_time()} CIDR: {network}, Total Usable IPs: {total_ips_count}, Used IPs: {total_ips_count - remaining_ips_count}, Remaining IPs: {remaining_ips_count}")
+    return remaining_ips_count
 
 
 # Main Logic
-def do():
+def do(index):
     try:
-        used_ips = get_used_ipam_addresses()  # Fetch all used IPAM addresses
+        nodes = get_nodes()  # The only API call on a tick where nothing changed
+        if nodes is None:
+            print(f'{current_time()} Skipping check, node listing failed.')
+            return
+        print(f'{current_time()} Found {len(nodes)} node(s).')
+
+        if refresh_ipam_index(index, nodes):
+            save_ipam_index(index)
+        resumed = resume_pending_reboots(index, nodes)
+
+        used_ips = get_used_ipam_addresses(index)  # All used IPAM addresses on the VLAN
         print(f'{current_time()} Used IPs: {used_ips}')
-        
-        remaining_ips = get_remaining_ips(cidr, used_ips)  # Check remaining IPs
-        
+
+        allocator = build_allocator(cidr, used_ips)
+        remaining_ips = get_remaining_ips(allocator)  # Check remaining IPs
+
         print(f'{current_time()} Remaining available IPs in {cidr}: {remaining_ips}')
-        
-        nodes = get_nodes()
-        print(f'{current_time()} Found {len(nodes)} node(s).')
 
+        # Pick every address first (one thread), then apply the config changes concurrently
+        changes = []
         for node in nodes:
             node_id = node['id']
             node_name = node['label']
-            configs = get_configs(node_id)
-            status = get_linode_status(node_id)
-
-            if configs and status == 'running':
-                for config in configs:
-                    if len(config.get('interfaces', [])) < 2:  # Less than 2 interfaces (public + VLAN)
-                        if remaining_ips > 0:  # ✅ Prevent errors if no IPs are left
-                            ipam_address = get_unused_ipv4(cidr, used_ips) + '/21'
-                            attach_vlan_if_needed(node_name, node_id, config['id'], ipam_address, used_ips)
-                            reboot_from_config(node_name, node_id)
-                            remaining_ips -= 1  # ✅ Update remaining IP count
+            entry = index["nodes"].get(str(node_id))
+            status = node.get('status')
+
+            if entry and entry["configs"] and status == 'running':
+                for config in entry["configs"]:
+                    if config["interface_count"] < 2:  # Less than 2 interfaces (public + VLAN)
+                        if allocator.free_count > 0:  # ✅ Prevent errors if no IPs are left
+                            ip = get_unused_ipv4(allocator)
+                            changes.append({'node_id': node_id, 'node_name': node_name, 'config_id': config['id'],
+                                            'pool_id': get_pool_id(node), 'ip': ip,
+                                            'ipam_address': f'{ip}/{allocator.network.prefixlen}'})
                         else:
                             print(f'{current_time()} No remaining IPs available in {cidr}. Skipping attachment.')
                     else:
                         print(f'{current_time()} {node_name} is already properly configured.')
 
+        applied = []
+        if changes:
+            print(f'{current_time()} Attaching VLAN to {len(changes)} config(s) concurrently.')
+            with ThreadPoolExecutor(max_workers=NODE_CONCURRENCY) as executor:
+                results = list(executor.map(
+                    lambda change: attach_vlan_if_needed(change['node_name'], change['node_id'], change['config_id'], change['ipam_address'], used_ips),
+                    changes))
+
+            for change, attached in zip(changes, results):
+                if attached:
+                    record_attachment(index, change['node_id'], change['config_id'], change['ip'])
+                    applied.append(change)
+                else:
+                    allocator.release(change['ip'])  # Give the address back for the next check
+
+        if applied or resumed:
+            reboot_in_waves(applied + resumed, index)
+
     except Exception as e:
         print(f'{current_time()} Error in do(): {e}')
 
 
+# Concurrent Controller (ASYNC_MODE)
+async def api_request_async(session, semaphore, method, path, payload=None, params=None, label='', headers=None):
+    """
+    Send one Linode API request and return the JSON body, or None on failure.
+    429s, 5xx and network errors are retried with exponential backoff via asyncio.sleep, so a
+    retrying node never blocks the others.
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            async with semaphore:
+                async with session.request(method, f'{base_url}{path}', json=payload, params=params, headers=headers,
+                                           timeout=aiohttp.ClientTimeout(total=15)) as response:
+                    response.raise_for_status()
+                    return await response.json()
+        except aiohttp.ClientResponseError as e:
+            if e.status != 429 and e.status < 500:
+                print(f'{current_time()} {label} {method} {path} failed. Error: {e.status} {e.message}')
+                return None
+            error = f'{e.status} {e.message}'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = str(e) or type(e).__name__
+
+        print(f'{current_time()} {label} {method} {path} failed (Attempt {attempt}). Error: {error}')
+        if attempt < MAX_RETRIES:
+            delay = RETRY_INTERVAL * 2 ** (attempt - 1)
+            print(f'{current_time()} {label} Retrying in {delay} seconds...')
+            await asyncio.sleep(delay)
+
+    print(f'{current_time()} {label} Maximum retry attempts reached.')
+    return None
+
+async def get_nodes_async(session, semaphore, page_size=500):
+    """
+    Same listing as get_nodes(): page 1 first, then the remaining pages concurrently. None if any page fails.
+    """
+    async def get_page(page):
+        return await api_request_async(session, semaphore, 'GET', '/linode/instances', params={'page': page, 'page_size': page_size},
+                                       headers={'X-Filter': NODE_LIST_ORDER})
+
+    first = await get_page(1)
+    if first is None:
+        return None
+    pages = [first] + list(await asyncio.gather(*(get_page(page) for page in range(2, first.get('pages', 1) + 1))))
+    if any(data is None for data in pages):
+        return None
+    return [node for data in pages for node in data['data'] if node['label'].startswith('lke')]
+
+async def get_configs_async(session, semaphore, node):
+    data = await api_request_async(session, semaphore, 'GET', f'/linode/instances/{node["id"]}/configs', label=node['label'])
+    return None if data is None else data['data']
+
+async def attach_node_async(session, semaphore, index, allocator, node, config_id):
+    """
+    Attach the VLAN to one node config. Returns the applied change, or None.
+    """
+    node_id = node['id']
+    node_name = node['label']
+    if allocator.free_count <= 0:
+        print(f'{current_time()} No remaining IPs available in {cidr}. Skipping attachment.')
+        return None
+
+    # There is no await between picking and marking the address, so the single allocator hands out
+    # addresses one at a time even with many attachments in flight
+    ip = get_unused_ipv4(allocator)
+    ipam_address = f'{ip}/{allocator.network.prefixlen}'
+    config = {
+        "interfaces": [
+            {"purpose": "public"},
+            {"purpose": "vlan", "label": vlan_id, "ipam_address": ipam_address},
+        ]
+    }
+
+    result = await api_request_async(session, semaphore, 'PUT', f'/linode/instances/{node_id}/configs/{config_id}', payload=config, label=node_name)
+    if result is None:
+        print(f'{current_time()} {node_name} Failed to attach VLAN.')
+        allocator.release(ip)  # Give the address back for the next node
+        return None
+    print(f'{current_time()} {node_name} Successfully attached VLAN to Linode instance.')
+    record_attachment(index, node_id, config_id, ip)
+    return {'node_id': node_id, 'node_name': node_name, 'config_id': config_id, 'pool_id': get_pool_id(node), 'ip': ip}
+
+async def reboot_node_async(session, semaphore, change):
+    result = await api_request_async(session, semaphore, 'POST', f'/linode/instances/{change["node_id"]}/reboot', label=change['node_name'])
+    if result is None:
+        return False
+    print(f'{current_time()} {change["node_name"]} Successfully rebooted Linode instance.')
+    return True
+
+async def get_reboot_events_async(session, semaphore, since):
+    """
+    Same as get_reboot_events(): page 1 first, then the remaining pages concurrently. None if any page fails.
+    """
+    async def get_page(page):
+        return await api_request_async(session, semaphore, 'GET', '/account/events', params={'page': page, 'page_size': 500},
+                                       headers={'X-Filter': json.dumps(reboot_events_filter(since))})
+
+    first = await get_page(1)
+    if first is None:
+        return None
+    pages = [first] + list(await asyncio.gather(*(get_page(page) for page in range(2, first.get('pages', 1) + 1))))
+    if any(data is None for data in pages):
+        return None
+    return [event for data in pages for event in data['data'] if event.get('status') in ('finished', 'failed')]
+
+async def resume_pending_reboots_async(session, semaphore, index, nodes):
+    since = pending_reboots_since(index, nodes)
+    if since is None:
+        return []
+    events = await get_reboot_events_async(session, semaphore, since)
+    if events is None:
+        return []  # Try again on the next tick
+    return pending_reboot_changes(index, nodes, events)
+
+async def reboot_in_waves_async(session, semaphore, changes, index):
+    """
+    Same wave rollout as reboot_in_waves(), with the reboots of a wave sent concurrently and the
+    event polling waiting on asyncio.sleep.
+    """
+    waves = plan_reboot_waves(changes)
+    for number, wave in enumerate(waves, start=1):
+        print(f'{current_time()} Reboot wave {number}/{len(waves)}: {", ".join(change["node_name"] for change in wave)}')
+        since = start_reboot_wave(index, wave)
+        results = await asyncio.gather(*(reboot_node_async(session, semaphore, change) for change in wave))
+
+        pending = {change['node_id']: change['node_name'] for change, ok in zip(wave, results) if ok}
+        finished = set()
+        deadline = time.monotonic() + REBOOT_TIMEOUT
+        while pending and time.monotonic() < deadline:
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+            events = await get_reboot_events_async(session, semaphore, since)
+            if events is not None:
+                collect_reboot_results(events, pending, finished)
+
+        clear_finished_reboots(index, wave, finished)
+        if wave_failed(number, waves, wave, finished):
+            return
+
+async def do_async(session, index):
+    """
+    Same check as do(), but on aiohttp: config fetches, VLAN attachments and the reboots of a wave
+    run concurrently.
+    """
+    try:
+        semaphore = asyncio.Semaphore(NODE_CONCURRENCY)
+        nodes = await get_nodes_async(session, semaphore)
+        if nodes is None:
+            print(f'{current_time()} Skipping check, node listing failed.')
+            return
+        print(f'{current_time()} Found {len(nodes)} node(s).')
+
+        stale_nodes, full_resync, changed = plan_ipam_refresh(index, nodes)
+        results = await asyncio.gather(*(get_configs_async(session, semaphore, node) for node in stale_nodes))
+        if apply_ipam_refresh(index, nodes, stale_nodes, results, full_resync, changed):
+            save_ipam_index(index)
+        resumed = await resume_pending_reboots_async(session, semaphore, index, nodes)
+
+        used_ips = get_used_ipam_addresses(index)
+        print(f'{current_time()} Used IPs: {used_ips}')
+        allocator = build_allocator(cidr, used_ips)
+        remaining_ips = get_remaining_ips(allocator)
+        print(f'{current_time()} Remaining available IPs in {cidr}: {remaining_ips}')
+
+        tasks = []
+        for node in nodes:
+            entry = index["nodes"].get(str(node['id']))
+            if not entry or not entry["configs"] or node.get('status') != 'running':
+                continue
+            for config in entry["configs"]:
+                if config["interface_count"] < 2:  # Less than 2 interfaces (public + VLAN)
+                    tasks.append(attach_node_async(session, semaphore, index, allocator, node, config["id"]))
+                else:
+                    print(f'{current_time()} {node["label"]} is already properly configured.')
+
+        applied = []
+        if tasks:
+            print(f'{current_time()} Attaching VLAN to {len(tasks)} config(s) concurrently.')
+            applied = [change for change in await asyncio.gather(*tasks) if change is not None]
+        if applied or resumed:
+            await reboot_in_waves_async(session, semaphore, applied + resumed, index)
+
+    except Exception as e:
+        print(f'{current_time()} Error in do_async(): {e}')
+
+
 # Asynchronous Main Loop
 async def main():
-    while True:
-        print(f'{current_time()} Starting check...')
-        do()
-        print(f'{current_time()} Check completed. No changes needed.')
-        await asyncio.sleep(60)
+    index = load_ipam_index()
+    print(f'{current_time()} Loaded IPAM index with {len(index["nodes"])} node(s) from {IPAM_INDEX_FILE}.')
+    session = aiohttp.ClientSession(headers=headers) if ASYNC_MODE else None
+    try:
+        while True:
+            print(f'{current_time()} Starting check...')
+            if session is not None:
+                await do_async(session, index)
+            else:
+                do(index)
+            print(f'{current_time()} Check completed. No changes needed.')
+            await asyncio.sleep(60)
+    finally:
+        if session is not None:
+            await session.close()
 
 if __name__ == '__main__':
+    if ASYNC_MODE and aiohttp is None:
+        raise SystemExit("ASYNC_MODE=true requires the aiohttp library (pip install aiohttp)")
     loop = asyncio.get_event_loop()
     loop.run_until_complete(main())
@@ -1,9 +1,15 @@
 from datetime import datetime, timedelta
+import asyncio
 import os
 import time
 import requests
 from dotenv import load_dotenv
 
+try:
+    import aiohttp  # Only needed for the non-blocking mode (V1_ASYNC_MODE=true)
+except ImportError:
+    aiohttp = None
+
 # Load environment variables
 load_dotenv()
 
@@ -12,6 +18,8 @@ MIN_VMS = int(os.getenv("MIN_VMS", 1))
 MAX_VMS = int(os.getenv("MAX_VMS", 5))
 COOLDOWN_PERIOD = int(os.getenv("COOLDOWN_PERIOD", 300))  # Default 5 minutes
 RABBIT_MQ_TIME_INTERVAL_CHECK = int(os.getenv("RABBIT_MQ_TIME_INTERVAL_CHECK", 30)) # Default 30 seconds
+V1_ASYNC_MODE = os.getenv("V1_ASYNC_MODE", "false").lower() == "true"  # Non-blocking tick-based loop
+PROVISION_TIMEOUT = 300  # Same 5 minute budget as check_vm_provision_status()
 
 # Linode & RabbitMQ API Config
 LINODE_API_TOKEN = os.getenv("LINODE_API_TOKEN")
@@ -211,5 +219,155 @@ def autoscaler_loop():
         time.sleep(RABBIT_MQ_TIME_INTERVAL_CHECK)  # Check time interval based on RABBIT_MQ_TIME_INTERVAL_CHECK value set
 
 
+#-------------------------------------------------------------------
+# Non-blocking mode: every tick takes one instance listing and one
+# queue snapshot, and all running/idle/provisioning decisions are made
+# from those two responses instead of per-VM API calls or sleeps.
+#-------------------------------------------------------------------
+
+# Track VMs created in non-blocking mode: vm_id -> (label, creation time)
+pending_vm_provisions = {}
+
+#Fetch one listing and one queue snapshot concurrently
+async def fetch_tick_snapshot(session):
+    """Return (gpu instances, queue info) for this tick; either may be None on failure."""
+    async def get_instances():
+        instances = []
+        page = 1
+        while True:
+            async with session.get(LINODE_API_URL, headers=HEADERS, params={"page": page, "page_size": 500}) as response:
+                if response.status != 200:
+                    print(f"⚠️ Error listing VMs: {await response.text()}")
+                    return None
+                data = await response.json()
+            instances.extend(data.get("data", []))
+            if page >= data.get("pages", 1):
+                return [vm for vm in instances if vm["label"].startswith("gpu-")]
+            page += 1
+
+    async def get_queue_info():
+        async with session.get(RABBITMQ_URL, auth=aiohttp.BasicAuth(RABBITMQ_USER, RABBITMQ_PASS)) as response:
+            if response.status != 200:
+                print(f"⚠️ Error fetching queue: {await response.text()}")
+                return None
+            return await response.json()
+
+    results = await asyncio.gather(get_instances(), get_queue_info(), return_exceptions=True)
+    instances, queue_info = [None if isinstance(r, Exception) else r for r in results]
+    return instances, queue_info
+
+#Resolve provisioning VMs from the tick listing (replaces check_vm_provision_status polling)
+def update_pending_provisions(gpu_instances):
+    statuses = {vm["id"]: vm["status"] for vm in gpu_instances}
+    now = time.time()
+    for vm_id, (vm_label, created_at) in list(pending_vm_provisions.items()):
+        if statuses.get(vm_id) == "running":
+            print(f"✅ VM {vm_label} is now ACTIVE and READY TO USE.")
+            del pending_vm_provisions[vm_id]
+        elif now - created_at >= PROVISION_TIMEOUT:
+            print(f"❌ VM {vm_label} failed to become ready.")
+            del pending_vm_provisions[vm_id]
+        else:
+            print(f"⏳ Waiting for VM {vm_label} to be ready... (Current status: {statuses.get(vm_id)})")
+
+#Non-blocking provision: POST and return, readiness is picked up on later ticks
+async def provision_vm_async(session, current_vms):
+    global vm_creation_timestamps
+    now = datetime.now()
+    vm_creation_timestamps = [ts for ts in vm_creation_timestamps if now - ts < timedelta(seconds=30)]
+
+    # Rate limit: max 10 requests per 30 seconds, skip this tick rather than sleeping
+    if len(vm_creation_timestamps) >= 10:
+        print("Rate limit reached! Deferring VM creation to the next check...")
+        return None
+    if current_vms >= MAX_VMS:
+        return None
+
+    vm_label = f"gpu-{now.strftime('%Y%m%d-%H%M%S')}"
+    async with session.post(LINODE_API_URL, headers=HEADERS, json={
+        "type": "g6-standard-1",  # Modify this for a GPU VM type if needed
+        "region": "us-east",
+        "image": "linode/ubuntu22.04",
+        "label": vm_label,
+        "root_pass": "your_secure_password",
+        "firewall_id": 849035
+    }) as response:
+        if response.status != 200:
+            print(f"Failed to provision VM: {await response.text()}")
+            return None
+        vm_data = await response.json()
+
+    vm_id = vm_data.get("id")
+    print(f"🚀 Provisioned VM {vm_label} (ID: {vm_id}), checking status on next ticks...")
+    pending_vm_provisions[vm_id] = (vm_label, time.time())
+    vm_creation_timestamps.append(now)
+    return vm_data
+
+#Batched idle detection (same idle_vm_timers / COOLDOWN_PERIOD semantics as delete_idle_gpu_vm)
+async def delete_idle_gpu_vm_async(session, gpu_instances, queue_info):
+    # One queue snapshot answers is_vm_idle() for every VM this tick
+    idle = queue_info.get("messages_unacknowledged", 0) == 0
+    now = time.time()
+
+    for instance in gpu_instances:
+        vm_name = instance["label"]
+        vm_id = instance["id"]
+
+        if instance["status"] != "running":
+            print(f"⏳ VM {vm_name} (ID: {vm_id}) is not running, skipping scale down...")
+            continue
+
+        if not idle:
+            idle_vm_timers.pop(vm_name, None)  # Reset cooldown if VM is no longer idle
+            continue
+
+        if vm_name not in idle_vm_timers:
+            idle_vm_timers[vm_name] = now
+            continue
+
+        if now - idle_vm_timers[vm_name] >= COOLDOWN_PERIOD:
+            print(f"⚠️ VM {vm_name} (ID: {vm_id}) has been idle for {COOLDOWN_PERIOD} seconds. Preparing to delete...")
+            async with session.delete(f"{LINODE_API_URL}/{vm_id}", headers=HEADERS) as response:
+                if response.status == 200:
+                    print(f"✅ Successfully deleted VM {vm_name} (ID: {vm_id}).")
+                    del idle_vm_timers[vm_name]
+                else:
+                    print(f"❌ Failed to delete VM {vm_name} (ID: {vm_id}): {await response.text()}")
+            return  # One deletion per check, as in delete_idle_gpu_vm()
+
+#main function for non-blocking autoscaller logic
+async def autoscaler_loop_async():
+    """Tick every RABBIT_MQ_TIME_INTERVAL_CHECK seconds regardless of fleet size or provisioning VMs."""
+    async with aiohttp.ClientSession() as session:
+        while True:
+            tick_started = time.monotonic()
+            try:
+                gpu_instances, queue_info = await fetch_tick_snapshot(session)
+                if gpu_instances is not None and queue_info is not None:
+                    update_pending_provisions(gpu_instances)
+                    queue_length = queue_info.get("messages", 0)
+                    active_gpu_vms = len(gpu_instances)
+
+                    print(f"Queue Length: {queue_length}, Active GPU VMs: {active_gpu_vms}")
+
+                    if queue_length > active_gpu_vms and active_gpu_vms < MAX_VMS:
+                        print("Scaling up GPU VM...")
+                        await provision_vm_async(session, active_gpu_vms)
+
+                    elif queue_length < active_gpu_vms and active_gpu_vms > MIN_VMS:
+                        print("Checking for idle GPU VMs to scale down...")
+                        await delete_idle_gpu_vm_async(session, gpu_instances, queue_info)
+            except Exception as e:
+                print(f"Error in autoscaler tick: {e}")
+
+            # Keep a fixed cadence: subtract the time this tick spent on API calls
+            await asyncio.sleep(max(0, RABBIT_MQ_TIME_INTERVAL_CHECK - (time.monotonic() - tick_started)))
+
+
 if __name__ == "__main__":
-    autoscaler_loop()
\ No newline at end of file
+    if V1_ASYNC_MODE:
+        if aiohttp is None:
+            raise SystemExit("V1_ASYNC_MODE=true requires the aiohttp library (pip install aiohttp)")
+        asyncio.run(autoscaler_loop_async())
+    else:
+        autoscaler_loop()
\ No newline at end of file
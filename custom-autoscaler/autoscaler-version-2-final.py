@@ -3,7 +3,10 @@ import os
 import time
 import requests
 import asyncio
+import json
+from collections import deque
 import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
 import logging
 from typing import Dict, Set
@@ -47,6 +50,11 @@ RABBITMQ_API_URL = f"{RABBITMQ_ENDPOINT}/api/queues/{RABBITMQ_VHOST}/{RABBITMQ_Q
 HEADERS = {"Authorization": f"Bearer {LINODE_API_TOKEN}", "Content-Type": "application/json"}
 LINODE_API_URL = "https://api.linode.com/v4/linode/instances"
 
+# Multi-pool Configuration (JSON file describing several queue/VM pools, see readme)
+POOLS_CONFIG = os.getenv("POOLS_CONFIG")
+LINODE_API_REQUESTS_PER_MINUTE = int(os.getenv("LINODE_API_REQUESTS_PER_MINUTE", 200))  # Shared by all pools
+INSTANCE_LIST_PAGE_SIZE = 500
+
 # Track idle VM cooldown
 idle_vm_timers = {}
 
@@ -57,12 +65,184 @@ vm_creation_timestamps = []
 vm_provision_tracking: Dict[int, datetime] = {}
 MAX_PROVISION_WAIT_TIME = 600  # 10 minutes in seconds
 
+# Readiness Configuration: how a VM proves it is consuming work, not just booted
+# status   - Linode status == "running" (default)
+# tcp      - READINESS_PORT (the worker's service port; sshd on 22 is up long before
+#            cloud-init has installed the worker) accepts connections on the VM's public IPv4
+# http     - READINESS_HTTP_URL ({ip} is substituted) answers 2xx
+# rabbitmq - the VM's IPv4 appears as a consumer of the queue
+READINESS_CHECK = os.getenv("READINESS_CHECK", "status").lower()
+READINESS_PORT = int(os.getenv("READINESS_PORT", 8080))
+READINESS_HTTP_URL = os.getenv("READINESS_HTTP_URL", "http://{ip}:8080/healthz")
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 3))
+READINESS_CONCURRENCY = int(os.getenv("READINESS_CONCURRENCY", 20))  # Max probes in flight
+
+if READINESS_CHECK not in ("status", "tcp", "http", "rabbitmq"):
+    raise ValueError(f"Unsupported READINESS_CHECK: {READINESS_CHECK}")
+
+# Track VMs that passed the readiness check
+ready_vm_ids: Set[int] = set()
+
 # Track scale operations cooldown
 scale_timestamps = []
 
 # Track VM last activity
 vm_last_activity = {}
 
+# Metrics endpoint Configuration (set METRICS_PORT=0 to disable)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9105))
+
+# Histogram buckets (seconds)
+API_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROVISION_TIME_BUCKETS = (30, 60, 90, 120, 180, 240, 300, 450, 600, 900)
+LOOP_DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+#Metrics registry
+class MetricsRegistry:
+    """Minimal in-process registry rendered in Prometheus text exposition format."""
+
+    def __init__(self):
+        self._meta = {}        # name -> (type, help)
+        self._gauges = {}      # (name, labels) -> value
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._buckets = {}     # name -> bucket bounds
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self._meta[name] = (metric_type, help_text)
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def set_gauge(self, name, value, **labels):
+        self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def inc_counter(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bounds = self._buckets[name]
+        entry = self._histograms.setdefault(key, [[0] * len(bounds), 0.0, 0])
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        lines = []
+        for name, (metric_type, help_text) in sorted(self._meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "gauge":
+                series = self._gauges
+            elif metric_type == "counter":
+                series = self._counters
+            else:
+                series = None
+
+            if series is not None:
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+                continue
+
+            bounds = self._buckets[name]
+            for (series_name, labels), (counts, total, count) in sorted(self._histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, bucket_count in zip(bounds, counts):
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("autoscaler_queue_length", "gauge", "Messages in the RabbitMQ queue at the last check.")
+metrics.describe("autoscaler_active_vms", "gauge", "Active GPU VMs matching the label prefix and tags.")
+metrics.describe("autoscaler_ready_vms", "gauge", "GPU VMs that passed the READINESS_CHECK probe.")
+metrics.describe("autoscaler_desired_vms", "gauge", "VM count the scaler is aiming for, bounded by MIN_VMS/MAX_VMS.")
+metrics.describe("autoscaler_provisioning_vms", "gauge", "VMs currently tracked in vm_provision_tracking.")
+metrics.describe("autoscaler_vm_provision_seconds", "histogram",
+                 "Time from VM create to ready (see READINESS_CHECK).", PROVISION_TIME_BUCKETS)
+metrics.describe("autoscaler_api_request_seconds", "histogram",
+                 "Latency of Linode/RabbitMQ API requests by endpoint.", API_LATENCY_BUCKETS)
+metrics.describe("autoscaler_api_errors_total", "counter", "Failed API requests by endpoint and reason.")
+metrics.describe("autoscaler_cooldown_seconds_total", "counter", "Time spent waiting in scale cooldown.")
+metrics.describe("autoscaler_loop_duration_seconds", "histogram",
+                 "Duration of one autoscaler loop iteration (excluding the interval sleep).", LOOP_DURATION_BUCKETS)
+metrics.describe("autoscaler_vms_created_total", "counter", "VMs successfully created.")
+metrics.describe("autoscaler_vms_deleted_total", "counter", "VMs successfully deleted.")
+
+def api_endpoint_name(method, url):
+    """Collapse a request URL into a low-cardinality endpoint label (IDs replaced by ':id')."""
+    path = url.path if url.host == "api.linode.com" else "/rabbitmq" + url.path.split("/api", 1)[-1]
+    parts = [":id" if part.isdigit() else part for part in path.split("/")]
+    if url.host != "api.linode.com" and len(parts) > 3:
+        parts = parts[:3] + [":queue"]  # Don't leak vhost/queue names into labels
+    return f"{method} {'/'.join(parts)}"
+
+async def _on_request_start(session, ctx, params):
+    ctx.start = time.monotonic()
+
+async def _on_request_end(session, ctx, params):
+    endpoint = api_endpoint_name(params.method, params.url)
+    metrics.observe("autoscaler_api_request_seconds", time.monotonic() - ctx.start, endpoint=endpoint)
+    if params.response.status >= 400:
+        metrics.inc_counter("autoscaler_api_errors_total", endpoint=endpoint, reason=str(params.response.status))
+
+async def _on_request_exception(session, ctx, params):
+    endpoint = api_endpoint_name(params.method, params.url)
+    metrics.observe("autoscaler_api_request_seconds", time.monotonic() - ctx.start, endpoint=endpoint)
+    metrics.inc_counter("autoscaler_api_errors_total", endpoint=endpoint, reason=type(params.exception).__name__)
+
+API_TRACE_CONFIG = aiohttp.TraceConfig()
+API_TRACE_CONFIG.on_request_start.append(_on_request_start)
+API_TRACE_CONFIG.on_request_end.append(_on_request_end)
+API_TRACE_CONFIG.on_request_exception.append(_on_request_exception)
+
+def new_session():
+    """Create an aiohttp session whose requests are recorded in the API metrics."""
+    return aiohttp.ClientSession(trace_configs=[API_TRACE_CONFIG])
+
+def record_provision_time(elapsed_seconds):
+    """Record a create-to-running duration in the provisioning histogram."""
+    metrics.observe("autoscaler_vm_provision_seconds", elapsed_seconds)
+
+async def start_metrics_server():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT using aiohttp.web."""
+    if METRICS_PORT <= 0:
+        logger.info("Metrics endpoint disabled (METRICS_PORT=0)")
+        return None
+
+    async def handle_metrics(request):
+        metrics.set_gauge("autoscaler_provisioning_vms", len(vm_provision_tracking))
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, METRICS_HOST, METRICS_PORT)
+    await site.start()
+    logger.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
 #Check Instance status function
 async def check_vm_running_status(vm_id, session):
     """Check the status of a Linode VM."""
@@ -80,18 +260,133 @@ async def check_vm_running_status(vm_id, session):
         logger.error(f"Error checking VM status: {str(e)}")
         return None
 
+#Fetch a single instance
+async def fetch_vm(vm_id, session):
+    """Return the Linode instance payload, or None on failure."""
+    try:
+        async with session.get(f"{LINODE_API_URL}/{vm_id}", headers=HEADERS) as response:
+            if response.status == 200:
+                return await response.json()
+            logger.error(f"Failed to fetch VM {vm_id}: {await response.text()}")
+            return None
+    except Exception as e:
+        logger.error(f"Error fetching VM {vm_id}: {str(e)}")
+        return None
+
+def vm_public_ipv4(instance):
+    """First public IPv4 of an instance (private 192.168.x addresses are skipped)."""
+    for ip in instance.get("ipv4", []):
+        if not ip.startswith("192.168."):
+            return ip
+    return None
+
+#Readiness probes
+async def probe_tcp(ip):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, READINESS_PORT), READINESS_TIMEOUT)
+        writer.close()
+        await writer.wait_closed()
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+async def probe_http(ip, session):
+    try:
+        async with session.get(
+            READINESS_HTTP_URL.format(ip=ip),
+            timeout=aiohttp.ClientTimeout(total=READINESS_TIMEOUT)
+        ) as response:
+            return 200 <= response.status < 300
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+async def get_rabbitmq_consumer_hosts(session, queue_url=RABBITMQ_API_URL):
+    """Return the peer hosts of every consumer attached to the queue (one API call)."""
+    try:
+        async with session.get(queue_url, auth=aiohttp.BasicAuth(RABBITMQ_USER, RABBITMQ_PASS)) as response:
+            if response.status != 200:
+                logger.error(f"Failed to get queue consumers: {await response.text()}")
+                return set()
+            data = await response.json()
+    except Exception as e:
+        logger.error(f"Error fetching queue consumers: {str(e)}")
+        return set()
+    return {
+        consumer.get("channel_details", {}).get("peer_host")
+        for consumer in data.get("consumer_details", [])
+    }
+
+async def refresh_vm_readiness(instances, session, ready_ids=ready_vm_ids, queue_url=RABBITMQ_API_URL):
+    """
+    Probe every running, not-yet-ready instance concurrently (bounded by READINESS_CONCURRENCY)
+    and update ready_ids in place. VMs that left "running" or disappeared lose their ready flag.
+    """
+    running = [inst for inst in instances if inst["status"] == "running"]
+    ready_ids.intersection_update(inst["id"] for inst in running)
+    pending = [inst for inst in running if inst["id"] not in ready_ids]
+    if not pending:
+        return ready_ids
+
+    if READINESS_CHECK == "status":
+        ready_ids.update(inst["id"] for inst in pending)
+        return ready_ids
+
+    if READINESS_CHECK == "rabbitmq":
+        consumer_hosts = await get_rabbitmq_consumer_hosts(session, queue_url)
+        ready_ids.update(
+            inst["id"] for inst in pending
+            if consumer_hosts.intersection(inst.get("ipv4", []))
+        )
+        return ready_ids
+
+    semaphore = asyncio.Semaphore(READINESS_CONCURRENCY)
+
+    async def probe(instance, probe_session):
+        ip = vm_public_ipv4(instance)
+        if ip is None:
+            return False
+        async with semaphore:
+            if READINESS_CHECK == "tcp":
+                return await probe_tcp(ip)
+            return await probe_http(ip, probe_session)
+
+    # Probes go to the worker VMs, not the APIs: use a session without API_TRACE_CONFIG so they
+    # do not show up in the API request/error metrics
+    async with aiohttp.ClientSession() as probe_session:
+        results = await asyncio.gather(*(probe(inst, probe_session) for inst in pending))
+    ready_ids.update(inst["id"] for inst, ok in zip(pending, results) if ok)
+    return ready_ids
+
+def count_vm_capacity(instances, ready_ids, tracking):
+    """
+    Capacity used by the scaling math: ready VMs plus VMs still inside their provisioning
+    window. VMs that booted but never became ready stop counting once the window expires.
+    """
+    now = datetime.now()
+    capacity = 0
+    for inst in instances:
+        if inst["id"] in ready_ids:
+            capacity += 1
+            continue
+        started = tracking.get(inst["id"], now)  # Untracked VMs count as just started
+        if (now - started).total_seconds() < MAX_PROVISION_WAIT_TIME:
+            capacity += 1
+    return capacity
+
 #Fetch RabbitMQ Queue Length
 async def get_queue_length():
     """Fetch RabbitMQ queue length."""
     try:
-        async with aiohttp.ClientSession() as session:
+        async with new_session() as session:
             async with session.get(
                 RABBITMQ_API_URL,
                 auth=aiohttp.BasicAuth(RABBITMQ_USER, RABBITMQ_PASS)
             ) as response:
                 if response.status == 200:
                     data = await response.json()
-                    return data.get("messages", 0)
+                    queue_length = data.get("messages", 0)
+                    metrics.set_gauge("autoscaler_queue_length", queue_length)
+                    return queue_length
                 else:
                     logger.error(f"Failed to get queue length: {await response.text()}")
                     return -1
@@ -100,10 +395,13 @@ async def get_queue_length():
         return -1
 
 #fetch active instance created
-async def get_active_gpu_vm_count():
-    """Fetch active Linode VMs with label starting with 'gpu-'."""
+async def get_active_gpu_vm_count(include_unready=False):
+    """
+    Fetch GPU VM capacity: ready VMs plus VMs still provisioning (see count_vm_capacity).
+    With include_unready=True every matching VM is counted, e.g. for the MAX_VMS check.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
+        async with new_session() as session:
             async with session.get(LINODE_API_URL, headers=HEADERS) as response:
                 if response.status == 200:
                     data = await response.json()
@@ -118,7 +416,16 @@ async def get_active_gpu_vm_count():
                     for vm in gpu_vms:
                         logger.info(f"  - VM {vm['label']} (ID: {vm['id']}) with tags: {vm.get('tags', [])}")
                     
-                    return len(gpu_vms)
+                    metrics.set_gauge("autoscaler_active_vms", len(gpu_vms))
+                    if include_unready:
+                        return len(gpu_vms)
+
+                    await refresh_vm_readiness(gpu_vms, session)
+                    capacity = count_vm_capacity(gpu_vms, ready_vm_ids, vm_provision_tracking)
+                    ready_count = sum(1 for vm in gpu_vms if vm["id"] in ready_vm_ids)
+                    metrics.set_gauge("autoscaler_ready_vms", ready_count)
+                    logger.info(f"GPU VM capacity: {capacity} ({ready_count} ready, {capacity - ready_count} provisioning)")
+                    return capacity
                 else:
                     logger.error(f"Failed to get active VM count: {await response.text()}")
                     return -1
@@ -187,6 +494,7 @@ async def handle_scale_cooldown(bypass_cooldown=False):
     if scale_timestamps and not bypass_cooldown:
         wait_time = (SCALE_COOLDOWN - (now - scale_timestamps[0]).seconds)
         logger.info(f"Scale cooldown active! Waiting {wait_time} seconds before next scale operation...")
+        metrics.inc_counter("autoscaler_cooldown_seconds_total", wait_time)
         await asyncio.sleep(wait_time)
         return False
     
@@ -196,7 +504,7 @@ async def handle_scale_cooldown(bypass_cooldown=False):
 async def provision_vm(bypass_cooldown=False):
     """Create a new Linode GPU VM with a label starting with 'gpu-'."""
     global vm_creation_timestamps, scale_timestamps  # Explicitly declare globals
-    current_vms = await get_active_gpu_vm_count()
+    current_vms = await get_active_gpu_vm_count(include_unready=True)
     
     # Double check MAX_VMS limit before proceeding
     if current_vms >= MAX_VMS:
@@ -215,11 +523,13 @@ async def provision_vm(bypass_cooldown=False):
     now = datetime.now()
     
     try:
-        async with aiohttp.ClientSession() as session:
+        async with new_session() as session:
             # Create VM instance
             vm_data = await create_vm_instance(session, vm_label)
             if vm_data:
                 logger.info(f"✅ VM {vm_data['label']} creation initiated.")
+                metrics.inc_counter("autoscaler_vms_created_total")
+                vm_provision_tracking.setdefault(vm_data["id"], now)  # Start the create-to-running clock
                 vm_creation_timestamps.append(now)  # Store timestamp after successful creation
                 if not bypass_cooldown:  # Only add to scale timestamps if not bypassing cooldown
                     scale_timestamps.append(now)
@@ -236,6 +546,7 @@ async def delete_vm(vm_id, session):
         async with session.delete(f"{LINODE_API_URL}/{vm_id}", headers=HEADERS) as response:
             if response.status == 200:
                 logger.info(f"VM {vm_id} deleted")
+                metrics.inc_counter("autoscaler_vms_deleted_total")
                 return True
             else:
                 logger.error(f"Failed to delete VM {vm_id}")
@@ -291,7 +602,7 @@ async def delete_idle_gpu_vm():
         if not await handle_scale_cooldown(bypass_cooldown=False):
             return
 
-        async with aiohttp.ClientSession() as session:
+        async with new_session() as session:
             # Get current VM instances
             async with session.get(LINODE_API_URL, headers=HEADERS) as response:
                 if response.status != 200:
@@ -303,6 +614,9 @@ async def delete_idle_gpu_vm():
                 gpu_instances = [inst for inst in instances 
                                if inst["label"].startswith("gpu-") 
                                and all(tag in inst.get("tags", []) for tag in VM_TAGS)]
+                # Only ready VMs are real capacity and only they are deletion candidates
+                await refresh_vm_readiness(gpu_instances, session)
+                gpu_instances = [inst for inst in gpu_instances if inst["id"] in ready_vm_ids]
                 active_vm_count = len(gpu_instances)
 
                 # If we're at or below minimum VMs, don't delete any
@@ -351,11 +665,7 @@ async def delete_idle_gpu_vm():
                     vm_name = instance["label"]
                     vm_id = instance["id"]
                     
-                    # Check VM status
-                    vm_status = await check_vm_running_status(vm_id, session)
-                    if vm_status != "running":
-                        logger.info(f"⏳ VM {vm_name} (ID: {vm_id}) is not running, skipping...")
-                        continue
+                    # Status and readiness were already taken from the listing above
 
                     # Check if VM should be deleted
                     logger.info(f"⚠️ Preparing to delete VM {vm_name} (ID: {vm_id})")
@@ -363,6 +673,7 @@ async def delete_idle_gpu_vm():
                     # Delete the VM
                     if await delete_vm(vm_id, session):
                         deleted_count += 1
+                        ready_vm_ids.discard(vm_id)
 
                 # Only add timestamp after all planned deletions are complete
                 if deleted_count > 0:
@@ -386,12 +697,18 @@ async def delete_idle_gpu_vm():
         )
 
 async def monitor_vm_status(vm_id, vm_label, session):
-    """Monitor a single VM's provisioning status in a separate thread."""
+    """Monitor a single VM until it passes the readiness check."""
+    # Status-only readiness keeps the original 5 minute budget; probes get the full provisioning window
+    attempts = 30 if READINESS_CHECK == "status" else MAX_PROVISION_WAIT_TIME // 10
     try:
-        for _ in range(30):  # Check for up to 5 minutes (10s interval)
-            status = await check_vm_running_status(vm_id, session)
-            if status == "running":
+        for _ in range(attempts):  # 10s interval
+            instance = await fetch_vm(vm_id, session)
+            if instance and vm_id in await refresh_vm_readiness([instance], session, set(ready_vm_ids)):
+                ready_vm_ids.add(vm_id)
                 logger.info(f"VM {vm_label} ready")
+                if vm_id in vm_provision_tracking:
+                    start_time = vm_provision_tracking.pop(vm_id)
+                    record_provision_time((datetime.now() - start_time).total_seconds())
                 return True
             await asyncio.sleep(10)
         
@@ -404,13 +721,13 @@ async def monitor_vm_status(vm_id, vm_label, session):
 
 async def monitor_vm_provisioning():
     """
-    Monitor VMs that are being provisioned and delete them if they don't reach running status
-    within the maximum wait time.
+    Monitor VMs that are being provisioned and delete them if they don't pass the readiness
+    check within the maximum wait time.
     """
     logger.info(f"Starting VM provisioning monitor at {datetime.now()}")
     
     try:
-        async with aiohttp.ClientSession() as session:
+        async with new_session() as session:
             async with session.get(LINODE_API_URL, headers=HEADERS) as response:
                 if response.status != 200:
                     logger.error(f"Failed to fetch Linode instances: {await response.text()}")
@@ -422,19 +739,20 @@ async def monitor_vm_provisioning():
                 
                 # Create tasks for monitoring each VM
                 monitoring_tasks = []
+
+                # Probe all pending GPU VMs in one bounded batch
+                gpu_instances = [inst for inst in instances if inst["label"].startswith("gpu-")]
+                await refresh_vm_readiness(gpu_instances, session)
                 
                 # Check all instances
-                for instance in instances:
+                for instance in gpu_instances:
                     vm_id = instance["id"]
                     vm_label = instance["label"]
                     status = instance["status"]
-                    
-                    # Skip non-GPU VMs
-                    if not vm_label.startswith("gpu-"):
-                        continue
+                    ready = vm_id in ready_vm_ids
                     
                     # Add to tracking if not already tracked
-                    if vm_id not in vm_provision_tracking and status != "running":
+                    if vm_id not in vm_provision_tracking and not ready:
                         vm_provision_tracking[vm_id] = current_time
                         logger.info(f"Started tracking VM {vm_label} (ID: {vm_id}) at {current_time}")
                         # Create monitoring task for this VM
@@ -443,26 +761,27 @@ async def monitor_vm_provisioning():
                         )
                         continue
                     
-                    # Check if VM has been in non-running state too long
-                    if vm_id in vm_provision_tracking and status != "running":
+                    # Check if VM has been not ready for too long
+                    if vm_id in vm_provision_tracking and not ready:
                         start_time = vm_provision_tracking[vm_id]
                         elapsed_time = (current_time - start_time).total_seconds()
                         
                         if elapsed_time >= MAX_PROVISION_WAIT_TIME:
                             logger.warning(
-                                f"VM {vm_label} (ID: {vm_id}) has been in {status} status for "
+                                f"VM {vm_label} (ID: {vm_id}) has not been ready ({status}) for "
                                 f"{elapsed_time:.1f} seconds (started at {start_time})"
                             )
                             vms_to_delete.add(vm_id)
                     
-                    # Remove from tracking if running
-                    elif status == "running" and vm_id in vm_provision_tracking:
+                    # Remove from tracking if ready
+                    elif ready and vm_id in vm_provision_tracking:
                         start_time = vm_provision_tracking[vm_id]
                         elapsed_time = (current_time - start_time).total_seconds()
                         logger.info(
-                            f"VM {vm_label} (ID: {vm_id}) is now running after "
+                            f"VM {vm_label} (ID: {vm_id}) is now ready after "
                             f"{elapsed_time:.1f} seconds (started at {start_time})"
                         )
+                        record_provision_time(elapsed_time)
                         del vm_provision_tracking[vm_id]
                 
                 # Wait for all monitoring tasks to complete
@@ -508,7 +827,7 @@ async def ensure_minimum_gpu_vms():
             monitoring_tasks = []
             
             # Create a single session for all monitoring tasks
-            async with aiohttp.ClientSession() as session:
+            async with new_session() as session:
                 for i in range(vms_needed):
                     try:
                         # Handle rate limiting before creating VM
@@ -552,6 +871,9 @@ async def ensure_minimum_gpu_vms():
 #main function for autoscaller logic
 async def autoscaler_loop():
     """Main loop to monitor queue length and scale VMs."""
+    # Expose metrics before the (possibly long) initial provisioning
+    await start_metrics_server()
+
     # Ensure minimum VMs are running at startup
     await ensure_minimum_gpu_vms()
     
@@ -560,11 +882,14 @@ async def autoscaler_loop():
     
     # Main autoscaler loop
     while True:
+        loop_started = time.monotonic()
         try:
             queue_length = await get_queue_length()
             active_gpu_vms = await get_active_gpu_vm_count()
 
             logger.info(f"Queue Length: {queue_length}, Active GPU VMs: {active_gpu_vms}")
+            if queue_length >= 0:
+                metrics.set_gauge("autoscaler_desired_vms", max(MIN_VMS, min(MAX_VMS, queue_length)))
 
             # If we have no active VMs and there are items in the queue, create VMs immediately
             if active_gpu_vms == 0 and queue_length > 0:
@@ -602,12 +927,14 @@ async def autoscaler_loop():
                     scale_timestamps.append(datetime.now())
                     # Check cooldown after creating VMs
                     if not await handle_scale_cooldown(bypass_cooldown=False):
+                        metrics.observe("autoscaler_loop_duration_seconds", time.monotonic() - loop_started)
                         await asyncio.sleep(RABBIT_MQ_TIME_INTERVAL_CHECK)
                         continue
             elif queue_length < active_gpu_vms and active_gpu_vms > MIN_VMS:
                 logger.info("Checking for VMs to scale down...")
                 await delete_idle_gpu_vm()
 
+            metrics.observe("autoscaler_loop_duration_seconds", time.monotonic() - loop_started)
             await asyncio.sleep(RABBIT_MQ_TIME_INTERVAL_CHECK)
         
         except Exception as e:
@@ -624,5 +951,248 @@ async def run_vm_monitoring():
             logger.error(f"Error in VM monitoring loop: {str(e)}")
             await asyncio.sleep(30)  # Wait before retrying
 
+#Sliding-window limiter shared by every pool
+class ApiRateLimiter:
+    """Allow at most max_requests per period seconds across all coroutines."""
+
+    def __init__(self, max_requests, period):
+        self.max_requests = max_requests
+        self.period = period
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.period:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_requests:
+                    self._timestamps.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._timestamps[0]))
+
+# One budget for all Linode calls, plus the 10 creates / 30 s window used by handle_rate_limit()
+linode_api_budget = ApiRateLimiter(LINODE_API_REQUESTS_PER_MINUTE, 60)
+vm_create_budget = ApiRateLimiter(10, 30)
+
+#Fetch every Linode instance once per tick (shared by all pools)
+async def fetch_all_instances(session):
+    """Return the full, paginated instance list, or None on failure."""
+    instances = []
+    page = 1
+    while True:
+        await linode_api_budget.acquire()
+        async with session.get(
+            LINODE_API_URL,
+            headers=HEADERS,
+            params={"page": page, "page_size": INSTANCE_LIST_PAGE_SIZE}
+        ) as response:
+            if response.status != 200:
+                logger.error(f"Failed to fetch Linode instances: {await response.text()}")
+                return None
+            data = await response.json()
+        instances.extend(data.get("data", []))
+        if page >= data.get("pages", 1):
+            return instances
+        page += 1
+
+#Load pool definitions
+def load_pool_configs(path):
+    """Read the pools JSON file, filling missing fields from the single-pool environment settings."""
+    with open(path) as f:
+        raw = json.load(f)
+
+    pools = []
+    for entry in raw.get("pools", []):
+        name = entry["name"]
+        pools.append({
+            "name": name,
+            "queue": entry["queue"],
+            "vhost": entry.get("vhost", os.getenv("RABBITMQ_VHOST", "/")),
+            "tags": [tag.strip() for tag in entry.get("tags", VM_TAGS)],
+            "label_prefix": entry.get("label_prefix", f"{name}-"),
+            "type": entry.get("type", "g6-standard-1"),
+            "region": entry.get("region", "us-east"),
+            "image": entry.get("image", "linode/ubuntu22.04"),
+            "firewall_id": entry.get("firewall_id", 849035),
+            "min_vms": int(entry.get("min_vms", MIN_VMS)),
+            "max_vms": int(entry.get("max_vms", MAX_VMS)),
+            "scale_threshold": int(entry.get("scale_threshold", SCALE_THRESHOLD)),
+            "scale_cooldown": int(entry.get("scale_cooldown", SCALE_COOLDOWN)),
+        })
+
+    names = [pool["name"] for pool in pools]
+    if not pools or len(names) != len(set(names)):
+        raise ValueError(f"{path} must define at least one pool and pool names must be unique")
+    return pools
+
+class PoolScaler:
+    """Scaling state and decisions for one queue/VM-type pool in multi-pool mode."""
+
+    def __init__(self, config):
+        self.config = config
+        self.name = config["name"]
+        self.queue_url = (
+            f"{RABBITMQ_ENDPOINT}/api/queues/{quote_plus(config['vhost'])}/{config['queue']}"
+        )
+        self.last_scale_time = None
+        self.provision_tracking: Dict[int, datetime] = {}
+        self.ready_ids: Set[int] = set()
+
+    def owns(self, instance):
+        """True if the instance belongs to this pool (label prefix and all tags)."""
+        return (instance["label"].startswith(self.config["label_prefix"])
+                and all(tag in instance.get("tags", []) for tag in self.config["tags"]))
+
+    def in_cooldown(self):
+        if self.last_scale_time is None:
+            return False
+        return (datetime.now() - self.last_scale_time).total_seconds() < self.config["scale_cooldown"]
+
+    async def get_queue_length(self, session):
+        try:
+            async with session.get(
+                self.queue_url,
+                auth=aiohttp.BasicAuth(RABBITMQ_USER, RABBITMQ_PASS)
+            ) as response:
+                if response.status == 200:
+                    return (await response.json()).get("messages", 0)
+                logger.error(f"[{self.name}] Failed to get queue length: {await response.text()}")
+                return -1
+        except Exception as e:
+            logger.error(f"[{self.name}] Error fetching queue length: {str(e)}")
+            return -1
+
+    async def create_vm(self, session):
+        await vm_create_budget.acquire()
+        await linode_api_budget.acquire()
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        label = f"{self.config['label_prefix']}{timestamp}-{os.urandom(2).hex()}"
+        async with session.post(
+            LINODE_API_URL,
+            headers=HEADERS,
+            json={
+                "type": self.config["type"],
+                "region": self.config["region"],
+                "image": self.config["image"],
+                "label": label,
+                "root_pass": "your_secure_password",
+                "firewall_id": self.config["firewall_id"],
+                "tags": self.config["tags"]
+            }
+        ) as response:
+            if response.status != 200:
+                logger.error(f"[{self.name}] Failed to create VM: {await response.text()}")
+                return None
+            vm_data = await response.json()
+        logger.info(f"[{self.name}] VM {label} (ID: {vm_data['id']}) creation initiated.")
+        metrics.inc_counter("autoscaler_vms_created_total", pool=self.name)
+        self.provision_tracking[vm_data["id"]] = datetime.now()
+        return vm_data
+
+    async def delete_vm(self, session, vm_id):
+        await linode_api_budget.acquire()
+        return await delete_vm(vm_id, session)
+
+    async def track_provisioning(self, session, pool_instances):
+        """Update create-to-ready tracking from the shared listing and delete stuck VMs."""
+        await refresh_vm_readiness(pool_instances, session, self.ready_ids, self.queue_url)
+        now = datetime.now()
+        statuses = {inst["id"]: inst["status"] for inst in pool_instances}
+        for vm_id in statuses:
+            if vm_id not in self.ready_ids:
+                self.provision_tracking.setdefault(vm_id, now)
+
+        for vm_id, started in list(self.provision_tracking.items()):
+            status = statuses.get(vm_id)
+            elapsed = (now - started).total_seconds()
+            if vm_id in self.ready_ids:
+                logger.info(f"[{self.name}] VM {vm_id} is now ready after {elapsed:.1f} seconds")
+                record_provision_time(elapsed)
+                del self.provision_tracking[vm_id]
+            elif status is None and elapsed > 60:
+                del self.provision_tracking[vm_id]  # Deleted elsewhere
+            elif status is not None and elapsed >= MAX_PROVISION_WAIT_TIME:
+                logger.warning(f"[{self.name}] Deleting VM {vm_id} stuck in {status} for {elapsed:.1f} seconds")
+                await self.delete_vm(session, vm_id)
+                del self.provision_tracking[vm_id]
+
+    async def scale(self, session, instances):
+        """Run one scaling decision for this pool against the shared instance snapshot."""
+        cfg = self.config
+        pool_instances = [inst for inst in instances if self.owns(inst)]
+        await self.track_provisioning(session, pool_instances)
+
+        queue_length = await self.get_queue_length(session)
+        active = count_vm_capacity(pool_instances, self.ready_ids, self.provision_tracking)
+        ready_instances = [inst for inst in pool_instances if inst["id"] in self.ready_ids]
+        metrics.set_gauge("autoscaler_queue_length", max(queue_length, 0), pool=self.name)
+        metrics.set_gauge("autoscaler_active_vms", len(pool_instances), pool=self.name)
+        metrics.set_gauge("autoscaler_ready_vms", len(ready_instances), pool=self.name)
+        metrics.set_gauge("autoscaler_provisioning_vms", len(self.provision_tracking), pool=self.name)
+        logger.info(f"[{self.name}] Queue Length: {queue_length}, Capacity: {active} ({len(ready_instances)} ready)")
+        if queue_length == -1:
+            return
+        metrics.set_gauge("autoscaler_desired_vms",
+                          max(cfg["min_vms"], min(cfg["max_vms"], queue_length)), pool=self.name)
+
+        if active < cfg["min_vms"] or (active == 0 and queue_length > 0):
+            # Below minimum or nothing serving a non-empty queue: bypass cooldown
+            to_create = min(cfg["max_vms"] - len(pool_instances),
+                            max(cfg["min_vms"] - active, min(cfg["scale_threshold"], cfg["max_vms"], queue_length)))
+        elif queue_length > active and len(pool_instances) < cfg["max_vms"] and not self.in_cooldown():
+            to_create = min(cfg["scale_threshold"], cfg["max_vms"] - len(pool_instances), queue_length - active)
+        else:
+            to_create = 0
+
+        if to_create > 0:
+            logger.info(f"[{self.name}] Creating {to_create} VMs")
+            results = await asyncio.gather(*(self.create_vm(session) for _ in range(to_create)),
+                                           return_exceptions=True)
+            if any(result and not isinstance(result, Exception) for result in results):
+                self.last_scale_time = datetime.now()
+            return
+
+        ready = len(ready_instances)
+        surplus = ready - queue_length
+        if (ready > cfg["min_vms"] and surplus >= cfg["scale_threshold"] and not self.in_cooldown()):
+            to_delete = min(ready - cfg["min_vms"], surplus)
+            candidates = sorted(ready_instances, key=lambda inst: inst.get("created", ""))[:to_delete]
+            if not candidates:
+                return
+            logger.info(f"[{self.name}] Deleting {len(candidates)} VMs (surplus {surplus})")
+            results = await asyncio.gather(*(self.delete_vm(session, inst["id"]) for inst in candidates),
+                                           return_exceptions=True)
+            if any(result is True for result in results):
+                self.last_scale_time = datetime.now()
+
+#main function for multi-pool autoscaler logic
+async def multi_pool_autoscaler_loop(config_path):
+    """Scale every configured pool concurrently from one shared instance listing per tick."""
+    scalers = [PoolScaler(config) for config in load_pool_configs(config_path)]
+    logger.info(f"Multi-pool mode: {', '.join(scaler.name for scaler in scalers)}")
+    await start_metrics_server()
+
+    async with new_session() as session:
+        while True:
+            loop_started = time.monotonic()
+            try:
+                instances = await fetch_all_instances(session)
+                if instances is not None:
+                    results = await asyncio.gather(*(scaler.scale(session, instances) for scaler in scalers),
+                                                   return_exceptions=True)
+                    for scaler, result in zip(scalers, results):
+                        if isinstance(result, Exception):
+                            logger.error(f"[{scaler.name}] Error scaling pool: {str(result)}")
+            except Exception as e:
+                logger.error(f"Error in multi_pool_autoscaler_loop: {str(e)}")
+
+            metrics.observe("autoscaler_loop_duration_seconds", time.monotonic() - loop_started)
+            await asyncio.sleep(RABBIT_MQ_TIME_INTERVAL_CHECK)
+
 if __name__ == "__main__":
-    asyncio.run(autoscaler_loop())
\ No newline at end of file
+    if POOLS_CONFIG:
+        asyncio.run(multi_pool_autoscaler_loop(POOLS_CONFIG))
+    else:
+        asyncio.run(autoscaler_loop())
\ No newline at end of file
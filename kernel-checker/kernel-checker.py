@@ -1,42 +1,70 @@
+import argparse
 import requests
 import json
+import os
+import re
+import threading
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
 
 # Configuration
 API_TOKEN = ""  # Replace with your Linode API token
 BASE_URL = f"https://api.linode.com/v4"
 RATE_LIMIT_REQUESTS = 800  # Linode API rate limit: 800 requests per minute
 RATE_LIMIT_PERIOD = 60  # Seconds in a minute
-REQUEST_INTERVAL = RATE_LIMIT_PERIOD / RATE_LIMIT_REQUESTS  # Time between requests
 PAGE_SIZE = 100  # Number of results per page, max supported by Linode API
+MAX_WORKERS = 16  # Concurrent config fetches, all sharing the rate limiter
+WAVE_SIZE = 10  # Instances updated and rebooted together in one wave
+MAX_UNAVAILABLE = 5  # Max instances of one group rebooting at the same time
+WAVE_GROUP_BY = None  # None, "label" (label without numeric suffix) or "tag" (first tag)
+REBOOT_TIMEOUT = 900  # Seconds to wait for a wave to come back before giving up
+EVENT_POLL_INTERVAL = 10  # Seconds between /account/events polls
+HALT_ON_FAILURE = True  # Stop the rollout if any instance of a wave does not come back
+USE_CONFIG_CACHE = True  # Reuse configs of instances whose "updated" timestamp did not change
+CONFIG_CACHE_FILE = "kernel-checker-config-cache.json"  # Local config snapshot store
+PLAN_FILE = "kernel-checker-plan.json"  # Written by "plan", executed by "apply"
+JOURNAL_FILE = "kernel-checker-journal.jsonl"  # Append-only log of steps completed by "apply"
 
-# Track request timestamps for rate limiting
-request_timestamps = []
+# Track request timestamps for rate limiting (sliding window shared by all worker threads)
+request_timestamps = deque()
+rate_limit_lock = threading.Lock()
 # Counter for configurations needing kernel change
 kernel_change_count = 0
 # Counter for scanned instances
 instance_count = 0
+# Tags of scanned instances (used when WAVE_GROUP_BY = "tag")
+instance_tags = {}
+# Config snapshots keyed by linode_id, and how many instances were served from it
+config_cache = {}
+cache_hits = 0
+cache_hits_lock = threading.Lock()
+# Steps completed by "apply": ("update", linode_id, config_id), ("reboot", linode_id, None), ("online", linode_id, None)
+completed_steps = set()
+journal_lock = threading.Lock()
+journal_enabled = False
 
 #rate-limit function
 def enforce_rate_limit():
-    """Ensure API requests stay within rate limits."""
-    current_time = time.time()
-    # Remove timestamps older than RATE_LIMIT_PERIOD
-    global request_timestamps
-    request_timestamps = [t for t in request_timestamps if current_time - t < RATE_LIMIT_PERIOD]
-    
-    # If we've hit the rate limit, sleep until we can make another request
-    if len(request_timestamps) >= RATE_LIMIT_REQUESTS:
-        sleep_time = RATE_LIMIT_PERIOD - (current_time - request_timestamps[0])
-        if sleep_time > 0:
-            print(f"Rate limit reached, sleeping for {sleep_time:.2f} seconds")
-            time.sleep(sleep_time)
-    
-    # Record the new request timestamp
-    request_timestamps.append(time.time())
-    # Sleep briefly to pace requests
-    time.sleep(REQUEST_INTERVAL)
+    """Ensure API requests stay within rate limits, waiting only when the window is full."""
+    while True:
+        with rate_limit_lock:
+            current_time = time.monotonic()
+            # Drop timestamps older than RATE_LIMIT_PERIOD (each one is removed exactly once)
+            while request_timestamps and current_time - request_timestamps[0] >= RATE_LIMIT_PERIOD:
+                request_timestamps.popleft()
+
+            # Record the new request timestamp if there is budget left
+            if len(request_timestamps) < RATE_LIMIT_REQUESTS:
+                request_timestamps.append(current_time)
+                return
+            sleep_time = RATE_LIMIT_PERIOD - (current_time - request_timestamps[0])
+
+        # Budget exhausted: sleep outside the lock until the oldest request leaves the window
+        print(f"Rate limit reached, sleeping for {sleep_time:.2f} seconds")
+        time.sleep(sleep_time)
 
 def get_headers():
     return {
@@ -44,6 +72,10 @@ def get_headers():
         "Content-Type": "application/json"
     }
 
+# Shared keep-alive connection pool sized for the worker threads
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
 #function to get the list of instances
 def get_linode_instances():
     """Fetch all Linode instances, handling pagination and displaying total pages."""
@@ -54,7 +86,7 @@ def get_linode_instances():
     while True:
         enforce_rate_limit()
         try:
-            response = requests.get(
+            response = session.get(
                 f"{BASE_URL}/linode/instances?page={page}&page_size={PAGE_SIZE}",
                 headers=get_headers()
             )
@@ -82,7 +114,7 @@ def get_linode_configs(linode_id):
     """Fetch configurations for a specific Linode instance."""
     enforce_rate_limit()
     try:
-        response = requests.get(
+        response = session.get(
             f"{BASE_URL}/linode/instances/{linode_id}/configs?page_size={PAGE_SIZE}",
             headers=get_headers()
         )
@@ -98,13 +130,15 @@ def update_linode_kernel(linode_id, config_id, kernel_id="linode/grub2"):
     enforce_rate_limit()
     try:
         payload = {"kernel": kernel_id}
-        response = requests.put(
+        response = session.put(
             f"{BASE_URL}/linode/instances/{linode_id}/configs/{config_id}",
             headers=get_headers(),
             data=json.dumps(payload)
         )
         response.raise_for_status()
         print(f"Updated kernel to GRUB for Linode {linode_id}, config {config_id}")
+        # The snapshot no longer matches this instance
+        config_cache.pop(str(linode_id), None)
         return True
     except requests.RequestException as e:
         print(f"Error updating kernel for Linode {linode_id}, config {config_id}: {e}")
@@ -115,7 +149,7 @@ def reboot_linode(linode_id):
     """Reboot a Linode instance."""
     enforce_rate_limit()
     try:
-        response = requests.post(
+        response = session.post(
             f"{BASE_URL}/linode/instances/{linode_id}/reboot",
             headers=get_headers()
         )
@@ -126,6 +160,44 @@ def reboot_linode(linode_id):
         print(f"Error rebooting Linode {linode_id}: {e}")
         return False
 
+#function to load the config snapshot cache
+def load_config_cache():
+    """Load {linode_id: {"updated": ..., "configs": [...]}} from CONFIG_CACHE_FILE."""
+    if not USE_CONFIG_CACHE or not os.path.exists(CONFIG_CACHE_FILE):
+        return {}
+    try:
+        with open(CONFIG_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable config cache {CONFIG_CACHE_FILE}: {e}")
+        return {}
+
+#function to save the config snapshot cache
+def save_config_cache():
+    """Write the cache atomically so an interrupted run never leaves a truncated file."""
+    if not USE_CONFIG_CACHE:
+        return
+    tmp_file = f"{CONFIG_CACHE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(config_cache, f)
+    os.replace(tmp_file, CONFIG_CACHE_FILE)
+
+#function to get configs from the cache, refetching only instances whose "updated" changed
+def get_linode_configs_cached(linode):
+    """Return the configs of an instance, using the snapshot when its 'updated' timestamp is unchanged."""
+    global cache_hits
+    key = str(linode['id'])
+    cached = config_cache.get(key)
+    if cached and cached.get('updated') == linode.get('updated'):
+        with cache_hits_lock:  # Called from MAX_WORKERS threads
+            cache_hits += 1
+        return cached['configs']
+
+    configs = get_linode_configs(linode['id'])
+    if configs:  # An empty list may be a fetch error, don't cache it
+        config_cache[key] = {"updated": linode.get('updated'), "configs": configs}
+    return configs
+
 #function to identify the number of instance which linode configuration not equal to grub2
 def count_non_grub_configs():
     """Count configurations with non-GRUB kernels across all Linodes."""
@@ -135,31 +207,319 @@ def count_non_grub_configs():
         print("No Linode instances found or error occurred.")
         return []
 
+    config_cache.update(load_config_cache())
+
     non_grub_configs = []
-    for linode in linodes:
-        instance_count += 1
-        linode_id = linode['id']
-        label = linode['label']
-        print(f"\nScanning Linode: {label} (ID: {linode_id})")
-        
-        configs = get_linode_configs(linode_id)
-        if not configs:
-            print(f"No configurations found for Linode {linode_id}")
-            continue
-
-        for config in configs:
-            config_id = config['id']
-            kernel = config.get('kernel', '')
-            if kernel != 'linode/grub2':
-                kernel_change_count += 1
-                non_grub_configs.append((linode_id, config_id, label, kernel))
-                print(f"Non-GRUB kernel ({kernel}) found in config {config_id} for Linode {linode_id}")
-            else:
-                print(f"Config {config_id} already using GRUB kernel")
+    # Fetch configs concurrently; results are processed in instance order as they become available
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        config_results = executor.map(get_linode_configs_cached, linodes)
+        for linode, configs in zip(linodes, config_results):
+            instance_count += 1
+            linode_id = linode['id']
+            label = linode['label']
+            instance_tags[linode_id] = linode.get('tags', [])
+            print(f"\nScanning Linode: {label} (ID: {linode_id})")
+            non_grub_configs.extend(find_non_grub_configs(linode_id, label, configs))
+
+    # Drop snapshots of instances that no longer exist
+    current_ids = {str(linode['id']) for linode in linodes}
+    for key in set(config_cache) - current_ids:
+        del config_cache[key]
+    save_config_cache()
+    if USE_CONFIG_CACHE:
+        print(f"\nConfig cache: {cache_hits} instances unchanged, {instance_count - cache_hits} fetched")
+
+    return non_grub_configs
+
+#function to pick the configurations of one instance that are not using grub2
+def find_non_grub_configs(linode_id, label, configs):
+    """Return (linode_id, config_id, label, kernel) for every non-GRUB config of an instance."""
+    global kernel_change_count
+    non_grub_configs = []
+    if not configs:
+        print(f"No configurations found for Linode {linode_id}")
+        return non_grub_configs
+
+    for config in configs:
+        config_id = config['id']
+        kernel = config.get('kernel', '')
+        if kernel != 'linode/grub2':
+            kernel_change_count += 1
+            non_grub_configs.append((linode_id, config_id, label, kernel))
+            print(f"Non-GRUB kernel ({kernel}) found in config {config_id} for Linode {linode_id}")
+        else:
+            print(f"Config {config_id} already using GRUB kernel")
     
     return non_grub_configs
 
+#function to append a completed step to the apply journal
+def record_step(step, linode_id, config_id=None):
+    """Append one completed step to JOURNAL_FILE (fsynced, so a crash never loses a finished step)."""
+    key = (step, linode_id, config_id)
+    with journal_lock:
+        completed_steps.add(key)
+        if not journal_enabled:
+            return
+        entry = {"step": step, "linode_id": linode_id, "config_id": config_id,
+                 "time": datetime.now(timezone.utc).isoformat()}
+        with open(JOURNAL_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+#function to read the completed steps back from the journal
+def load_journal():
+    """Return the set of (step, linode_id, config_id) already completed."""
+    steps = set()
+    if not os.path.exists(JOURNAL_FILE):
+        return steps
+    with open(JOURNAL_FILE) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Partially written last line from a crash
+            steps.add((entry["step"], entry["linode_id"], entry.get("config_id")))
+    return steps
+
+#function to write the migration plan
+def write_plan(non_grub_configs):
+    """Write the (linode, config, current kernel) list found by the scan to PLAN_FILE."""
+    plan = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "target_kernel": "linode/grub2",
+        "steps": [
+            {"linode_id": linode_id, "config_id": config_id, "label": label, "kernel": kernel,
+             "tags": instance_tags.get(linode_id, [])}
+            for linode_id, config_id, label, kernel in non_grub_configs
+        ],
+    }
+    tmp_file = f"{PLAN_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp_file, PLAN_FILE)
+    print(f"Wrote plan with {len(plan['steps'])} config updates to {PLAN_FILE}")
+
+#function to read the migration plan
+def load_plan():
+    """Return the plan as non_grub_configs tuples (and restore instance tags for wave grouping)."""
+    with open(PLAN_FILE) as f:
+        plan = json.load(f)
+    non_grub_configs = []
+    for step in plan["steps"]:
+        instance_tags[step["linode_id"]] = step.get("tags", [])
+        non_grub_configs.append((step["linode_id"], step["config_id"], step["label"], step["kernel"]))
+    return non_grub_configs
+
+#function to derive the group an instance belongs to for max-unavailable accounting
+def instance_group(linode_id, label):
+    """Group key used by WAVE_GROUP_BY: first tag, label without its numeric suffix, or one group."""
+    if WAVE_GROUP_BY == "tag":
+        tags = instance_tags.get(linode_id, [])
+        return tags[0] if tags else "(untagged)"
+    if WAVE_GROUP_BY == "label":
+        return re.sub(r"[-_]?\d+$", "", label) or label
+    return "(all)"
+
+#function to split the instances to migrate into waves
+def plan_waves(non_grub_configs):
+    """
+    Return a list of waves, each a dict {linode_id: (label, [config_id, ...])}.
+    A wave holds at most WAVE_SIZE instances and at most MAX_UNAVAILABLE from any one group.
+    """
+    instances = {}
+    for linode_id, config_id, label, kernel in non_grub_configs:
+        instances.setdefault(linode_id, (label, []))[1].append(config_id)
+
+    waves = []
+    remaining = list(instances.items())
+    while remaining:
+        wave, group_counts, deferred = {}, {}, []
+        for linode_id, (label, config_ids) in remaining:
+            group = instance_group(linode_id, label)
+            if len(wave) < WAVE_SIZE and group_counts.get(group, 0) < MAX_UNAVAILABLE:
+                wave[linode_id] = (label, config_ids)
+                group_counts[group] = group_counts.get(group, 0) + 1
+            else:
+                deferred.append((linode_id, (label, config_ids)))
+        waves.append(wave)
+        remaining = deferred
+    return waves
+
+#function to fetch reboot events created since a point in time
+def get_reboot_events(since):
+    """Fetch linode_reboot events created at or after `since` (all pages)."""
+    x_filter = {"action": "linode_reboot", "created": {"+gte": since.strftime("%Y-%m-%dT%H:%M:%S")}}
+    events = []
+    page = 1
+    while True:
+        enforce_rate_limit()
+        response = session.get(
+            f"{BASE_URL}/account/events?page={page}&page_size={PAGE_SIZE}",
+            headers={**get_headers(), "X-Filter": json.dumps(x_filter)}
+        )
+        response.raise_for_status()
+        data = response.json()
+        events.extend(data.get('data', []))
+        if page >= data.get('pages', 1):
+            return events
+        page += 1
+
+#function to fetch the status of several instances in one listing call
+def get_instance_statuses(linode_ids):
+    """Return {linode_id: status} for the given instances using an X-Filter on id."""
+    statuses = {}
+    ids = list(linode_ids)
+    for start in range(0, len(ids), PAGE_SIZE):
+        chunk = ids[start:start + PAGE_SIZE]
+        enforce_rate_limit()
+        response = session.get(
+            f"{BASE_URL}/linode/instances?page_size={PAGE_SIZE}",
+            headers={**get_headers(), "X-Filter": json.dumps({"+or": [{"id": linode_id} for linode_id in chunk]})}
+        )
+        response.raise_for_status()
+        statuses.update({linode['id']: linode['status'] for linode in response.json().get('data', [])})
+    return statuses
+
+#function to wait until every instance of a wave rebooted and is running again
+def wait_for_wave(linode_ids, since, already_rebooted=()):
+    """
+    Return the set of instances confirmed back in 'running' status.
+    Instances in already_rebooted (journaled as rebooted before a crash) skip the reboot event and
+    are only polled until they are running again.
+    """
+    pending = set(linode_ids) | set(already_rebooted)
+    rebooted = set(already_rebooted)
+    confirmed = set()
+    deadline = time.monotonic() + REBOOT_TIMEOUT
+    while pending and time.monotonic() < deadline:
+        time.sleep(EVENT_POLL_INTERVAL)
+        try:
+            for event in (get_reboot_events(since) if pending - rebooted else []):
+                linode_id = (event.get('entity') or {}).get('id')
+                if linode_id not in pending:
+                    continue
+                if event.get('status') == 'finished':
+                    rebooted.add(linode_id)
+                elif event.get('status') == 'failed':
+                    print(f"Reboot event failed for Linode {linode_id}")
+                    pending.discard(linode_id)
+
+            # The reboot job finishing is not enough: confirm the instance is running again
+            if rebooted & pending:
+                statuses = get_instance_statuses(rebooted & pending)
+                for linode_id, status in statuses.items():
+                    if status == 'running':
+                        pending.discard(linode_id)
+                        confirmed.add(linode_id)
+                        print(f"Linode {linode_id} is back online")
+        except requests.RequestException as e:
+            print(f"Error polling wave status: {e}")
+
+    return confirmed
+
+#function to update the kernels and reboot one wave concurrently
+def run_wave(wave):
+    """Update configs and reboot all instances of a wave, then wait for them; returns (ok, failed)."""
+    since = datetime.now(timezone.utc) - timedelta(seconds=60)  # Allow for clock skew
+
+    def update_config(linode_id, config_id):
+        if ("update", linode_id, config_id) in completed_steps:
+            return True  # Done by an earlier (interrupted) apply
+        if update_linode_kernel(linode_id, config_id):
+            record_step("update", linode_id, config_id)
+            return True
+        return False
+
+    def reboot(linode_id):
+        if reboot_linode(linode_id):
+            record_step("reboot", linode_id)
+            return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        updates = {
+            linode_id: [executor.submit(update_config, linode_id, config_id) for config_id in config_ids]
+            for linode_id, (label, config_ids) in wave.items()
+        }
+        updated = [linode_id for linode_id, futures in updates.items() if all(f.result() for f in futures)]
+        # Never reboot twice: instances rebooted before a crash only need their status confirmed
+        previously_rebooted = [linode_id for linode_id in updated if ("reboot", linode_id, None) in completed_steps]
+        to_reboot = [linode_id for linode_id in updated if linode_id not in previously_rebooted]
+        rebooted = [
+            linode_id for linode_id, ok in zip(to_reboot, executor.map(reboot, to_reboot)) if ok
+        ]
+
+    # Instances rebooted before a crash may still be booting: poll them like the rest of the wave
+    back_online = wait_for_wave(rebooted, since, previously_rebooted) if rebooted or previously_rebooted else set()
+    for linode_id in back_online:
+        record_step("online", linode_id)
+    failed = set(wave) - back_online
+    return back_online, failed
+
+#function to run the rolling migration wave by wave
+def rolling_update(non_grub_configs):
+    """Migrate and reboot instances in waves; the next wave starts only when the current one is back."""
+    done = {linode_id for step, linode_id, _ in completed_steps if step == "online"}
+    if done:
+        print(f"Skipping {len(done)} instances already completed according to {JOURNAL_FILE}")
+    waves = plan_waves([entry for entry in non_grub_configs if entry[0] not in done])
+    print(f"Planned {len(waves)} waves (wave size {WAVE_SIZE}, max unavailable {MAX_UNAVAILABLE}"
+          f"{', grouped by ' + WAVE_GROUP_BY if WAVE_GROUP_BY else ''})")
+
+    for number, wave in enumerate(waves, start=1):
+        labels = ", ".join(f"{label} ({linode_id})" for linode_id, (label, _) in wave.items())
+        print(f"\n--- Wave {number}/{len(waves)}: {labels}")
+        started = time.monotonic()
+        back_online, failed = run_wave(wave)
+        print(f"Wave {number} finished in {time.monotonic() - started:.0f}s: "
+              f"{len(back_online)} back online, {len(failed)} failed")
+
+        if failed:
+            for linode_id in sorted(failed):
+                print(f"Failed to update/reboot Linode {linode_id}")
+            if HALT_ON_FAILURE:
+                print("Halting rollout because a wave did not complete (HALT_ON_FAILURE = True)")
+                return False
+    return True
+
+#function to execute a plan written by "plan", journaling every completed step
+def apply_plan(resume):
+    """Execute PLAN_FILE; with resume=True, steps recorded in JOURNAL_FILE are skipped."""
+    global journal_enabled
+    if not os.path.exists(PLAN_FILE):
+        print(f"No plan found at {PLAN_FILE}, run the 'plan' command first.")
+        return
+    if os.path.exists(JOURNAL_FILE) and not resume:
+        print(f"{JOURNAL_FILE} already exists. Use 'apply --resume' to continue it, "
+              f"or remove it to start over.")
+        return
+
+    print(f"Applying {PLAN_FILE} at {datetime.now()}")
+    non_grub_configs = load_plan()
+    completed_steps.update(load_journal())
+    journal_enabled = True
+    # Load the snapshot cache so the save below only drops the instances updated here
+    config_cache.update(load_config_cache())
+    try:
+        rolling_update(non_grub_configs)
+    finally:
+        save_config_cache()
+    print(f"\nProcess completed at {datetime.now()}")
+
 def main():
+    parser = argparse.ArgumentParser(description="Migrate Linode configs to the GRUB2 kernel.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "plan", "apply"],
+                        help="run: scan and migrate (default); plan: scan and write PLAN_FILE; "
+                             "apply: execute PLAN_FILE with a journal")
+    parser.add_argument("--resume", action="store_true",
+                        help="with apply: skip steps already recorded in JOURNAL_FILE")
+    args = parser.parse_args()
+
+    if args.command == "apply":
+        apply_plan(args.resume)
+        return
+
     print(f"Starting kernel update process at {datetime.now()}")
     
     # First pass: Count and identify non-GRUB configurations
@@ -168,29 +528,21 @@ def main():
     print(f"\nTotal Linode instances scanned: {instance_count}")
     print(f"Total configurations needing kernel change: {kernel_change_count}")
     
+    if args.command == "plan":
+        write_plan(non_grub_configs)
+        return
+
     if kernel_change_count == 0:
         print("No configurations need kernel updates.")
         print(f"\nProcess completed at {datetime.now()}")
         return
 
-    # Second pass: Update and reboot
+    # Second pass: Update and reboot in waves
     print("\n=== Updating kernels and rebooting ===")
-    for linode_id, config_id, label, kernel in non_grub_configs:
-        print(f"\nProcessing Linode: {label} (ID: {linode_id})")
-        print(f"Non-GRUB kernel ({kernel}) in config {config_id}")
-        
-        # Update kernel to GRUB
-        if update_linode_kernel(linode_id, config_id):
-            # Wait briefly to ensure configuration update is processed
-            time.sleep(2)
-            
-            # Reboot the instance
-            if reboot_linode(linode_id):
-                print(f"Successfully updated and rebooted Linode {linode_id}")
-            else:
-                print(f"Failed to reboot Linode {linode_id}")
-        else:
-            print(f"Failed to update kernel for Linode {linode_id}")
+    try:
+        rolling_update(non_grub_configs)
+    finally:
+        save_config_cache()  # Persist invalidated snapshots of updated instances
 
     print(f"\nProcess completed at {datetime.now()}")
 
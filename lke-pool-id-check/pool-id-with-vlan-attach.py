@@ -2,6 +2,22 @@ import subprocess
 import json
 import requests
 import ipaddress
+import random
+import os
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+try:
+    # Only needed for --watch; without it the watch falls back to `kubectl get nodes --watch`
+    from kubernetes import client as k8s_client, config as k8s_config, watch as k8s_watch
+    from kubernetes.client.rest import ApiException
+except ImportError:
+    k8s_client = None
 
 # CONFIG
 KUBECONFIG = ""  # Path to kubeconfig file for Kubernetes cluster authentication
@@ -10,12 +26,60 @@ TARGET_VLAN_ID = ""  # VLAN label to attach to nodes (e.g., vlan-xxxxx)
 VLAN_CIDR = ""  # VLAN subnet for IP assignment (e.g., 192.168.100.0/24)
 VLAN_GATEWAY = ""  # Gateway IP for the VLAN subnet (e.g., 192.168.100.1)
 
-LINODE_API_URL = "https://api.linode.com/v4"
+# Overridable so the script can be pointed at a fake Linode API for testing
+LINODE_API_URL = os.environ.get("LINODE_API_URL", "https://api.linode.com/v4")
 HEADERS = {
     "Authorization": f"Bearer {LINODE_API_TOKEN}",
     "Content-Type": "application/json"
 }
 
+# CONFIG FETCHING
+MAX_WORKERS = 16  # Concurrent config fetches, all sharing the rate limiter
+RATE_LIMIT_REQUESTS = 800  # Linode API rate limit: 800 requests per minute
+RATE_LIMIT_PERIOD = 60  # Seconds in a minute
+# Which instances are scanned for used VLAN IPs: "cluster" = only the Linodes backing Kubernetes nodes,
+# "region" = every instance in the cluster's region(s) (use this if non-LKE Linodes share the VLAN)
+VLAN_IP_SCAN_SCOPE = "cluster"
+
+# Sliding-window rate limiter shared by all worker threads
+request_timestamps = deque()
+rate_limit_lock = threading.Lock()
+
+# Keep-alive connections for the concurrent config fetches
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
+# REBOOT SCHEDULING
+MAX_UNAVAILABLE_PER_POOL = 1  # Max nodes of one LKE pool (lke.linode.com/pool-id) rebooting at the same time
+REBOOT_TIMEOUT = 900  # Seconds to wait for a reboot wave to finish before giving up
+EVENT_POLL_INTERVAL = 10  # Seconds between /account/events polls
+PENDING_REBOOTS_FILE = "pending-reboots.json"  # Nodes with the VLAN configured that still need a reboot
+EVENT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"  # UTC timestamp format of the Linode API
+
+# WATCH MODE
+WATCH_TIMEOUT = 300  # Seconds per watch request before it is resumed from the last resourceVersion
+WATCH_RETRY_DELAY = 5  # Seconds to wait before reconnecting after a watch error
+IPAM_RESYNC_INTERVAL = 3600  # Seconds between full rebuilds of the warm IPAM cache
+
+def enforce_rate_limit():
+    """
+    Waits until another Linode API request fits in the RATE_LIMIT_REQUESTS per RATE_LIMIT_PERIOD window.
+    """
+    while True:
+        with rate_limit_lock:
+            current_time = time.monotonic()
+            while request_timestamps and current_time - request_timestamps[0] >= RATE_LIMIT_PERIOD:
+                request_timestamps.popleft()
+            if len(request_timestamps) < RATE_LIMIT_REQUESTS:
+                request_timestamps.append(current_time)
+                return
+            sleep_time = RATE_LIMIT_PERIOD - (current_time - request_timestamps[0])
+
+        # Budget exhausted: sleep outside the lock so other threads are not blocked on it
+        print(f"⏳ Rate limit reached, sleeping for {sleep_time:.2f} seconds")
+        time.sleep(sleep_time)
+
 def get_all_nodes():
     """
     Retrieves all Kubernetes nodes using kubectl.
@@ -35,15 +99,22 @@ def get_all_nodes():
 def get_all_linode_instances():
     """
     Fetches all Linode instances using the Linode API, handling pagination.
-    Returns a list of Linode instance objects.
+    Returns a list of Linode instance objects, or None if any page fails (a partial
+    listing would leave VLAN IPs in use on the missing instances unseen).
     """
     instances = []
     page = 1
     while True:
-        resp = requests.get(f"{LINODE_API_URL}/linode/instances?page={page}", headers=HEADERS)
+        enforce_rate_limit()
+        try:
+            resp = SESSION.get(f"{LINODE_API_URL}/linode/instances", headers=HEADERS,
+                               params={"page": page, "page_size": 500}, timeout=15)
+        except requests.RequestException as e:
+            print(f"❌ Failed to fetch Linode instances: {e}")
+            return None
         if resp.status_code != 200:
-            print(f"Failed to fetch Linode instances: {resp.text}")
-            break
+            print(f"❌ Failed to fetch Linode instances: {resp.text}")
+            return None
         data = resp.json()
         instances.extend(data["data"])
         if page >= data["pages"]:
@@ -51,19 +122,47 @@ def get_all_linode_instances():
         page += 1
     return instances
 
-def find_linode_by_node_name(node_name, instances):
+def index_linodes_by_label(instances):
+    """
+    Builds a label -> instance lookup table from the instance listing.
+    Args:
+        instances (list): List of Linode instance objects.
+    Returns:
+        dict: Linode instances keyed by label.
+    """
+    return {linode.get("label"): linode for linode in instances}
+
+def find_linode_by_node_name(node_name, instances_by_label):
     """
     Matches a Kubernetes node name to a Linode instance by its label.
     Args:
         node_name (str): Name of the Kubernetes node.
-        instances (list): List of Linode instance objects.
+        instances_by_label (dict): Linode instances keyed by label (see index_linodes_by_label).
     Returns:
         dict: Matching Linode instance, or None if no match is found.
     """
-    for linode in instances:
-        if linode.get("label") == node_name:
-            return linode
-    return None
+    return instances_by_label.get(node_name)
+
+def get_linode_by_label(label):
+    """
+    Looks up a single Linode instance by label with an X-Filter, instead of listing every instance.
+    Args:
+        label (str): Linode label (LKE names nodes after their Linode label).
+    Returns:
+        dict: Matching Linode instance, or None if no match is found or the request fails.
+    """
+    headers = {**HEADERS, "X-Filter": json.dumps({"label": label})}
+    enforce_rate_limit()
+    try:
+        resp = SESSION.get(f"{LINODE_API_URL}/linode/instances", headers=headers, timeout=15)
+    except requests.RequestException as e:
+        print(f"❌ Failed to look up Linode {label}: {e}")
+        return None
+    if resp.status_code != 200:
+        print(f"❌ Failed to look up Linode {label}: {resp.text}")
+        return None
+    data = resp.json().get("data", [])
+    return data[0] if data else None
 
 def get_linode_configs(linode_id):
     """
@@ -71,15 +170,46 @@ def get_linode_configs(linode_id):
     Args:
         linode_id (int): ID of the Linode instance.
     Returns:
-        list: List of configuration profiles, or empty list if the request fails.
+        list: List of configuration profiles, or None if the request fails.
     """
     url = f"{LINODE_API_URL}/linode/instances/{linode_id}/configs"
-    resp = requests.get(url, headers=HEADERS)
+    enforce_rate_limit()
+    try:
+        resp = SESSION.get(url, headers=HEADERS, timeout=15)
+    except requests.RequestException as e:
+        print(f"❌ Failed to get configs for Linode {linode_id}: {e}")
+        return None
     if resp.status_code != 200:
         print(f"❌ Failed to get configs for Linode {linode_id}: {resp.text}")
-        return []
+        return None
     return resp.json().get("data", [])
 
+def get_configs_concurrently(linode_ids):
+    """
+    Fetches configs for several Linodes at once on MAX_WORKERS threads under the shared rate limiter.
+    Args:
+        linode_ids (iterable): IDs of the Linode instances.
+    Returns:
+        dict: Configuration profiles (None where the fetch failed) keyed by Linode ID.
+    """
+    linode_ids = list(dict.fromkeys(linode_ids))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return dict(zip(linode_ids, executor.map(get_linode_configs, linode_ids)))
+
+def select_instances_to_scan(cluster_linodes, instances):
+    """
+    Picks the instances whose configs are scanned for used VLAN IPs, according to VLAN_IP_SCAN_SCOPE.
+    Args:
+        cluster_linodes (list): Linode instances backing the cluster's nodes.
+        instances (list): Every Linode instance in the account.
+    Returns:
+        list: Linode instances to scan.
+    """
+    if VLAN_IP_SCAN_SCOPE == "region":
+        regions = {linode.get("region") for linode in cluster_linodes}
+        return [linode for linode in instances if linode.get("region") in regions]
+    return cluster_linodes
+
 def has_vlan_already(config, vlan_label):
     """
     Checks if a Linode config already has the specified VLAN attached.
@@ -94,19 +224,17 @@ def has_vlan_already(config, vlan_label):
             return True
     return False
 
-def get_used_vlan_ips(instances, vlan_label):
+def get_used_vlan_ips(configs_by_linode, vlan_label):
     """
-    Collects all IP addresses already assigned to the specified VLAN across all instances.
+    Collects all IP addresses already assigned to the specified VLAN across the given configs.
     Args:
-        instances (list): List of Linode instance objects.
+        configs_by_linode (dict): Configuration profiles keyed by Linode ID.
         vlan_label (str): VLAN label to check for assigned IPs.
     Returns:
         set: Set of used IP addresses (strings).
     """
     used_ips = set()
-    for instance in instances:
-        linode_id = instance["id"]
-        configs = get_linode_configs(linode_id)
+    for configs in configs_by_linode.values():
         for config in configs:
             interfaces = config.get("interfaces", [])
             for iface in interfaces:
@@ -116,79 +244,665 @@ def get_used_vlan_ips(instances, vlan_label):
                         used_ips.add(ipam.split("/")[0])
     return used_ips
 
-def get_next_available_ip(vlan_cidr, used_ips):
+class IPv4Allocator:
+    """
+    IPAM allocator for one CIDR, stored as an integer range plus a bitmap of used addresses.
+    Memory is one bit per address (a /16 is 8 KB, a /8 is 2 MB) and no IPv4Address objects are
+    created. Random picks are expected O(1) on sparse ranges and lowest-free picks are amortized
+    O(1) thanks to a moving hint; both fall back to a C-speed bitmap scan when the range is dense.
+    """
+
+    def __init__(self, cidr, reserved=()):
+        self.network = ipaddress.ip_network(cidr, strict=False)
+        self.first = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.free_count = self.size
+        self.lowest_hint = 0
+        if self.size % 8:
+            # Padding bits past the end of the range are permanently "used"
+            self.bitmap[-1] |= 0xFF << (self.size % 8) & 0xFF
+
+        if self.network.prefixlen < 31:
+            self.mark_used(self.network.network_address)
+            self.mark_used(self.network.broadcast_address)
+        for entry in reserved:
+            self.reserve(entry)
+
+    def reserve(self, entry):
+        """Reserve a single IP, an 'a.b.c.d-e.f.g.h' range or a CIDR inside the network."""
+        if not entry:
+            return
+        entry = str(entry)
+        if "-" in entry:
+            start, end = (int(ipaddress.ip_address(part.strip())) for part in entry.split("-", 1))
+        elif "/" in entry:
+            block = ipaddress.ip_network(entry, strict=False)
+            start, end = int(block.network_address), int(block.broadcast_address)
+        else:
+            start = end = int(ipaddress.ip_address(entry))
+        for value in range(max(start, self.first), min(end, self.first + self.size - 1) + 1):
+            self._set(value - self.first)
+
+    def _index(self, ip):
+        offset = int(ipaddress.ip_address(str(ip).split("/")[0])) - self.first
+        return offset if 0 <= offset < self.size else None
+
+    def _is_set(self, offset):
+        return self.bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _set(self, offset):
+        if not self._is_set(offset):
+            self.bitmap[offset >> 3] |= 1 << (offset & 7)
+            self.free_count -= 1
+
+    def mark_used(self, ip):
+        """Mark an address (optionally with /prefix) as used; addresses outside the CIDR are ignored."""
+        offset = self._index(ip)
+        if offset is not None:
+            self._set(offset)
+
+    def release(self, ip):
+        offset = self._index(ip)
+        if offset is not None and self._is_set(offset):
+            self.bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+            self.free_count += 1
+            self.lowest_hint = min(self.lowest_hint, offset)
+
+    def is_used(self, ip):
+        offset = self._index(ip)
+        return offset is None or bool(self._is_set(offset))
+
+    def _next_free_from(self, offset):
+        """Lowest free offset >= offset, or None. Full bytes are skipped with bytes.lstrip (C speed)."""
+        byte_index = offset >> 3
+        if byte_index >= len(self.bitmap):
+            return None
+        # Finish the partial first byte bit by bit
+        for bit in range(offset & 7, 8):
+            if not self.bitmap[byte_index] & (1 << bit):
+                return (byte_index << 3) + bit
+        rest = bytes(self.bitmap[byte_index + 1:])
+        skipped = len(rest) - len(rest.lstrip(b"\xff"))
+        byte_index += 1 + skipped
+        if byte_index >= len(self.bitmap):
+            return None
+        value = self.bitmap[byte_index]
+        bit = (~value & (value + 1)).bit_length() - 1  # lowest zero bit
+        return (byte_index << 3) + bit
+
+    def _take(self, offset):
+        self._set(offset)
+        return str(ipaddress.ip_address(self.first + offset))
+
+    def allocate_lowest(self):
+        """Allocate and return the lowest free address."""
+        offset = self._next_free_from(self.lowest_hint)
+        if offset is None:
+            raise RuntimeError(f"No free IPs available in {self.network}")
+        self.lowest_hint = offset + 1
+        return self._take(offset)
+
+    def allocate_random(self, probes=32):
+        """Allocate and return a random free address."""
+        if self.free_count <= 0:
+            raise RuntimeError(f"No free IPs available in {self.network}")
+        for _ in range(probes):
+            offset = random.randrange(self.size)
+            if not self._is_set(offset):
+                return self._take(offset)
+        # Dense range: take the first free address after a random starting point
+        start = random.randrange(self.size)
+        offset = self._next_free_from(start)
+        if offset is None:
+            offset = self._next_free_from(0)
+        return self._take(offset)
+
+
+def get_next_available_ip(allocator):
     """
-    Finds the next available IP address in the VLAN subnet, excluding the gateway.
+    Takes the lowest free IP address in the VLAN subnet from the allocator.
     Args:
-        vlan_cidr (str): CIDR notation for the VLAN subnet (e.g., 192.168.100.0/24).
-        used_ips (set): Set of already used IP addresses.
+        allocator (IPv4Allocator): Allocator for VLAN_CIDR with the gateway and used IPs already taken.
     Returns:
         str: Next available IP address.
     Raises:
         RuntimeError: If no free IPs are available in the subnet.
     """
-    net = ipaddress.ip_network(vlan_cidr)
-    for ip in net.hosts():
-        ip_str = str(ip)
-        if ip_str == VLAN_GATEWAY:
-            continue
-        if ip_str not in used_ips:
-            return ip_str
-    raise RuntimeError("No free IPs available in VLAN pool")
+    return allocator.allocate_lowest()
 
 def reboot_linode(linode_id):
     """
     Triggers a reboot for the specified Linode instance via the Linode API.
     Args:
         linode_id (int): ID of the Linode instance to reboot.
+    Returns:
+        bool: True if the reboot was accepted.
     """
     url = f"{LINODE_API_URL}/linode/instances/{linode_id}/reboot"
-    resp = requests.post(url, headers=HEADERS)
+    enforce_rate_limit()
+    try:
+        resp = SESSION.post(url, headers=HEADERS, timeout=15)
+    except requests.RequestException as e:
+        print(f"❌ Failed to reboot Linode {linode_id}: {e}")
+        return False
     if resp.status_code == 200:
         print(f"🔁 Reboot triggered for Linode {linode_id}")
-    else:
-        print(f"❌ Failed to reboot Linode {linode_id}: {resp.text}")
+        return True
+    print(f"❌ Failed to reboot Linode {linode_id}: {resp.text}")
+    return False
 
-def update_config_with_vlan_and_ipam(linode_id, config_id, config, used_ips):
+def prepare_vlan_config(config, allocator):
     """
-    Updates a Linode configuration to attach a VLAN with a unique IP address.
+    Picks a VLAN IP and builds the updated configuration profile with the VLAN on eth1.
+    Call it from one thread only: the allocator is not thread-safe.
     Args:
-        linode_id (int): ID of the Linode instance.
-        config_id (int): ID of the configuration profile to update.
         config (dict): Current configuration profile.
-        used_ips (set): Set of already used IP addresses in the VLAN.
+        allocator (IPv4Allocator): VLAN IP allocator.
+    Returns:
+        tuple: (IP address taken from the allocator, configuration body for the PUT).
     """
     interfaces = config.get("interfaces", [])
 
     while len(interfaces) < 2:
         interfaces.append({"purpose": "public"})
 
-    ipam_ip = get_next_available_ip(VLAN_CIDR, used_ips)
-    used_ips.add(ipam_ip)
+    ipam_ip = get_next_available_ip(allocator)
+    ipam_address = f"{ipam_ip}/{allocator.network.prefixlen}"
 
     interfaces[1] = {
         "purpose": "vlan",
         "label": TARGET_VLAN_ID,
-        "ipam_address": f"{ipam_ip}/24"
+        "ipam_address": ipam_address
     }
 
     payload = {
         "interfaces": interfaces
     }
+    return ipam_ip, {**config, **payload}
 
+def put_vlan_config(linode_id, config_id, body):
+    """
+    Sends the updated configuration profile to the Linode API.
+    Args:
+        linode_id (int): ID of the Linode instance.
+        config_id (int): ID of the configuration profile to update.
+        body (dict): Configuration body from prepare_vlan_config.
+    Returns:
+        bool: True if the update succeeded.
+    """
     url = f"{LINODE_API_URL}/linode/instances/{linode_id}/configs/{config_id}"
-    resp = requests.put(url, headers=HEADERS, json={**config, **payload})
+    enforce_rate_limit()
+    try:
+        resp = SESSION.put(url, headers=HEADERS, json=body, timeout=15)
+    except requests.RequestException as e:
+        print(f"❌ Failed to update config {config_id} for Linode {linode_id}: {e}")
+        return False
     if resp.status_code == 200:
-        print(f"✅ VLAN {TARGET_VLAN_ID} + IP {ipam_ip}/24 assigned on eth1 (Config {config_id})")
-        reboot_linode(linode_id)
-    else:
-        print(f"❌ Failed to update config {config_id} for Linode {linode_id}: {resp.text}")
+        ipam_address = body["interfaces"][1]["ipam_address"]
+        print(f"✅ VLAN {TARGET_VLAN_ID} + IP {ipam_address} assigned on eth1 (Config {config_id})")
+        return True
+    print(f"❌ Failed to update config {config_id} for Linode {linode_id}: {resp.text}")
+    return False
+
+def update_config_with_vlan_and_ipam(linode_id, config_id, config, allocator, scheduler, name, pool_id):
+    """
+    Updates a Linode configuration to attach a VLAN with a unique IP address and queues its reboot.
+    The node stays in the pending reboots until its reboot is seen finishing (see PoolRebootScheduler).
+    Args:
+        linode_id (int): ID of the Linode instance.
+        config_id (int): ID of the configuration profile to update.
+        config (dict): Current configuration profile.
+        allocator (IPv4Allocator): VLAN IP allocator; the address is released again if the update fails.
+        scheduler (PoolRebootScheduler): Per-pool reboot scheduler of the watch.
+        name (str): Name of the Kubernetes node.
+        pool_id (str): LKE pool of the node.
+    Returns:
+        bool: True if the update succeeded.
+    """
+    ipam_ip, body = prepare_vlan_config(config, allocator)
+    if put_vlan_config(linode_id, config_id, body):
+        scheduler.enqueue([{"name": name, "linode_id": linode_id, "pool_id": pool_id}])
+        return True
+    allocator.release(ipam_ip)
+    return False
+
+def apply_vlan_changes(changes, allocator):
+    """
+    Sends all pending config updates concurrently. Addresses of failed updates are released.
+    Args:
+        changes (list): Pending changes (dicts with linode_id, config_id, body and ipam_ip).
+        allocator (IPv4Allocator): VLAN IP allocator the addresses were taken from.
+    Returns:
+        list: The changes that were applied.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(
+            lambda change: put_vlan_config(change["linode_id"], change["config_id"], change["body"]), changes
+        ))
+
+    applied = []
+    for change, ok in zip(changes, results):
+        if ok:
+            applied.append(change)
+        else:
+            allocator.release(change["ipam_ip"])  # Released here, on the main thread
+    return applied
+
+def reboot_since():
+    """
+    Returns:
+        str: Current UTC time in the API's event format, with a minute of slack for clock skew.
+    """
+    return (datetime.now(timezone.utc) - timedelta(seconds=60)).strftime(EVENT_TIME_FORMAT)
+
+def load_pending_reboots():
+    """
+    Loads the nodes whose VLAN config was applied but whose reboot has not been seen finishing.
+    Returns:
+        dict: Pending reboots keyed by Linode ID (as a string), each with name, linode_id, pool_id
+        and since (UTC time the last reboot was requested).
+    """
+    try:
+        with open(PENDING_REBOOTS_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring unreadable {PENDING_REBOOTS_FILE}: {e}")
+        return {}
+
+def save_pending_reboots(pending):
+    """
+    Writes the pending reboots atomically (temp file + rename), so a crash never leaves a torn file.
+    Args:
+        pending (dict): Pending reboots keyed by Linode ID.
+    """
+    tmp_file = f"{PENDING_REBOOTS_FILE}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(pending, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, PENDING_REBOOTS_FILE)
+    except OSError as e:
+        print(f"❌ Failed to save {PENDING_REBOOTS_FILE}: {e}")
+
+def mark_pending_reboots(pending, changes):
+    """
+    Records nodes that need a reboot (or are about to get one) and persists them.
+    Args:
+        pending (dict): Pending reboots keyed by Linode ID.
+        changes (list): Changes (dicts with name, linode_id and pool_id).
+    """
+    since = reboot_since()
+    for change in changes:
+        pending[str(change["linode_id"])] = {"name": change["name"], "linode_id": change["linode_id"],
+                                             "pool_id": change["pool_id"], "since": since}
+    save_pending_reboots(pending)
+
+def resume_pending_reboots(pending, linode_instances):
+    """
+    Works out which pending reboots from earlier runs still have to happen.
+    Nodes that are gone or powered off (the config applies on their next boot) are dropped, and so
+    are nodes with a reboot that finished after it was requested. Running nodes are returned to be
+    rebooted again; nodes in any other state are kept for the next run.
+    Args:
+        pending (dict): Pending reboots keyed by Linode ID.
+        linode_instances (list): Every Linode instance in the account.
+    Returns:
+        list: Changes (dicts with name, linode_id and pool_id) to reboot in waves.
+    """
+    if not pending:
+        return []
+    status_by_id = {str(linode["id"]): linode.get("status") for linode in linode_instances}
+    for key in list(pending):
+        if status_by_id.get(key) in (None, "offline"):
+            print(f"🗑️  {pending[key]['name']} is gone or offline, dropping its pending reboot")
+            del pending[key]
+
+    if pending:
+        since = datetime.strptime(min(entry["since"] for entry in pending.values()), EVENT_TIME_FORMAT)
+        try:
+            events = get_reboot_events(since)
+        except requests.RequestException as e:
+            print(f"❌ Failed to fetch reboot events: {e}")
+            events = []
+        for event in events:
+            key = str((event.get("entity") or {}).get("id"))
+            if key in pending and event.get("status") == "finished" and event.get("created", "") >= pending[key]["since"]:
+                print(f"🟢 {pending[key]['name']} finished rebooting since the last run")
+                del pending[key]
+    save_pending_reboots(pending)
+
+    resumed = [entry for key, entry in pending.items() if status_by_id.get(key) == "running"]
+    if resumed:
+        print(f"🔁 Resuming {len(resumed)} pending reboot(s): {', '.join(entry['name'] for entry in resumed)}")
+    return resumed
+
+def plan_reboot_waves(changes):
+    """
+    Splits the nodes to reboot into waves, each taking at most MAX_UNAVAILABLE_PER_POOL nodes of every pool.
+    Args:
+        changes (list): Applied changes (dicts with name, linode_id and pool_id).
+    Returns:
+        list: Waves, each a list of changes.
+    """
+    by_pool = {}
+    for change in changes:
+        by_pool.setdefault(change["pool_id"], []).append(change)
+
+    waves = []
+    while any(by_pool.values()):
+        wave = []
+        for pool_changes in by_pool.values():
+            wave.extend(pool_changes[:MAX_UNAVAILABLE_PER_POOL])
+            del pool_changes[:MAX_UNAVAILABLE_PER_POOL]
+        waves.append(wave)
+    return waves
+
+def get_reboot_events(since):
+    """
+    Fetches linode_reboot events created at or after a point in time (all pages).
+    Args:
+        since (datetime): UTC time to look back to.
+    Returns:
+        list: Event objects.
+    """
+    x_filter = {"action": "linode_reboot", "created": {"+gte": since.strftime(EVENT_TIME_FORMAT)}}
+    headers = {**HEADERS, "X-Filter": json.dumps(x_filter)}
+    events = []
+    page = 1
+    while True:
+        enforce_rate_limit()
+        resp = SESSION.get(f"{LINODE_API_URL}/account/events?page={page}&page_size=500", headers=headers, timeout=15)
+        resp.raise_for_status()
+        data = resp.json()
+        events.extend(data.get("data", []))
+        if page >= data.get("pages", 1):
+            return events
+        page += 1
+
+def wait_for_reboots(linode_ids, since):
+    """
+    Polls /account/events until the reboot of every given Linode has finished, failed or timed out.
+    Args:
+        linode_ids (iterable): IDs of the rebooted Linode instances.
+        since (datetime): UTC time just before the reboots were triggered.
+    Returns:
+        set: IDs of the Linodes whose reboot finished.
+    """
+    pending = set(linode_ids)
+    finished = set()
+    deadline = time.monotonic() + REBOOT_TIMEOUT
+    while pending and time.monotonic() < deadline:
+        time.sleep(EVENT_POLL_INTERVAL)
+        try:
+            events = get_reboot_events(since)
+        except requests.RequestException as e:
+            print(f"❌ Failed to poll reboot events: {e}")
+            continue
+        for event in events:
+            linode_id = (event.get("entity") or {}).get("id")
+            if linode_id not in pending:
+                continue
+            if event.get("status") == "finished":
+                pending.discard(linode_id)
+                finished.add(linode_id)
+                print(f"🟢 Linode {linode_id} finished rebooting")
+            elif event.get("status") == "failed":
+                pending.discard(linode_id)
+                print(f"❌ Reboot failed for Linode {linode_id}")
+    return finished
+
+def reboot_in_waves(changes, pending):
+    """
+    Reboots the updated nodes wave by wave, never taking more than MAX_UNAVAILABLE_PER_POOL nodes of a
+    pool down at once. Stops if a node does not come back, so a pool never loses more nodes.
+    A node leaves the pending reboots only once its reboot event has finished, so nodes left over
+    by a stopped rollout are rebooted by the next run.
+    Args:
+        changes (list): Applied changes (dicts with name, linode_id and pool_id).
+        pending (dict): Pending reboots keyed by Linode ID, holding every node in changes.
+    """
+    waves = plan_reboot_waves(changes)
+    for number, wave in enumerate(waves, start=1):
+        print(f"\n🌊 Reboot wave {number}/{len(waves)}: {', '.join(change['name'] for change in wave)}")
+        mark_pending_reboots(pending, wave)  # Only reboot events from now on count for this wave
+        since = datetime.strptime(pending[str(wave[0]["linode_id"])]["since"], EVENT_TIME_FORMAT)
+        linode_ids = [change["linode_id"] for change in wave]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            rebooted = [linode_id for linode_id, ok in zip(linode_ids, executor.map(reboot_linode, linode_ids)) if ok]
+
+        finished = wait_for_reboots(rebooted, since) if rebooted else set()
+        for linode_id in finished:
+            pending.pop(str(linode_id), None)
+        save_pending_reboots(pending)
+        failed = [change["name"] for change in wave if change["linode_id"] not in finished]
+        if failed:
+            remaining = [change["name"] for later_wave in waves[number:] for change in later_wave]
+            print(f"❌ Wave {number} did not finish for: {', '.join(failed)}. Stopping reboots.")
+            if remaining:
+                print(f"⚠️  VLAN configured but reboot still needed for: {', '.join(remaining)}")
+            print(f"⚠️  Pending reboots are kept in {PENDING_REBOOTS_FILE} and resumed on the next run.")
+            return
+    print("\n✅ All reboot waves finished.")
+
+class PoolRebootScheduler:
+    """
+    Reboots the nodes configured in watch mode in the background, never taking more than
+    MAX_UNAVAILABLE_PER_POOL nodes of a pool down at once (the watch-mode counterpart of reboot_in_waves).
+    Nodes are queued per pool and rebooted as soon as their pool has a free slot. A slot is freed once
+    the node's linode_reboot event has finished. A pool whose reboot fails or exceeds REBOOT_TIMEOUT is
+    held until the next IPAM rebuild re-checks its pending reboots, so it never loses more nodes.
+    The pending reboots are only changed under the scheduler's lock.
+    """
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.lock = threading.Lock()
+        self.queued = {}  # pool id -> deque of changes waiting for a free slot
+        self.in_flight = {}  # Linode ID -> (change, monotonic deadline)
+        self.held = {}  # pool id -> names of the nodes whose reboot failed or timed out
+
+    def _is_scheduled(self, linode_id):
+        return linode_id in self.in_flight or any(
+            change["linode_id"] == linode_id for queue in self.queued.values() for change in queue
+        )
+
+    def enqueue(self, changes):
+        """Records the nodes as pending and queues their reboot. Nodes already scheduled are skipped."""
+        with self.lock:
+            changes = [change for change in changes if not self._is_scheduled(change["linode_id"])]
+            if not changes:
+                return
+            mark_pending_reboots(self.pending, changes)  # Persisted before any reboot, so a crash cannot lose them
+            for change in changes:
+                self.queued.setdefault(change["pool_id"], deque()).append(change)
+        self._start_ready()
+
+    def resume(self, linode_instances):
+        """Re-checks the pending reboots (see resume_pending_reboots), releases held pools and queues the rest."""
+        with self.lock:
+            resumed = resume_pending_reboots(self.pending, linode_instances)
+            for queue in self.queued.values():
+                kept = [change for change in queue if str(change["linode_id"]) in self.pending]
+                queue.clear()
+                queue.extend(kept)
+            self.held.clear()
+        self.enqueue(resumed)
+
+    def _start_ready(self):
+        """Reboots queued nodes of every pool that is not held, up to MAX_UNAVAILABLE_PER_POOL in flight."""
+        with self.lock:
+            starting = []
+            for pool_id, queue in self.queued.items():
+                if pool_id in self.held:
+                    continue
+                busy = sum(1 for change, _ in self.in_flight.values() if change["pool_id"] == pool_id)
+                while queue and busy < MAX_UNAVAILABLE_PER_POOL:
+                    change = queue.popleft()
+                    self.in_flight[change["linode_id"]] = (change, time.monotonic() + REBOOT_TIMEOUT)
+                    starting.append(change)
+                    busy += 1
+            if starting:
+                mark_pending_reboots(self.pending, starting)  # Only reboot events from now on count
+
+        for change in starting:
+            print(f"🌊 Rebooting {change['name']} (pool {change['pool_id']})")
+            if not reboot_linode(change["linode_id"]):
+                with self.lock:
+                    self.in_flight.pop(change["linode_id"], None)
+                    self._hold(change)
+
+    def _hold(self, change):
+        self.held.setdefault(change["pool_id"], []).append(change["name"])
+        print(f"⚠️  Holding reboots of pool {change['pool_id']} until the next IPAM rebuild "
+              f"({', '.join(self.held[change['pool_id']])} did not come back).")
+
+    def poll(self):
+        """Completes finished, failed and timed-out reboots, then starts the next queued ones."""
+        with self.lock:
+            # A rebuild may have seen these finish (or the node go away) already
+            for linode_id in [linode_id for linode_id in self.in_flight if str(linode_id) not in self.pending]:
+                del self.in_flight[linode_id]
+            since = min((self.pending[str(linode_id)]["since"] for linode_id in self.in_flight), default=None)
+
+        events = []
+        if since is not None:
+            try:
+                events = get_reboot_events(datetime.strptime(since, EVENT_TIME_FORMAT))
+            except requests.RequestException as e:
+                print(f"❌ Failed to poll reboot events: {e}")
+
+        with self.lock:
+            for event in events:
+                linode_id = (event.get("entity") or {}).get("id")
+                entry = self.pending.get(str(linode_id))
+                if linode_id not in self.in_flight or not entry or event.get("created", "") < entry["since"]:
+                    continue
+                change, _ = self.in_flight[linode_id]
+                if event.get("status") == "finished":
+                    del self.in_flight[linode_id]
+                    del self.pending[str(linode_id)]
+                    print(f"🟢 {change['name']} finished rebooting")
+                elif event.get("status") == "failed":
+                    del self.in_flight[linode_id]
+                    print(f"❌ Reboot failed for {change['name']}")
+                    self._hold(change)
+            now = time.monotonic()
+            for linode_id, (change, deadline) in list(self.in_flight.items()):
+                if now >= deadline:
+                    del self.in_flight[linode_id]
+                    print(f"❌ Reboot of {change['name']} did not finish within {REBOOT_TIMEOUT}s")
+                    self._hold(change)
+            save_pending_reboots(self.pending)
+        self._start_ready()
+
+    def run(self):
+        """Polls the in-flight reboots every EVENT_POLL_INTERVAL seconds. Runs on a daemon thread."""
+        while True:
+            time.sleep(EVENT_POLL_INTERVAL)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"❌ Reboot scheduler poll failed: {e}")
+
+def build_allocator(configs_by_linode):
+    """
+    Builds the VLAN IP allocator from the IPs already assigned in the given configs.
+    Args:
+        configs_by_linode (dict): Configuration profiles keyed by Linode ID.
+    Returns:
+        IPv4Allocator: Allocator for VLAN_CIDR with the gateway and used IPs taken.
+    """
+    used_ips = get_used_vlan_ips(configs_by_linode, TARGET_VLAN_ID)
+    allocator = IPv4Allocator(VLAN_CIDR, reserved=[VLAN_GATEWAY])
+    for ip in used_ips:
+        allocator.mark_used(ip)
+    return allocator
+
+def ensure_node_vlan(name, linode, allocator, scheduler, pool_id):
+    """
+    Attaches the VLAN to the Linode backing a single (new) node unless it already has it, and queues its reboot.
+    Args:
+        name (str): Name of the Kubernetes node.
+        linode (dict): Linode instance backing the node.
+        allocator (IPv4Allocator): VLAN IP allocator.
+        scheduler (PoolRebootScheduler): Per-pool reboot scheduler of the watch.
+        pool_id (str): LKE pool of the node.
+    Returns:
+        bool: True if the node has the VLAN now (or already had it), False if it should be retried.
+    """
+    linode_id = linode["id"]
+    print(f"\n🔧 Checking node {name} (Linode ID: {linode_id})")
+
+    configs = get_linode_configs(linode_id)
+    if not configs:
+        print(f"❌ No configs found for Linode {linode_id}")
+        return False
+
+    config = configs[0]  # use first config (assumed active)
+    config_id = config["id"]
+
+    if has_vlan_already(config, TARGET_VLAN_ID):
+        print(f"✅ VLAN already configured for node {name}. Skipping.")
+        return True
+
+    return update_config_with_vlan_and_ipam(linode_id, config_id, config, allocator, scheduler, name, pool_id)
+
+def match_cluster_nodes(nodes, instances_by_label):
+    """
+    Matches LKE worker nodes to the Linode instances backing them.
+    Args:
+        nodes (list): Kubernetes node objects.
+        instances_by_label (dict): Linode instances keyed by label.
+    Returns:
+        list: (node name, Linode instance, pool id) tuples for nodes in an LKE pool.
+    """
+    cluster_nodes = []
+    for node in nodes:
+        name = node.get("metadata", {}).get("name", "")
+        labels = node.get("metadata", {}).get("labels", {})
+        pool_id = labels.get("lke.linode.com/pool-id")
+
+        if not pool_id:
+            print(f"⚠️  Node {name} is not part of an LKE pool. Skipping.")
+            continue
+
+        linode = find_linode_by_node_name(name, instances_by_label)
+        if not linode:
+            print(f"❌ No Linode instance found for node {name}")
+            continue
+
+        cluster_nodes.append((name, linode, pool_id))
+    return cluster_nodes
+
+def scan_cluster_configs(cluster_nodes, linode_instances):
+    """
+    Fetches configs for the instances in VLAN_IP_SCAN_SCOPE concurrently.
+    Args:
+        cluster_nodes (list): (node name, Linode instance, pool id) tuples from match_cluster_nodes.
+        linode_instances (list): Every Linode instance in the account.
+    Returns:
+        dict: Configuration profiles keyed by Linode ID, or None if any instance's configs could not
+        be fetched (its VLAN IPs would be unknown and could be handed out twice).
+    """
+    scan = select_instances_to_scan([linode for _, linode, _ in cluster_nodes], linode_instances)
+    print(f"🔍 Fetching configs for {len(scan)} of {len(linode_instances)} Linode instances...")
+    configs_by_linode = get_configs_concurrently(linode["id"] for linode in scan)
+    failed = [str(linode_id) for linode_id, configs in configs_by_linode.items() if configs is None]
+    if failed:
+        print(f"❌ Could not read configs for Linode(s) {', '.join(failed)}; their VLAN IPs are unknown.")
+        return None
+    return configs_by_linode
 
 def main():
     """
     Main function to orchestrate VLAN attachment for LKE worker nodes.
     Fetches nodes, matches them to Linode instances, checks for existing VLANs,
-    assigns new IPs, updates configurations, and reboots instances as needed.
+    assigns new IPs, updates all configurations concurrently, and then reboots
+    the updated instances in waves bounded per LKE pool.
     """
     print("🔍 Fetching Kubernetes nodes...")
     nodes = get_all_nodes()
@@ -198,42 +912,209 @@ def main():
 
     print("🔍 Fetching Linode instances...")
     linode_instances = get_all_linode_instances()
+    if linode_instances is None:
+        print("❌ Linode instance listing incomplete. Aborting.")
+        return
     if not linode_instances:
         print("No Linode instances retrieved.")
         return
 
-    used_ips = get_used_vlan_ips(linode_instances, TARGET_VLAN_ID)
-
-    for node in nodes:
-        name = node.get("metadata", {}).get("name", "")
-        labels = node.get("metadata", {}).get("labels", {})
-        pool_id = labels.get("lke.linode.com/pool-id")
-
-        if not pool_id:
-            print(f"⚠️  Node {name} is not part of an LKE pool. Skipping.")
-            continue
+    pending = load_pending_reboots()
+    resumed = resume_pending_reboots(pending, linode_instances)
 
-        linode = find_linode_by_node_name(name, linode_instances)
-        if not linode:
-            print(f"❌ No Linode instance found for node {name}")
-            continue
+    cluster_nodes = match_cluster_nodes(nodes, index_linodes_by_label(linode_instances))
+    configs_by_linode = scan_cluster_configs(cluster_nodes, linode_instances)
+    if configs_by_linode is None:
+        print("❌ Aborting before allocating any VLAN IP.")
+        if resumed:
+            reboot_in_waves(resumed, pending)
+        return
+    allocator = build_allocator(configs_by_linode)
 
+    changes = []
+    for name, linode, pool_id in cluster_nodes:
         linode_id = linode["id"]
         print(f"\n🔧 Checking node {name} (Linode ID: {linode_id})")
 
-        configs = get_linode_configs(linode_id)
+        configs = configs_by_linode.get(linode_id)
         if not configs:
             print(f"❌ No configs found for Linode {linode_id}")
             continue
 
         config = configs[0]  # use first config (assumed active)
-        config_id = config["id"]
-
         if has_vlan_already(config, TARGET_VLAN_ID):
             print(f"✅ VLAN already configured for node {name}. Skipping.")
             continue
 
-        update_config_with_vlan_and_ipam(linode_id, config_id, config, used_ips)
+        ipam_ip, body = prepare_vlan_config(config, allocator)
+        changes.append({"name": name, "linode_id": linode_id, "config_id": config["id"],
+                        "pool_id": pool_id, "ipam_ip": ipam_ip, "body": body})
+
+    applied = []
+    if changes:
+        print(f"\n📝 Updating {len(changes)} config(s) concurrently...")
+        applied = apply_vlan_changes(changes, allocator)
+        mark_pending_reboots(pending, applied)  # Persisted before any reboot, so a crash cannot lose them
+    if applied or resumed:
+        reboot_in_waves(applied + resumed, pending)
+
+def warm_allocator(scheduler):
+    """
+    Builds the IPAM allocator from a full scan of the cluster's current nodes, and queues the pending
+    nodes whose reboot has not been seen finishing on the reboot scheduler.
+    Args:
+        scheduler (PoolRebootScheduler): Per-pool reboot scheduler of the watch.
+    Returns:
+        IPv4Allocator: Allocator for VLAN_CIDR with the gateway and used IPs taken, or None if the
+        instance listing or config scan failed.
+    """
+    linode_instances = get_all_linode_instances()
+    if linode_instances is None:
+        return None
+    scheduler.resume(linode_instances)
+    cluster_nodes = match_cluster_nodes(get_all_nodes(), index_linodes_by_label(linode_instances))
+    configs_by_linode = scan_cluster_configs(cluster_nodes, linode_instances)
+    if configs_by_linode is None:
+        return None
+    return build_allocator(configs_by_linode)
+
+def iter_node_events_api():
+    """
+    Streams node events from the Kubernetes API with the kubernetes client.
+    Lists once, then watches from the list's resourceVersion and resumes each watch from the last
+    resourceVersion seen (bookmarks included). Only a 410 Gone forces a new list.
+    Yields:
+        tuple: (event_type, node) where node is the raw node object as a dict.
+    """
+    k8s_config.load_kube_config(config_file=KUBECONFIG or None)
+    core = k8s_client.CoreV1Api()
+    resource_version = None
+
+    while True:
+        try:
+            if resource_version is None:
+                node_list = core.list_node(_preload_content=False)
+                node_list = json.loads(node_list.data)
+                resource_version = node_list["metadata"]["resourceVersion"]
+                for node in node_list.get("items", []):
+                    yield "ADDED", node
+
+            stream = k8s_watch.Watch().stream(
+                core.list_node,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=WATCH_TIMEOUT,
+            )
+            for event in stream:
+                node = event["raw_object"]
+                resource_version = node.get("metadata", {}).get("resourceVersion", resource_version)
+                if event["type"] == "ERROR":
+                    if node.get("code") == 410:
+                        print("⚠️  Watch resourceVersion expired. Re-listing nodes.")
+                        resource_version = None
+                    break
+                if event["type"] != "BOOKMARK":
+                    yield event["type"], node
+        except ApiException as e:
+            if e.status == 410:
+                resource_version = None
+                continue
+            print(f"❌ Node watch failed: {e.status} {e.reason}. Reconnecting in {WATCH_RETRY_DELAY}s...")
+            time.sleep(WATCH_RETRY_DELAY)
+        except Exception as e:
+            print(f"❌ Node watch failed: {e}. Reconnecting in {WATCH_RETRY_DELAY}s...")
+            time.sleep(WATCH_RETRY_DELAY)
+
+def iter_node_events_kubectl():
+    """
+    Streams node events from `kubectl get nodes --watch --output-watch-events -o json`.
+    kubectl prints one pretty-printed JSON event at a time; an event is complete when a line
+    closes the top-level object. kubectl relists on every (re)start, which replays ADDED events
+    for existing nodes; the caller skips nodes it has already handled.
+    Yields:
+        tuple: (event_type, node) where node is the node object as a dict.
+    """
+    cmd = [
+        "kubectl", "--kubeconfig", KUBECONFIG,
+        "get", "nodes", "--watch", "--output-watch-events", "-o", "json"
+    ]
+    while True:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        buffer = []
+        try:
+            for line in proc.stdout:
+                buffer.append(line)
+                if not line.startswith("}"):
+                    continue
+                event = json.loads("".join(buffer))
+                buffer = []
+                yield event.get("type"), event.get("object", {})
+        finally:
+            proc.kill()
+            proc.wait()
+        print(f"⚠️  kubectl watch exited ({proc.returncode}). Restarting in {WATCH_RETRY_DELAY}s...")
+        time.sleep(WATCH_RETRY_DELAY)
+
+def watch_nodes():
+    """
+    Long-running controller: attaches the VLAN to nodes as they join the cluster.
+    The Linode listing and config scan run once to warm the IPAM allocator, which is then reused
+    for every node (and rebuilt every IPAM_RESYNC_INTERVAL). Each new node costs one filtered
+    instance lookup, one config fetch and the update itself. Reboots go through a PoolRebootScheduler,
+    so the ADDED events replayed for every node on start cannot take a whole pool down.
+    """
+    scheduler = PoolRebootScheduler(load_pending_reboots())
+    threading.Thread(target=scheduler.run, daemon=True).start()
+
+    print("🔍 Warming IPAM cache from Linode instances...")
+    allocator = warm_allocator(scheduler)
+    while allocator is None:
+        print(f"❌ Could not warm IPAM cache. Retrying in {WATCH_RETRY_DELAY}s...")
+        time.sleep(WATCH_RETRY_DELAY)
+        allocator = warm_allocator(scheduler)
+    allocator_built = time.time()
+    handled_nodes = set()
+
+    events = iter_node_events_api() if k8s_client is not None else iter_node_events_kubectl()
+    print("👀 Watching Kubernetes nodes...")
+    for event_type, node in events:
+        name = node.get("metadata", {}).get("name", "")
+        labels = node.get("metadata", {}).get("labels", {})
+
+        if event_type == "DELETED":
+            handled_nodes.discard(name)
+            continue
+        if event_type not in ("ADDED", "MODIFIED") or name in handled_nodes:
+            continue
+        if not labels.get("lke.linode.com/pool-id"):
+            continue  # Not an LKE worker (yet); MODIFIED events will bring it back once labelled
+
+        if time.time() - allocator_built >= IPAM_RESYNC_INTERVAL:
+            print("🔄 Rebuilding IPAM cache...")
+            rebuilt = warm_allocator(scheduler)
+            if rebuilt is None:
+                # The current allocator still holds every IP seen or handed out so far
+                print("⚠️  IPAM rebuild failed. Keeping the current cache and retrying on the next event.")
+            else:
+                allocator = rebuilt
+                allocator_built = time.time()
+
+        linode = get_linode_by_label(name)
+        if not linode:
+            print(f"❌ No Linode instance found for node {name}. Will retry on its next update.")
+            continue
+
+        # Failed attempts stay unhandled and are retried on the node's next MODIFIED event
+        if ensure_node_vlan(name, linode, allocator, scheduler, labels["lke.linode.com/pool-id"]):
+            handled_nodes.add(name)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Attach a VLAN with IPAM addresses to LKE worker nodes")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and attach the VLAN to nodes as soon as they join the cluster")
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_nodes()
+    else:
+        main()
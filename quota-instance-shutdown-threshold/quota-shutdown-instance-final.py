@@ -1,5 +1,13 @@
+import argparse
+import calendar
+import heapq
+import json
 import requests
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 # Your Linode API token
 API_TOKEN = ""
@@ -8,6 +16,7 @@ API_TOKEN = ""
 BASE_URL = "https://api.linode.com/v4"
 LINODES_URL = f"{BASE_URL}/linode/instances"
 ACCOUNT_SETTINGS_URL = f"{BASE_URL}/account/settings"
+ACCOUNT_TRANSFER_URL = f"{BASE_URL}/account/transfer"
 
 # remove the addtional transfer allowance for Object storage, if customer enable object storage in their account.
 OBJECT_STORAGE_QUOTA_REDUCTION = 1000  # GB
@@ -15,6 +24,24 @@ OBJECT_STORAGE_QUOTA_REDUCTION = 1000  # GB
 # Threshold percentage (e.g., 90% of the network quota)
 THRESHOLD_PERCENTAGE = 90 # percentage
 
+# Instance listing: page size and optional server-side X-Filter (e.g. {"region": "us-east"} or {"tags": "production"}).
+# The API has no "does not start with" operator, so the 'lke' label exclusion is applied as pages stream in.
+PAGE_SIZE = 500
+LINODE_LIST_FILTER = {}
+
+# Daemon mode (--daemon): check each instance again based on its forecast time to the threshold
+MIN_CHECK_INTERVAL = 60          # seconds, for instances close to the threshold
+MAX_CHECK_INTERVAL = 4 * 3600    # seconds, for idle instances
+FIRST_RECHECK_INTERVAL = 600     # seconds, second sample needed before a rate can be estimated
+FORECAST_SAFETY_FACTOR = 0.5     # re-check after this fraction of the forecast time to threshold
+SAMPLES_PER_INSTANCE = 6         # recent (time, used) samples kept for the rate estimate
+LIST_REFRESH_INTERVAL = 900      # seconds between instance listings (new/deleted/offline instances)
+
+# Pool mode (--pool): keep the projected end-of-month account transfer under THRESHOLD_PERCENTAGE of the pool
+POOL_MAX_WORKERS = 8             # concurrent /transfer requests when per-instance usage is needed
+RATE_LIMIT_REQUESTS = 800        # Linode API rate limit: 800 requests per 2 minutes
+RATE_LIMIT_PERIOD = 120          # seconds
+
 headers = {
     "Authorization": f"Bearer {API_TOKEN}",
     "Content-Type": "application/json",
@@ -22,25 +49,38 @@ headers = {
 
 #function to retrieve all linode instances in their account
 """ def get_all_linode_ids():
-    response = requests.get(LINODES_URL, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    linode_ids = [linode['id'] for linode in data['data']]
-    return linode_ids """
+    return [linode['id'] for linode in iter_linodes()] """
 
-#function to retrieve all linode instance in their account by excluding LKE worker node
-def get_all_linode_ids_without_lke():
-    response = requests.get(LINODES_URL, headers=headers)
-    response.raise_for_status()
-    data = response.json()
+#Generator over every linode instance: page_size=500, next page prefetched while the current one is processed
+def iter_linodes(x_filter=None):
+    # Stable ordering so instances don't shift between pages while we paginate
+    request_headers = dict(headers)
+    request_headers["X-Filter"] = json.dumps({"+order_by": "id", "+order": "asc", **(x_filter or {})})
+
+    def fetch_page(page):
+        response = requests.get(LINODES_URL, headers=request_headers, params={"page": page, "page_size": PAGE_SIZE})
+        response.raise_for_status()
+        return response.json()
 
-    # Filter out instances whose label starts with 'lke'
-    linode_ids = [
-        linode['id'] for linode in data['data'] 
-        if not linode['label'].startswith('lke')
-    ]
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        data = fetch_page(1)
+        pages = data.get('pages', 1)
+        for page in range(1, pages + 1):
+            next_page = prefetcher.submit(fetch_page, page + 1) if page < pages else None
+            yield from data['data']
+            if next_page is not None:
+                data = next_page.result()
 
-    return linode_ids
+#Generator over instances that are not LKE worker nodes
+def iter_linodes_without_lke():
+    for linode in iter_linodes(LINODE_LIST_FILTER):
+        # Filter out instances whose label starts with 'lke'
+        if not linode['label'].startswith('lke'):
+            yield linode
+
+#function to retrieve all linode instance in their account by excluding LKE worker node
+def get_all_linode_ids_without_lke():
+    return [linode['id'] for linode in iter_linodes_without_lke()]
 
 #function to retrieve the linode instance detail
 def get_instance_details(linode_id):
@@ -125,5 +165,248 @@ def main():
     except requests.exceptions.RequestException as e:
         print(f"Failed to retrieve Linode IDs: {e}")
 
+#Per-instance transfer samples and time-to-threshold forecast
+class TransferForecaster:
+    def __init__(self, threshold_percentage):
+        self.threshold_percentage = threshold_percentage
+        self.samples = {}  # linode_id -> deque of (timestamp, used GB)
+
+    def record(self, linode_id, used, now):
+        history = self.samples.setdefault(linode_id, deque(maxlen=SAMPLES_PER_INSTANCE))
+        if history and used < history[-1][1]:
+            history.clear()  # Usage dropped: a new billing cycle started
+        history.append((now, used))
+
+    def forget(self, linode_id):
+        self.samples.pop(linode_id, None)
+
+    def rate(self, linode_id):
+        """Transfer rate in GB/s over the kept samples, or None with fewer than two samples."""
+        history = self.samples.get(linode_id)
+        if not history or len(history) < 2:
+            return None
+        (first_time, first_used), (last_time, last_used) = history[0], history[-1]
+        if last_time <= first_time:
+            return None
+        return max(0.0, (last_used - first_used) / (last_time - first_time))
+
+    def next_check_delay(self, linode_id, quota, used):
+        """Seconds until this instance should be checked again."""
+        rate = self.rate(linode_id)
+        if rate is None:
+            return FIRST_RECHECK_INTERVAL
+        remaining = quota * self.threshold_percentage / 100 - used
+        if remaining <= 0:
+            return MIN_CHECK_INTERVAL
+        if rate == 0:
+            return MAX_CHECK_INTERVAL
+        delay = remaining / rate * FORECAST_SAFETY_FACTOR
+        return min(MAX_CHECK_INTERVAL, max(MIN_CHECK_INTERVAL, delay))
+
+#function to list non-LKE instances that are not offline (status comes from the listing)
+def get_online_linode_ids_without_lke():
+    return {linode['id'] for linode in iter_linodes_without_lke() if linode['status'] != 'offline'}
+
+#Long-running mode: heap of (next check time, linode id) ordered by forecast time to threshold
+def run_daemon():
+    forecaster = TransferForecaster(THRESHOLD_PERCENTAGE)
+    schedule = []          # heap of (due time, linode_id)
+    next_check = {}        # linode_id -> due time of its live heap entry (older entries are stale)
+    known_online = set()
+    object_storage_enabled = False
+    next_listing = 0
+
+    def schedule_check(linode_id, due_time):
+        next_check[linode_id] = due_time
+        heapq.heappush(schedule, (due_time, linode_id))
+
+    while True:
+        now = time.time()
+
+        # Refresh the inventory and Object Storage setting now and then
+        if now >= next_listing:
+            try:
+                object_storage_enabled = check_object_storage_enabled()
+                online = get_online_linode_ids_without_lke()
+                for linode_id in online - known_online:
+                    schedule_check(linode_id, now)
+                for linode_id in known_online - online:
+                    forecaster.forget(linode_id)
+                    next_check.pop(linode_id, None)
+                known_online = online
+                print(f"Inventory refreshed: {len(online)} online instances. Object Storage enabled: {object_storage_enabled}")
+            except requests.exceptions.RequestException as e:
+                print(f"Failed to retrieve Linode IDs: {e}")
+            next_listing = now + LIST_REFRESH_INTERVAL
+
+        while schedule and schedule[0][0] <= time.time():
+            due_time, linode_id = heapq.heappop(schedule)
+            if linode_id not in known_online or next_check.get(linode_id) != due_time:
+                continue  # Stale entry
+
+            try:
+                network_quota, network_used = get_instance_network_usage(linode_id, object_storage_enabled)
+                checked_at = time.time()
+                forecaster.record(linode_id, network_used, checked_at)
+                usage_percentage = (network_used / network_quota) * 100
+                print(f"Linode ID {linode_id}: {usage_percentage:.2f}% of the quota used.")
+
+                if usage_percentage >= THRESHOLD_PERCENTAGE:
+                    print(f"Network usage has reached {THRESHOLD_PERCENTAGE}% of the quota. Shutting down Linode.")
+                    shutdown_response = shutdown_linode(linode_id)
+                    print(f"Shutdown initiated:", shutdown_response, "\n")
+                    # Offline now; the inventory refresh re-adds it if it is powered on again
+                    known_online.discard(linode_id)
+                    forecaster.forget(linode_id)
+                    next_check.pop(linode_id, None)
+                    continue
+
+                delay = forecaster.next_check_delay(linode_id, network_quota, network_used)
+                print(f"Next check for Linode ID {linode_id} in {delay:.0f} seconds.")
+                schedule_check(linode_id, checked_at + delay)
+            except (KeyError, ZeroDivisionError, requests.exceptions.RequestException) as e:
+                # ZeroDivisionError: the quota is 0 (new instance, or fully used by the Object Storage deduction)
+                print(f"Check failed for Linode ID {linode_id}: {e}")
+                schedule_check(linode_id, time.time() + MIN_CHECK_INTERVAL)
+
+            # Rate limiting: sleep for 0.15 seconds to stay within the rate limit of 800 requests per 2 minutes
+            time.sleep(0.15)
+
+        next_due = schedule[0][0] if schedule else next_listing
+        time.sleep(max(1, min(next_due, next_listing) - time.time()))
+
+#Thread-safe sliding-window rate limiter for the pool mode workers
+class RateLimiter:
+    def __init__(self, max_requests, period):
+        self.max_requests = max_requests
+        self.period = period
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.period:
+                    self.timestamps.popleft()
+                if len(self.timestamps) < self.max_requests:
+                    self.timestamps.append(now)
+                    return
+                wait_time = self.period - (now - self.timestamps[0])
+            time.sleep(wait_time)
+
+#function to retrieve the account-wide (pooled) transfer usage and quota in GB
+def get_account_transfer():
+    response = requests.get(ACCOUNT_TRANSFER_URL, headers=headers)
+    response.raise_for_status()
+    data = response.json()
+    return data['quota'], data['used'], data.get('billable', 0)
+
+#function to compute how far through the billing month we are (Linode bills per calendar month, UTC)
+def month_progress(now=None):
+    now = now or datetime.now(timezone.utc)
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_seconds = calendar.monthrange(now.year, now.month)[1] * 86400
+    elapsed = max((now - month_start).total_seconds(), 1)
+    return elapsed, month_seconds - elapsed
+
+#function to project end-of-month usage from the month-to-date rate
+def project_usage(used, elapsed, remaining):
+    return used + used / elapsed * remaining
+
+#function to choose the fewest instances whose shutdown keeps the projected pool usage under target
+def select_instances_to_stop(instance_usage, overage, elapsed, remaining):
+    """
+    instance_usage: list of (linode_id, used GB this month).
+    Stopping an instance saves its projected usage for the rest of the month, so the
+    biggest projected consumers are taken first until the projected overage is covered.
+    """
+    projected_savings = sorted(
+        ((used / elapsed * remaining, linode_id) for linode_id, used in instance_usage),
+        reverse=True
+    )
+    selected = []
+    saved = 0.0
+    for savings, linode_id in projected_savings:
+        if saved >= overage or savings <= 0:
+            break
+        selected.append((linode_id, savings))
+        saved += savings
+    return selected, saved
+
+#Pool mode: one account call, per-instance calls only when the pool is projected to overrun
+def run_pool_enforcement(dry_run=False):
+    try:
+        pool_quota, pool_used, billable = get_account_transfer()
+    except (KeyError, requests.exceptions.RequestException) as e:
+        print(f"Failed to retrieve account transfer: {e}")
+        return
+
+    elapsed, remaining = month_progress()
+    projected = project_usage(pool_used, elapsed, remaining)
+    target = pool_quota * THRESHOLD_PERCENTAGE / 100
+    print(f"Account transfer pool: {pool_used:.2f} GB used of {pool_quota} GB (billable: {billable} GB).")
+    print(f"Projected end-of-month usage: {projected:.2f} GB, target: {target:.2f} GB ({THRESHOLD_PERCENTAGE}%).")
+
+    if projected <= target:
+        print("Projected pool usage is below target, no action needed.")
+        return
+
+    overage = projected - target
+    print(f"Projected overage of {overage:.2f} GB, collecting per-instance usage...")
+
+    try:
+        online_ids = get_online_linode_ids_without_lke()
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to retrieve Linode IDs: {e}")
+        return
+
+    rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+
+    def fetch_usage(linode_id):
+        rate_limiter.acquire()
+        _, network_used = get_instance_network_usage(linode_id, False)
+        return linode_id, network_used
+
+    instance_usage = []
+    with ThreadPoolExecutor(max_workers=POOL_MAX_WORKERS) as executor:
+        for future in [executor.submit(fetch_usage, linode_id) for linode_id in online_ids]:
+            try:
+                instance_usage.append(future.result())
+            except (KeyError, requests.exceptions.RequestException) as e:
+                print(f"Failed to retrieve usage: {e}")
+
+    selected, saved = select_instances_to_stop(instance_usage, overage, elapsed, remaining)
+    if saved < overage:
+        print(f"Warning: stopping every eligible instance only saves {saved:.2f} GB of the {overage:.2f} GB overage.")
+
+    for linode_id, savings in selected:
+        print(f"Linode ID {linode_id} is projected to use {savings:.2f} GB more this month.")
+        if dry_run:
+            print("Dry run, not shutting down.\n")
+            continue
+        try:
+            rate_limiter.acquire()
+            shutdown_response = shutdown_linode(linode_id)
+            print(f"Shutdown initiated:", shutdown_response, "\n")
+        except requests.exceptions.RequestException as e:
+            print(f"HTTP Request failed for Linode ID {linode_id}: {e}")
+
+    print(f"Selected {len(selected)} of {len(instance_usage)} instances, projected savings {saved:.2f} GB.")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Shut down non-LKE Linode instances that reach THRESHOLD_PERCENTAGE of their transfer quota.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and schedule each instance's next check from its transfer rate")
+    parser.add_argument("--pool", action="store_true",
+                        help="enforce against the pooled account transfer quota instead of per-instance quotas")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --pool, only report which instances would be shut down")
+    args = parser.parse_args()
+
+    if args.pool:
+        run_pool_enforcement(args.dry_run)
+    elif args.daemon:
+        run_daemon()
+    else:
+        main()
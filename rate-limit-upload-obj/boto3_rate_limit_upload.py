@@ -2,7 +2,11 @@ import os
 import threading
 import time
 import queue
+import argparse
+import tempfile
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
 
 # Configuration
 ACCESS_KEY = '' #enter your object storage access key
@@ -11,71 +15,192 @@ ENDPOINT_URL = 'https://jp-osa-1.linodeobjects.com'
 RPS = 300  # Request per second limit
 NUM_WORKERS = 10  # Number of worker threads to handle uploads
 SECONDS = 1  # Rate limiting period
+BURST = 20  # Requests that may go out back to back after an idle spell
+AIMD_DECREASE = 0.5  # Multiply the rate by this on a 503 SlowDown / 429
+AIMD_INCREASE = 10  # Requests per second won back per second of throttle-free uploads
+MIN_RATE_FRACTION = 0.05  # Never back off below this fraction of RPS
+THROTTLE_COOLDOWN = 1  # Seconds; throttles within this window count as one decrease
+MAX_UPLOAD_RETRIES = 5  # Times a throttled or transiently failed file is put back on the queue
 OUTPUT_DIR = 'output_files'  # Directory where files are stored
 BUCKET_NAME = 'testing-bucket-project'  # Name of your S3 bucket
 S3_DIRECTORY = 'new_code/'  # Directory within the bucket to upload files
 
+# Error codes Object Storage uses when it wants us to slow down
+THROTTLE_CODES = {'SlowDown', 'ServiceUnavailable', 'TooManyRequests', 'RequestLimitExceeded', '503', '429'}
+# Error codes of server-side failures that are worth another attempt
+TRANSIENT_CODES = {'InternalError', 'RequestTimeout', 'BadGateway', 'GatewayTimeout', '500', '502', '504'}
+
+# Upload results
+UPLOADED, THROTTLED, RETRY, FAILED = 'uploaded', 'throttled', 'retry', 'failed'
+
+# Function to create the S3 client shared by all worker threads
+def create_s3_client(endpoint_url=None):
+    # boto3 clients are thread-safe; one client keeps one connection pool with a
+    # keep-alive connection per worker instead of a new TLS handshake per file
+    return boto3.client('s3',
+            endpoint_url=endpoint_url or ENDPOINT_URL,
+            aws_access_key_id=ACCESS_KEY,
+            aws_secret_access_key=SECRET_KEY,
+            # No botocore retries: throttled and transiently failed uploads go back to the queue
+            # (see worker), so throttles reach the rate limiter instead of being retried behind its back
+            config=Config(max_pool_connections=NUM_WORKERS, tcp_keepalive=True,
+                          retries={'mode': 'standard', 'total_max_attempts': 1}))
+
+# Function to tell a SlowDown/429 apart from other upload errors
+def is_throttle_error(e):
+    if isinstance(e, ClientError):
+        error = e.response.get('Error', {})
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return error.get('Code') in THROTTLE_CODES or status in (429, 503)
+    # upload_file wraps the ClientError in S3UploadFailedError, which only keeps the message
+    return any(f"({code})" in str(e) for code in THROTTLE_CODES)
+
+# Function to tell a 5xx or connection error (worth retrying) apart from permanent upload errors
+def is_transient_error(e):
+    if isinstance(e, (ConnectionError, HTTPClientError)):
+        return True  # Connection refused/reset, timeouts
+    if isinstance(e, ClientError):
+        error = e.response.get('Error', {})
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return error.get('Code') in TRANSIENT_CODES or status >= 500
+    return any(f"({code})" in str(e) for code in TRANSIENT_CODES)
+
 # Function to upload file to S3
-def upload_file(file_path, s3_key):
+def upload_file(file_path, s3_key, s3_client=None):
     try:
-        s3_client = boto3.client('s3',
-                endpoint_url=ENDPOINT_URL,
-                aws_access_key_id=ACCESS_KEY,
-                aws_secret_access_key=SECRET_KEY)
+        if s3_client is None:
+            # Old behaviour (one client per file), only kept for benchmark comparisons
+            s3_client = create_s3_client()
         s3_client.upload_file(file_path, BUCKET_NAME, s3_key)
         print(f"Uploaded {file_path} to s3://{BUCKET_NAME}/{s3_key}")
+        return UPLOADED
     except Exception as e:
+        if is_throttle_error(e):
+            return THROTTLED
+        if is_transient_error(e):
+            print(f"Upload of {file_path} failed, will retry: {e}")
+            return RETRY
         print(f"Failed to upload {file_path}: {e}")
+        return FAILED
+
+# Upload counters shared by the worker threads
+class UploadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.throttled = 0
+        self.retried = 0
+
+    def record(self, size, result):
+        with self.lock:
+            if result == UPLOADED:
+                self.files += 1
+                self.bytes += size
+            elif result == THROTTLED:
+                self.throttled += 1
+            elif result == RETRY:
+                self.retried += 1
+            else:
+                self.failed += 1
 
 # Worker function for threads
-def worker(upload_queue, rate_limiter):
+def worker(upload_queue, rate_limiter, s3_client, stats):
     while True:
         item = upload_queue.get()
         if item is None:
             break
-        file_path, s3_path = item
+        file_path, s3_path, attempt = item
         rate_limiter()
-        upload_file(file_path, s3_path)
+        result = upload_file(file_path, s3_path, s3_client)
+        if result == THROTTLED:
+            rate_limiter.on_throttle()
+        if result in (THROTTLED, RETRY):
+            if attempt < MAX_UPLOAD_RETRIES:
+                # Put it back before task_done so upload_queue.join() keeps waiting for it
+                upload_queue.put((file_path, s3_path, attempt + 1))
+            else:
+                reason = "throttled" if result == THROTTLED else "failing"
+                print(f"Failed to upload {file_path}: still {reason} after {attempt + 1} attempts")
+                result = FAILED
+        elif result == UPLOADED:
+            rate_limiter.on_success()
+        stats.record(os.path.getsize(file_path), result)
         upload_queue.task_done()
 
-# Rate limiter function
-def create_rate_limiter(tps, period):
-    interval = period / tps
-    last_called = [time.time()]
+# Rate limiter: token bucket shared by all worker threads
+# Tokens refill at the current rate up to `burst`, so idle workers can start a short burst
+# instead of being spaced out at a fixed interval. The rate adapts AIMD style: a SlowDown/429
+# halves it (AIMD_DECREASE), and every throttle-free upload adds it back a little so it gains
+# about AIMD_INCREASE requests per second each second, up to the configured limit.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.lock = threading.Lock()
+        self.max_rate = rate
+        self.min_rate = rate * MIN_RATE_FRACTION
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.last_decrease = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-    def rate_limiter():
-        elapsed = time.time() - last_called[0]
-        wait_time = interval - elapsed
-        if wait_time > 0:
+    def __call__(self):
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            # Sleep outside the lock so the other workers can keep taking tokens
             time.sleep(wait_time)
-        last_called[0] = time.time()
 
-    return rate_limiter
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            # Workers usually hit SlowDown together; count one decrease per cooldown
+            if now - self.last_decrease < THROTTLE_COOLDOWN:
+                return
+            self._refill(now)
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * AIMD_DECREASE)
+            self.tokens = 0  # Drop the saved burst, it is what got us throttled
+            print(f"Throttled by Object Storage, lowering rate to {self.rate:.2f} requests/s")
 
-# Main function to set up the queue and workers
-def main():
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + AIMD_INCREASE / self.rate)
+
+def create_rate_limiter(rps, period, burst=None):
+    return TokenBucket(rps / period, burst or BURST)
+
+# Function to upload every file of a directory with the worker threads
+def upload_directory(directory, s3_directory, s3_client):
     upload_queue = queue.Queue()
     rate_limiter = create_rate_limiter(RPS, SECONDS)
-
-    # Ensure the output directory exists
-    if not os.path.exists(OUTPUT_DIR):
-        print(f"Output directory '{OUTPUT_DIR}' does not exist.")
-        return
+    stats = UploadStats()
 
     # Start worker threads
     threads = []
     for _ in range(NUM_WORKERS):
-        t = threading.Thread(target=worker, args=(upload_queue, rate_limiter))
+        t = threading.Thread(target=worker, args=(upload_queue, rate_limiter, s3_client, stats))
         t.start()
         threads.append(t)
 
     # Traverse the directory and upload all files
-    for root, _, files in os.walk(OUTPUT_DIR):
+    for root, _, files in os.walk(directory):
         for filename in files:
             file_path = os.path.join(root, filename)
-            s3_key = os.path.relpath(file_path, OUTPUT_DIR)
-            s3_key = os.path.join(S3_DIRECTORY, s3_key)
-            upload_queue.put((file_path, s3_key))
+            s3_key = os.path.relpath(file_path, directory)
+            s3_key = os.path.join(s3_directory, s3_key)
+            upload_queue.put((file_path, s3_key, 0))
 
     # Wait for all tasks to be done
     upload_queue.join()
@@ -85,6 +210,56 @@ def main():
         upload_queue.put(None)
     for t in threads:
         t.join()
+    return stats
+
+# Main function to set up the queue and workers
+def main():
+    # Ensure the output directory exists
+    if not os.path.exists(OUTPUT_DIR):
+        print(f"Output directory '{OUTPUT_DIR}' does not exist.")
+        return
+
+    upload_directory(OUTPUT_DIR, S3_DIRECTORY, create_s3_client())
+
+# Benchmark: upload generated files and report files/s and MB/s
+def run_benchmark(endpoint_url, file_count, size_kb, per_file_client):
+    global ENDPOINT_URL
+    s3_client = create_s3_client(endpoint_url)
+    try:
+        s3_client.head_bucket(Bucket=BUCKET_NAME)
+    except Exception:
+        s3_client.create_bucket(Bucket=BUCKET_NAME)  # Fresh local S3 stand-in (e.g. MinIO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(file_count):
+            with open(os.path.join(directory, f"bench-{i:06d}.bin"), "wb") as f:
+                f.write(os.urandom(size_kb * 1024))
+
+        if per_file_client:
+            # Reproduce the old behaviour by letting upload_file build a client per file
+            ENDPOINT_URL = endpoint_url
+            s3_client = None
+        started = time.perf_counter()
+        stats = upload_directory(directory, os.path.join(S3_DIRECTORY, 'benchmark/'), s3_client)
+        elapsed = time.perf_counter() - started
+
+    mode = "client per file" if per_file_client else f"shared client, {NUM_WORKERS} pooled connections"
+    print(f"\nBenchmark ({mode}): {stats.files} file(s) of {size_kb} KB in {elapsed:.2f}s, "
+          f"{stats.failed} failed, {stats.throttled} throttled, {stats.retried} retried")
+    print(f"  {stats.files / elapsed:.1f} files/s, {stats.bytes / elapsed / (1024 * 1024):.2f} MB/s")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Rate limited upload of OUTPUT_DIR to Object Storage")
+    parser.add_argument("--benchmark", action="store_true", help="Upload generated files and report files/s and MB/s")
+    parser.add_argument("--endpoint-url", default=ENDPOINT_URL,
+                        help="S3 endpoint for the benchmark, e.g. a local MinIO at http://127.0.0.1:9000")
+    parser.add_argument("--files", type=int, default=500, help="Number of files to upload in the benchmark")
+    parser.add_argument("--size-kb", type=int, default=16, help="Size of each benchmark file in KB")
+    parser.add_argument("--per-file-client", action="store_true",
+                        help="Benchmark the old one-client-per-file behaviour for comparison")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.endpoint_url, args.files, args.size_kb, args.per_file_client)
+    else:
+        main()
@@ -3,21 +3,40 @@ import threading
 import time
 import queue
 import subprocess
+import re
 
 # Configuration
 RPS = 1  # Transactions per second limit
 NUM_WORKERS = 2  # Number of worker threads to handle uploads
 SECONDS = 1  # Rate limiting period
+BURST = 2  # Requests that may go out back to back after an idle spell
+AIMD_DECREASE = 0.5  # Multiply the rate by this on a 503 SlowDown / 429
+AIMD_INCREASE = 0.1  # Requests per second won back per second of throttle-free uploads
+MIN_RATE_FRACTION = 0.05  # Never back off below this fraction of RPS
+THROTTLE_COOLDOWN = 1  # Seconds; throttles within this window count as one decrease
+MAX_THROTTLE_RETRIES = 5  # Times a throttled file is put back on the queue
 OUTPUT_DIR = 'output_files'  # Directory where files are stored
 BUCKET_NAME = 'testing-bucket-project/test4'
 
+# What s3cmd prints when Object Storage wants us to slow down, e.g. "S3 error: 503 (SlowDown): ..."
+# Only the status followed by its error code counts, so file names or sizes containing 503/429 do not
+THROTTLE_PATTERN = re.compile(r"\b(?:503|429) \(\w+\)|\((?:SlowDown|TooManyRequests)\)")
+
+# Upload results
+UPLOADED, THROTTLED, FAILED = 'uploaded', 'throttled', 'failed'
+
 # Function to execute s3cmd put
 def upload_file(file_path, s3_path):
     try:
         result = subprocess.run(['s3cmd', 'put', file_path, s3_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         print(f"Uploaded {file_path} to {s3_path}: {result.stdout}")
+        return UPLOADED
     except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors='replace')
+        if THROTTLE_PATTERN.search(stderr):
+            return THROTTLED
         print(f"Failed to upload {file_path}: {e.stderr}")
+        return FAILED
 
 # Worker function for threads
 def worker(upload_queue, rate_limiter):
@@ -25,24 +44,71 @@ def worker(upload_queue, rate_limiter):
         item = upload_queue.get()
         if item is None:
             break
-        file_path, s3_path = item
+        file_path, s3_path, attempt = item
         rate_limiter()
-        upload_file(file_path, s3_path)
+        result = upload_file(file_path, s3_path)
+        if result == THROTTLED:
+            rate_limiter.on_throttle()
+            if attempt < MAX_THROTTLE_RETRIES:
+                # Put it back before task_done so upload_queue.join() keeps waiting for it
+                upload_queue.put((file_path, s3_path, attempt + 1))
+            else:
+                print(f"Failed to upload {file_path}: still throttled after {attempt + 1} attempts")
+        elif result == UPLOADED:
+            rate_limiter.on_success()
         upload_queue.task_done()
 
-# Rate limiter function
-def create_rate_limiter(rps, period):
-    interval = period / rps
-    last_called = [time.time()]
+# Rate limiter: token bucket shared by all worker threads
+# Tokens refill at the current rate up to `burst`, so idle workers can start a short burst
+# instead of being spaced out at a fixed interval. The rate adapts AIMD style: a SlowDown/429
+# halves it (AIMD_DECREASE), and every throttle-free upload adds it back a little so it gains
+# about AIMD_INCREASE requests per second each second, up to the configured limit.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.lock = threading.Lock()
+        self.max_rate = rate
+        self.min_rate = rate * MIN_RATE_FRACTION
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.last_decrease = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-    def rate_limiter():
-        elapsed = time.time() - last_called[0]
-        wait_time = interval - elapsed
-        if wait_time > 0:
+    def __call__(self):
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            # Sleep outside the lock so the other workers can keep taking tokens
             time.sleep(wait_time)
-        last_called[0] = time.time()
 
-    return rate_limiter
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            # Workers usually hit SlowDown together; count one decrease per cooldown
+            if now - self.last_decrease < THROTTLE_COOLDOWN:
+                return
+            self._refill(now)
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * AIMD_DECREASE)
+            self.tokens = 0  # Drop the saved burst, it is what got us throttled
+            print(f"Throttled by Object Storage, lowering rate to {self.rate:.2f} requests/s")
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + AIMD_INCREASE / self.rate)
+
+def create_rate_limiter(rps, period, burst=None):
+    return TokenBucket(rps / period, burst or BURST)
 
 # Main function to set up the queue and workers
 def main():
@@ -66,10 +132,10 @@ def main():
         for filename in files:
             file_path = os.path.join(root, filename)
             s3_path = f's3://{BUCKET_NAME}/{os.path.relpath(file_path, OUTPUT_DIR)}'
-            upload_queue.put((file_path, s3_path))
+            upload_queue.put((file_path, s3_path, 0))
 
         if os.path.exists(file_path):
-            upload_queue.put((file_path, s3_path))
+            upload_queue.put((file_path, s3_path, 0))
         else:
             print(f"File {file_path} does not exist. Skipping.")
 
@@ -1,10 +1,34 @@
 import subprocess
 import json
 import os
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    # Needed for the single-snapshot API mode; without it the script falls back to the kubectl functions
+    from kubernetes import client as k8s_client, config as k8s_config, watch as k8s_watch
+    from kubernetes.client.rest import ApiException
+except ImportError:
+    k8s_client = None
 
 # Set Kubernetes environment variables
 os.environ["KUBECONFIG"] = "falco-kubeconfig.yaml"
 
+POOL_ID_LABEL = "lke.linode.com/pool-id"
+
+# Desired taints and labels per LKE node pool id (taints as key=value:Effect, labels as key=value)
+POOL_TAINTS = {"199804": ["app=php:NoExecute"]}
+POOL_LABELS = {"207492": ["node_group=php"]}
+
+PATCH_WORKERS = 10  # Max concurrent node PATCH requests
+
+# Reconciler mode (--watch)
+WATCH_TIMEOUT = 300  # Seconds per watch request before it is resumed from the last resourceVersion
+RESYNC_INTERVAL = 600  # Seconds between full re-lists of the pool nodes, to catch anything the watch missed
+WATCH_RETRY_DELAY = 5  # Seconds to wait before reconnecting after a watch error
+
 def apply_taint_if_spec_taints_null(pool_id_matched, taint_value):
     try:
         # Run the shell command to get node information and capture its output
@@ -71,8 +95,220 @@ def apply_label_if_label_null(pool_id_matched, label_value):
     except Exception as e:
         print("An error occurred:", str(e))
 
-# Call the function to apply taints to nodes where spec.taints is null
-apply_taint_if_spec_taints_null("199804", "app=php:NoExecute")
+def parse_taint(taint_value):
+    # "key=value:Effect" (or "key:Effect") -> taint object as used in node.spec.taints
+    spec, effect = taint_value.rsplit(":", 1)
+    key, _, value = spec.partition("=")
+    taint = {"key": key, "effect": effect}
+    if value:
+        taint["value"] = value
+    return taint
+
+def parse_label(label_value):
+    key, _, value = label_value.partition("=")
+    return key, value
+
+def compute_node_patch(node):
+    """Return the PATCH body that adds the node's missing taints and labels, or None if nothing is missing."""
+    metadata = node.get("metadata", {})
+    labels = metadata.get("labels") or {}
+    pool_id = labels.get(POOL_ID_LABEL)
+    taints = node.get("spec", {}).get("taints") or []
+
+    missing_taints = [
+        taint for taint in map(parse_taint, POOL_TAINTS.get(pool_id, []))
+        if not any(existing.get("key") == taint["key"] and existing.get("effect") == taint["effect"] for existing in taints)
+    ]
+    missing_labels = {
+        key: value for key, value in map(parse_label, POOL_LABELS.get(pool_id, []))
+        if labels.get(key) is None
+    }
+    if not missing_taints and not missing_labels:
+        return None
+
+    # resourceVersion makes the PATCH fail with 409 if the node changed since it was read,
+    # so the full taints list below never overwrites a taint added in the meantime
+    patch = {"metadata": {"resourceVersion": metadata.get("resourceVersion")}}
+    if missing_taints:
+        patch["spec"] = {"taints": taints + missing_taints}
+    if missing_labels:
+        patch["metadata"]["labels"] = missing_labels
+    return patch
+
+def new_core_api():
+    # One API client whose connection pool fits every patch worker
+    k8s_config.load_kube_config(config_file=os.environ["KUBECONFIG"])
+    configuration = k8s_client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = PATCH_WORKERS
+    return k8s_client.CoreV1Api(k8s_client.ApiClient(configuration))
+
+def pool_label_selector():
+    # Only nodes of the configured pools are listed and watched
+    pool_ids = sorted(set(POOL_TAINTS) | set(POOL_LABELS))
+    return f"{POOL_ID_LABEL} in ({','.join(pool_ids)})"
+
+def list_nodes(core):
+    response = core.list_node(label_selector=pool_label_selector(), _preload_content=False)
+    return json.loads(response.data)
+
+def patch_node(core, node_name, patch):
+    """
+    PATCH one node; on a 409 conflict re-read it and retry once with a freshly computed patch.
+    Never raises: every error is logged and reported as False, so one node cannot abort a run.
+    """
+    for attempt in range(2):
+        try:
+            core.patch_node(node_name, patch)
+            return True
+        except ApiException as e:
+            if e.status != 409 or attempt:
+                print(f"Failed to patch node {node_name}: {e.status} {e.reason}")
+                return False
+        except Exception as e:
+            print(f"Failed to patch node {node_name}: {e}")
+            return False
+
+        try:
+            node = json.loads(core.read_node(node_name, _preload_content=False).data)
+        except ApiException as e:
+            # e.g. 404: the node was deleted while we were patching it
+            print(f"Failed to re-read node {node_name} after a conflict: {e.status} {e.reason}")
+            return False
+        except Exception as e:
+            print(f"Failed to re-read node {node_name} after a conflict: {e}")
+            return False
+        patch = compute_node_patch(node)
+        if patch is None:
+            return True  # Someone else already applied it
+    return False
+
+def reconcile_nodes_once(core):
+    """List the pool nodes once, PATCH their missing taints/labels, and return the list's resourceVersion."""
+    node_list = list_nodes(core)
+    reconcile_nodes(core, node_list.get("items", []))
+    return node_list["metadata"]["resourceVersion"]
+
+def reconcile_nodes(core, nodes):
+    """Compute every missing taint/label of the given nodes and PATCH them concurrently."""
+    patches = {}
+    for node in nodes:
+        node_name = node.get("metadata", {}).get("name")
+        pool_id = (node.get("metadata", {}).get("labels") or {}).get(POOL_ID_LABEL)
+        if pool_id not in POOL_TAINTS and pool_id not in POOL_LABELS:
+            continue
+        patch = compute_node_patch(node)
+        if patch is None:
+            print(f"Node {node_name} already has the desired taints and labels.")
+            continue
+        patches[node_name] = patch
+
+    print(f"Listed {len(nodes)} node(s), {len(patches)} need patching.")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=PATCH_WORKERS) as executor:
+        futures = {executor.submit(patch_node, core, node_name, patch): node_name for node_name, patch in patches.items()}
+        for future in as_completed(futures):
+            node_name = futures[future]
+            if future.result():
+                print(f"Patched node {node_name}: {summarize_patch(patches[node_name])}")
+            else:
+                failed += 1
+    if failed:
+        print(f"{failed} node(s) could not be patched.")
+
+def summarize_patch(patch):
+    changes = [f"taints {[taint['key'] + ':' + taint['effect'] for taint in patch['spec']['taints']]}"] if "spec" in patch else []
+    changes += [f"label {key}={value}" for key, value in patch["metadata"].get("labels", {}).items()]
+    return ", ".join(changes)
+
+def watch_and_reconcile(core):
+    """
+    Keep the pool nodes reconciled: nodes are patched as soon as their ADDED/MODIFIED event arrives.
+    Watches resume from the last resourceVersion seen (bookmarks included); the pool nodes are only
+    re-listed every RESYNC_INTERVAL or when the resourceVersion has expired (410 Gone).
+    """
+    executor = ThreadPoolExecutor(max_workers=PATCH_WORKERS)
+    in_flight = set()
+    in_flight_lock = threading.Lock()
+
+    def patch_and_report(node_name, patch):
+        try:
+            if patch_node(core, node_name, patch):
+                print(f"Patched node {node_name}: {summarize_patch(patch)}")
+        finally:
+            with in_flight_lock:
+                in_flight.discard(node_name)
+
+    resource_version = None
+    next_resync = 0
+    while True:
+        try:
+            if resource_version is None or time.monotonic() >= next_resync:
+                print("Resyncing pool nodes...")
+                resource_version = reconcile_nodes_once(core)
+                next_resync = time.monotonic() + RESYNC_INTERVAL
+
+            stream = k8s_watch.Watch().stream(
+                core.list_node,
+                label_selector=pool_label_selector(),
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=max(1, min(WATCH_TIMEOUT, int(next_resync - time.monotonic()))),
+            )
+            for event in stream:
+                node = event["raw_object"]
+                if event["type"] == "ERROR":
+                    if node.get("code") == 410:
+                        print("Watch resourceVersion expired, re-listing nodes.")
+                        resource_version = None
+                    break
+                resource_version = node.get("metadata", {}).get("resourceVersion", resource_version)
+                if event["type"] not in ("ADDED", "MODIFIED"):
+                    continue
+
+                patch = compute_node_patch(node)
+                node_name = node.get("metadata", {}).get("name")
+                if patch is None:
+                    continue
+                with in_flight_lock:
+                    if node_name in in_flight:
+                        continue  # A patch for this node is already running; its MODIFIED event re-checks it
+                    in_flight.add(node_name)
+                print(f"Node {node_name} ({event['type']}) needs patching.")
+                executor.submit(patch_and_report, node_name, patch)
+        except ApiException as e:
+            if e.status == 410:
+                resource_version = None
+                continue
+            print(f"Node watch failed: {e.status} {e.reason}. Reconnecting in {WATCH_RETRY_DELAY}s...")
+            time.sleep(WATCH_RETRY_DELAY)
+        except Exception as e:
+            print(f"Node watch failed: {e}. Reconnecting in {WATCH_RETRY_DELAY}s...")
+            time.sleep(WATCH_RETRY_DELAY)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply taints and labels to LKE node pools")
+    parser.add_argument("--kubectl", action="store_true",
+                        help="Use the original kubectl-based functions instead of the Kubernetes API")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and taint/label new pool nodes as soon as they register")
+    args = parser.parse_args()
+
+    if args.watch:
+        if k8s_client is None:
+            raise SystemExit("--watch requires the kubernetes client (pip install kubernetes)")
+        watch_and_reconcile(new_core_api())
+
+    elif args.kubectl or k8s_client is None:
+        if not args.kubectl:
+            print("kubernetes client not installed (pip install kubernetes); falling back to kubectl.")
+        # Call the function to apply taints to nodes where spec.taints is null
+        for pool_id, taint_values in POOL_TAINTS.items():
+            for taint_value in taint_values:
+                apply_taint_if_spec_taints_null(pool_id, taint_value)
 
-# Call the function to apply labels to nodes where spec.labels.node_group is null
-apply_label_if_label_null("207492","node_group=php")
+        # Call the function to apply labels to nodes where spec.labels.node_group is null
+        for pool_id, label_values in POOL_LABELS.items():
+            for label_value in label_values:
+                apply_label_if_label_null(pool_id, label_value)
+    else:
+        reconcile_nodes_once(new_core_api())